@@ -0,0 +1,193 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from dotenv import load_dotenv
+
+from backup_script import BACKUP_DIR, create_snapshot, replace_directory
+from db.session import PiiSessionLocal, KeySessionLocal
+from db.key_db import FieldKey, UserKEK, PIIFingerprint
+from db.pii_db import User, CATEGORY_MODEL_MAP
+
+load_dotenv()
+
+# --- Configuration ---
+CHANGELOG_DIR = os.path.join(BACKUP_DIR, "changelog")
+SNAPSHOT_DIR = os.path.join(BACKUP_DIR, "snapshot")
+CHECKPOINT_PATH = os.path.join(CHANGELOG_DIR, "checkpoint.json")
+FULL_SNAPSHOT_EVERY_SEGMENTS = int(os.getenv("FULL_SNAPSHOT_EVERY_SEGMENTS", 500))
+FULL_SNAPSHOT_INTERVAL_HOURS = float(os.getenv("FULL_SNAPSHOT_INTERVAL_HOURS", 24))
+
+# --- Row (de)serialisation ---
+def serialize_row(row) -> dict:
+    data = {}
+    for column in row.__table__.columns:
+        value = getattr(row, column.name)
+        if isinstance(value, (bytes, bytearray)):
+            value = {"b64": base64.b64encode(value).decode("ascii")}
+        elif isinstance(value, datetime):
+            value = {"ts": value.isoformat()}
+        data[column.name] = value
+    return data
+
+def deserialize_row(data: dict) -> dict:
+    values = {}
+    for name, value in data.items():
+        if isinstance(value, dict) and "b64" in value:
+            value = base64.b64decode(value["b64"])
+        elif isinstance(value, dict) and "ts" in value:
+            value = datetime.fromisoformat(value["ts"])
+        values[name] = value
+    return values
+
+# --- Checkpoint handling ---
+def load_checkpoint() -> dict:
+    if not os.path.exists(CHECKPOINT_PATH):
+        return {"snapshot_at": None, "next_segment": 1, "segments_since_snapshot": 0}
+    with open(CHECKPOINT_PATH, "r") as f:
+        return json.load(f)
+
+def save_checkpoint(checkpoint: dict):
+    temp_path = f"{CHECKPOINT_PATH}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, CHECKPOINT_PATH)
+
+def segment_path(seq: int) -> str:
+    return os.path.join(CHANGELOG_DIR, f"segment-{seq:08d}.jsonl.gz")
+
+def list_segments():
+    """Returns (seq, path) for every segment on disk, in replay order."""
+    if not os.path.isdir(CHANGELOG_DIR):
+        return []
+    segments = []
+    for name in os.listdir(CHANGELOG_DIR):
+        if name.startswith("segment-") and name.endswith(".jsonl.gz"):
+            segments.append((int(name[len("segment-"):-len(".jsonl.gz")]), os.path.join(CHANGELOG_DIR, name)))
+    return sorted(segments)
+
+# --- Capturing changed rows ---
+def capture_changes(changes) -> list:
+    """
+    Reads the current state of every changed (user_id, category) pair. A category
+    of None means the whole user changed (e.g. account deletion). Each record is
+    a full replacement of that slice, so replaying it is idempotent. The users row
+    and the user's wrapped KEK go into every record: category rows reference the
+    user, every DEK of hierarchy version 2 is wrapped under the KEK, and a record
+    may be the first one to mention a user registered after the snapshot.
+    """
+    records = []
+    pii_db, key_db = PiiSessionLocal(), KeySessionLocal()
+    try:
+        for user_id, category in sorted(changes, key=lambda c: (c[0], c[1] or "")):
+            categories = [category] if category else list(CATEGORY_MODEL_MAP)
+            key_query = key_db.query(FieldKey).filter(FieldKey.user_id == user_id)
+            fingerprint_query = key_db.query(PIIFingerprint).filter(PIIFingerprint.user_id == user_id)
+            if category:
+                key_query = key_query.filter(FieldKey.category == category)
+                fingerprint_query = fingerprint_query.filter(PIIFingerprint.category == category)
+            user = pii_db.query(User).filter(User.id == user_id).first()
+            user_kek = key_db.query(UserKEK).filter(UserKEK.user_id == user_id).first()
+            record = {
+                "type": "category_state" if category else "user_state",
+                "user_id": user_id,
+                "category": category,
+                "user": serialize_row(user) if user else None,
+                "user_kek": serialize_row(user_kek) if user_kek else None,
+                "field_keys": [serialize_row(key) for key in key_query.all()],
+                "fingerprints": [serialize_row(fingerprint) for fingerprint in fingerprint_query.all()],
+                "pii_rows": {},
+            }
+            for name in categories:
+                PiiModel = CATEGORY_MODEL_MAP[name]
+                pii_row = pii_db.query(PiiModel).filter(PiiModel.user_id == user_id).first()
+                record["pii_rows"][name] = serialize_row(pii_row) if pii_row else None
+            records.append(record)
+    finally:
+        pii_db.close()
+        key_db.close()
+    return records
+
+def write_segment(seq: int, records: list) -> str:
+    """Writes records as a gzip'd JSON-lines segment with a SHA-256 footer over the body."""
+    os.makedirs(CHANGELOG_DIR, exist_ok=True)
+    path = segment_path(seq)
+    digest = hashlib.sha256()
+    temp_path = f"{path}.tmp"
+    with gzip.open(temp_path, "wb") as f:
+        for record in records:
+            line = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+            digest.update(line)
+            f.write(line)
+        footer = {"type": "footer", "seq": seq, "records": len(records), "sha256": digest.hexdigest()}
+        f.write(json.dumps(footer, separators=(",", ":")).encode("utf-8") + b"\n")
+    os.replace(temp_path, path)
+    return path
+
+def read_segment(path: str) -> list:
+    """Reads a segment, raising ValueError if the checksum or record count do not match."""
+    digest = hashlib.sha256()
+    records, footer = [], None
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("type") == "footer":
+                footer = record
+                break
+            digest.update(line)
+            records.append(record)
+    if footer is None:
+        raise ValueError(f"Segment {path} is truncated (no footer).")
+    if footer["sha256"] != digest.hexdigest() or footer["records"] != len(records):
+        raise ValueError(f"Segment {path} failed checksum verification.")
+    return records
+
+# --- Snapshots ---
+def snapshot_due(checkpoint: dict) -> bool:
+    if not checkpoint.get("snapshot_at") or not os.path.isdir(SNAPSHOT_DIR):
+        return True
+    if checkpoint["segments_since_snapshot"] >= FULL_SNAPSHOT_EVERY_SEGMENTS:
+        return True
+    age = datetime.utcnow() - datetime.fromisoformat(checkpoint["snapshot_at"])
+    return age.total_seconds() >= FULL_SNAPSHOT_INTERVAL_HOURS * 3600
+
+def take_full_snapshot(checkpoint: dict) -> bool:
+    """Replaces the snapshot directory with a fresh per-database dump and drops obsolete segments."""
+    temp_dir = f"{SNAPSHOT_DIR}.tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    snapshot_at = datetime.utcnow()
+    if not create_snapshot(temp_dir):
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return False
+    replace_directory(temp_dir, SNAPSHOT_DIR)
+
+    # Every segment written so far is already contained in the new snapshot
+    for _, path in list_segments():
+        os.remove(path)
+    checkpoint.update({"snapshot_at": snapshot_at.isoformat(), "segments_since_snapshot": 0})
+    save_checkpoint(checkpoint)
+    print(f"Full snapshot completed to {SNAPSHOT_DIR}")
+    return True
+
+def run_incremental_backup(changes) -> bool:
+    """
+    Appends the changed rows as one change-log segment, or takes a full snapshot
+    when none exists or the current one is due for renewal.
+    """
+    os.makedirs(CHANGELOG_DIR, exist_ok=True)
+    checkpoint = load_checkpoint()
+    if snapshot_due(checkpoint):
+        return take_full_snapshot(checkpoint)
+    if not changes:
+        return True
+    seq = checkpoint["next_segment"]
+    records = capture_changes(changes)
+    path = write_segment(seq, records)
+    checkpoint["next_segment"] = seq + 1
+    checkpoint["segments_since_snapshot"] += 1
+    save_checkpoint(checkpoint)
+    print(f"Change-log segment {seq} written to {path} ({len(records)} records)")
+    return True
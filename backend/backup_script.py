@@ -1,5 +1,13 @@
 import subprocess
 import os
+import gzip
+import hashlib
+import json
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from dotenv import load_dotenv
 from urllib.parse import urlparse, unquote
 
@@ -11,8 +19,20 @@ load_dotenv()
 PII_DB_URL = os.getenv("PII_DATABASE_URL")
 KEY_DB_URL = os.getenv("KEY_DATABASE_URL")
 
-BACKUP_DIR = r"C:\DailyDBBackups" # Raw string to prevent path issues
-BACKUP_FILENAME = "latest_full_backup.sql"
+BACKUP_DIR = os.getenv("BACKUP_DIR", r"C:\DailyDBBackups") # Raw string to prevent path issues
+BACKUP_SET_NAME = "latest_full_backup"
+# "gzip", "zstd" (needs the optional 'zstandard' package) or "none"
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "gzip")
+BACKUP_COMPRESSION_LEVEL = int(os.getenv("BACKUP_COMPRESSION_LEVEL", 3))
+MANIFEST_FILENAME = "manifest.json"
+CHUNK_SIZE = 1024 * 1024
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_EXTENSIONS = {"gzip": ".sql.gz", "zstd": ".sql.zst", "none": ".sql"}
 
 def parse_db_url(url: str):
     """Parses a SQLAlchemy-style database URL to extract components."""
@@ -31,70 +51,214 @@ def parse_db_url(url: str):
         print(f"Error parsing database URL: {e}")
         return None
 
-def create_database_backup():
+def resolve_compression(compression: str) -> str:
+    if compression not in COMPRESSION_EXTENSIONS:
+        print(f"Unknown compression '{compression}', falling back to gzip.")
+        return "gzip"
+    if compression == "zstd" and zstandard is None:
+        print("WARN: 'zstandard' is not installed. Falling back to gzip.")
+        return "gzip"
+    return compression
+
+def open_compressed_writer(path: str, compression: str):
+    if compression == "zstd":
+        raw = open(path, "wb")
+        return zstandard.ZstdCompressor(level=BACKUP_COMPRESSION_LEVEL).stream_writer(raw, closefd=True)
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=BACKUP_COMPRESSION_LEVEL)
+    return open(path, "wb")
+
+def open_backup_reader(path: str):
+    """Opens a (possibly compressed) dump file for streaming reads, based on its extension."""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("The 'zstandard' package is required to read .zst backups.")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def dump_database(creds: dict, output_path: str, compression: str) -> dict:
     """
-    Deletes the previous backup and creates a new one for all configured databases.
+    Streams mysqldump's stdout through the compressor into output_path, without
+    ever holding the dump in memory. Returns the manifest entry for the file.
     """
+    command = [
+        "mysqldump",
+        f"--user={creds['user']}",
+        f"--password={creds['password']}",
+        f"--host={creds['host']}",
+        f"--port={creds['port']}",
+        "--single-transaction", # Good practice for consistent backups
+        creds['db_name']
+    ]
+    started = time.monotonic()
+    raw_bytes = 0
+    # stderr goes to a temp file so a chatty mysqldump can never block on a full pipe
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+        try:
+            with open_compressed_writer(output_path, compression) as out:
+                for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b""):
+                    raw_bytes += len(chunk)
+                    out.write(chunk)
+        except BaseException:
+            # A failed write (e.g. disk full) must not leave mysqldump running or a partial dump behind
+            process.kill()
+            remove_file(output_path)
+            raise
+        finally:
+            process.stdout.close()
+            process.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode(errors="replace")
+    duration = time.monotonic() - started
+
+    if process.returncode != 0:
+        remove_file(output_path)
+        raise RuntimeError(f"Backup failed for {creds['db_name']}. Error: {stderr.strip()}")
+    compressed_bytes = os.path.getsize(output_path)
+    return {
+        "database": creds['db_name'],
+        "file": os.path.basename(output_path),
+        "compression": compression,
+        "raw_bytes": raw_bytes,
+        "compressed_bytes": compressed_bytes,
+        "compression_ratio": round(raw_bytes / compressed_bytes, 2) if compressed_bytes else None,
+        "sha256": sha256_file(output_path),
+        "duration_seconds": round(duration, 3),
+        "throughput_mb_s": round(raw_bytes / 1_048_576 / duration, 2) if duration else None,
+    }
+
+def get_database_creds():
+    """Returns the parsed (pii_db, key_db) credentials, or None if either is missing."""
     pii_db_creds = parse_db_url(PII_DB_URL)
     key_db_creds = parse_db_url(KEY_DB_URL)
 
     if not pii_db_creds or not key_db_creds:
         print("Error: Database URLs are not configured correctly in the .env file.")
+        return None
+    return pii_db_creds, key_db_creds
+
+def write_backup_set(target_dir: str, compression: str = BACKUP_COMPRESSION):
+    """
+    Dumps both databases in parallel into separate compressed files inside
+    target_dir and writes a manifest with sizes, checksums and timings.
+    Returns the manifest, or None if any dump failed.
+    """
+    all_creds = get_database_creds()
+    if not all_creds:
+        return None
+    compression = resolve_compression(compression)
+    os.makedirs(target_dir, exist_ok=True)
+
+    started = time.monotonic()
+    # Both databases live on different servers, so dumping them concurrently halves the window
+    with ThreadPoolExecutor(max_workers=len(all_creds)) as pool:
+        futures = [
+            pool.submit(dump_database, creds, os.path.join(target_dir, creds['db_name'] + COMPRESSION_EXTENSIONS[compression]), compression)
+            for creds in all_creds
+        ]
+        files, success = [], True
+        for creds, future in zip(all_creds, futures):
+            try:
+                files.append(future.result())
+            except FileNotFoundError:
+                print("Error: 'mysqldump' command not found. Please ensure MySQL Client is installed and in your system's PATH.")
+                success = False
+            except Exception as e:
+                print(f"An unexpected error occurred during backup for {creds['db_name']}: {e}")
+                success = False
+    if not success:
+        return None
+
+    duration = time.monotonic() - started
+    raw_total = sum(f["raw_bytes"] for f in files)
+    disk_total = sum(f["compressed_bytes"] for f in files)
+    manifest = {
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "compression": compression,
+        "files": files,
+        "total_raw_bytes": raw_total,
+        "total_compressed_bytes": disk_total,
+        "duration_seconds": round(duration, 3),
+        "throughput_mb_s": round(raw_total / 1_048_576 / duration, 2) if duration else None,
+    }
+    with open(os.path.join(target_dir, MANIFEST_FILENAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(
+        f"Backup set written to {target_dir}: {raw_total / 1_048_576:.1f} MiB dumped, "
+        f"{disk_total / 1_048_576:.1f} MiB on disk, {manifest['duration_seconds']}s "
+        f"({manifest['throughput_mb_s']} MiB/s)"
+    )
+    return manifest
+
+def load_manifest(backup_dir: str):
+    manifest_path = os.path.join(backup_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+def verify_backup_set(backup_dir: str) -> bool:
+    """Checks every file in a backup set against the SHA-256 recorded in its manifest."""
+    manifest = load_manifest(backup_dir)
+    if not manifest:
         return False
+    return all(sha256_file(os.path.join(backup_dir, f["file"])) == f["sha256"] for f in manifest["files"])
 
-    # Since both databases are on different servers, we must back them up separately
-    # and append them to the same file.
+def replace_directory(temp_dir: str, final_dir: str):
+    """Swaps a completed temp directory into place, removing the previous one afterwards."""
+    old_dir = f"{final_dir}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(final_dir):
+        os.replace(final_dir, old_dir)
+    os.replace(temp_dir, final_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
 
+def create_database_backup():
+    """
+    Creates a new backup set for all configured databases. The set is written to
+    a temporary directory and only swapped in once every dump has completed, so
+    the last good backup is never deleted first.
+    """
     if not os.path.exists(BACKUP_DIR):
         print(f"Backup directory not found. Creating {BACKUP_DIR}...")
         os.makedirs(BACKUP_DIR)
 
-    latest_backup_path = os.path.join(BACKUP_DIR, BACKUP_FILENAME)
-    if os.path.exists(latest_backup_path):
-        try:
-            os.remove(latest_backup_path)
-            print(f"Previous backup file deleted: {latest_backup_path}")
-        except OSError as e:
-            print(f"Error deleting previous backup file: {e}")
+    latest_backup_path = os.path.join(BACKUP_DIR, BACKUP_SET_NAME)
+    temp_backup_path = f"{latest_backup_path}.{os.getpid()}.tmp"
+    shutil.rmtree(temp_backup_path, ignore_errors=True)
 
     print(f"Starting new backup to {latest_backup_path}...")
-    success = True
-    
-    # Backup each database
-    for creds in [pii_db_creds, key_db_creds]:
-        try:
-            command = [
-                "mysqldump",
-                f"--user={creds['user']}",
-                f"--password={creds['password']}",
-                f"--host={creds['host']}",
-                f"--port={creds['port']}",
-                "--single-transaction", # Good practice for consistent backups
-                creds['db_name']
-            ]
-
-            # Use 'a' to append the second DB backup to the same file
-            with open(latest_backup_path, "a") as f:
-                process = subprocess.Popen(
-                    command, stdout=f, stderr=subprocess.PIPE, text=True
-                )
-                _, stderr = process.communicate()
-                
-                if process.returncode != 0:
-                    print(f"Backup failed for {creds['db_name']}. Error: {stderr.strip()}")
-                    success = False
-
-        except FileNotFoundError:
-            print("Error: 'mysqldump' command not found. Please ensure MySQL Client is installed and in your system's PATH.")
-            return False
-        except Exception as e:
-            print(f"An unexpected error occurred during backup for {creds['db_name']}: {e}")
-            return False
-
-    if success:
+    if write_backup_set(temp_backup_path):
+        replace_directory(temp_backup_path, latest_backup_path)
         print(f"New backup completed successfully to {latest_backup_path}")
-    
-    return success
+        return True
+
+    print(f"Backup failed; keeping the previous backup at {latest_backup_path}")
+    shutil.rmtree(temp_backup_path, ignore_errors=True)
+    return False
+
+def create_snapshot(target_dir: str) -> bool:
+    """
+    Dumps each database into its own compressed file inside target_dir, so a
+    snapshot can be restored to each server independently.
+    """
+    return write_backup_set(target_dir) is not None
 
 # This block allows you to run the script directly for testing.
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+"""
+Throughput benchmark for field encryption: per-call seal_value/decrypt_field
+against the batch seal_values/decrypt_fields API.
+
+Fields are spread over --deks distinct keys (medium-sensitivity fields of a
+category share one), which is what lets the batch path reuse cipher contexts.
+--processes also runs the batch path with a process pool of that size.
+
+    python benchmarks/crypto_batch.py --fields 200000 --value-size 32 --deks 1000 --processes 4
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import crypto_service
+from services.crypto_service import generate_dek, seal_value, seal_values, decrypt_field, decrypt_fields
+
+def report(name, fields, payload_bytes, elapsed):
+    print(f"{name:<32} {fields / elapsed:12,.0f} fields/s   {payload_bytes / elapsed / 1e6:9.1f} MB/s")
+
+def run(args):
+    deks = [bytearray(generate_dek()) for _ in range(args.deks)]
+    value = "x" * args.value_size
+    items = [(deks[i % args.deks], i, i // 25, "field", value) for i in range(args.fields)]
+    payload_bytes = args.fields * args.value_size
+    print(f"fields={args.fields} value_size={args.value_size} deks={args.deks}\n")
+
+    started = time.perf_counter()
+    envelopes = [seal_value(plaintext, dek, key_id, user_id, field_name) for dek, key_id, user_id, field_name, plaintext in items]
+    report("seal_value (per call)", args.fields, payload_bytes, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    batch_envelopes = seal_values(items)
+    report("seal_values (batch)", args.fields, payload_bytes, time.perf_counter() - started)
+
+    opened = [(dek, key_id, user_id, field_name, envelope) for (dek, key_id, user_id, field_name, _), envelope in zip(items, envelopes)]
+    started = time.perf_counter()
+    plaintexts = [decrypt_field(stored, dek, key_id, user_id, field_name) for dek, key_id, user_id, field_name, stored in opened]
+    report("decrypt_field (per call)", args.fields, payload_bytes, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    batch_plaintexts = decrypt_fields(opened)
+    report("decrypt_fields (batch)", args.fields, payload_bytes, time.perf_counter() - started)
+    assert plaintexts == batch_plaintexts == [value] * args.fields, "round trip mismatch"
+    assert decrypt_fields((dek, key_id, user_id, field_name, stored) for (dek, key_id, user_id, field_name, _), stored in zip(items, batch_envelopes)) == plaintexts
+
+    if args.processes:
+        crypto_service.CRYPTO_PROCESS_WORKERS = args.processes
+        crypto_service.CRYPTO_PROCESS_MIN_BATCH = 0
+        seal_values(items[:args.processes])  # Start the pool outside the timed runs
+        started = time.perf_counter()
+        seal_values(items)
+        report(f"seal_values ({args.processes} processes)", args.fields, payload_bytes, time.perf_counter() - started)
+        started = time.perf_counter()
+        assert decrypt_fields(opened) == plaintexts
+        report(f"decrypt_fields ({args.processes} processes)", args.fields, payload_bytes, time.perf_counter() - started)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-call vs batch AES-GCM throughput")
+    parser.add_argument("--fields", type=int, default=200000)
+    parser.add_argument("--value-size", type=int, default=32, help="Plaintext bytes per field")
+    parser.add_argument("--deks", type=int, default=1000, help="Distinct DEKs the fields are spread over")
+    parser.add_argument("--processes", type=int, default=0, help="Also time the batch API with this many worker processes")
+    run(parser.parse_args())
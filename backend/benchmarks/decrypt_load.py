@@ -0,0 +1,64 @@
+"""
+Load benchmark for POST /api/vault/decrypt.
+
+Fires concurrent decrypt requests at a running backend and reports latency
+percentiles, so event-loop stalls (slow KMS, blocking DB calls) show up as p99.
+
+    python benchmarks/decrypt_load.py --token <JWT> --category "Basic Identifiers" --field fullname
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def run(args):
+    url = f"{args.base_url.rstrip('/')}/api/vault/decrypt"
+    headers = {"Authorization": f"Bearer {args.token}"}
+    payload = {"category": args.category, "field_name": args.field}
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=args.concurrency, pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def one_request(_):
+        start = time.perf_counter()
+        response = session.post(url, json=payload, headers=headers, timeout=args.timeout)
+        return time.perf_counter() - start, response.status_code
+
+    # Warm up connections (and the DEK cache) before measuring
+    for _ in range(min(args.concurrency, args.requests)):
+        one_request(None)
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        samples = list(pool.map(one_request, range(args.requests)))
+    wall = time.perf_counter() - wall_start
+
+    latencies = sorted(latency * 1000 for latency, _ in samples)
+    failures = sum(1 for _, code in samples if code != 200)
+    print(f"requests:    {args.requests} ({failures} non-200) at concurrency {args.concurrency}")
+    print(f"throughput:  {args.requests / wall:.1f} req/s")
+    print(f"mean:        {statistics.mean(latencies):.2f} ms")
+    for pct in (50, 90, 95, 99):
+        print(f"p{pct}:         {percentile(latencies, pct):.2f} ms")
+    print(f"max:         {latencies[-1]:.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent decrypt latency benchmark")
+    parser.add_argument("--base-url", default=os.getenv("BENCH_BASE_URL", "http://localhost:8080"))
+    parser.add_argument("--token", default=os.getenv("BENCH_TOKEN"), required=os.getenv("BENCH_TOKEN") is None)
+    parser.add_argument("--category", default="Basic Identifiers")
+    parser.add_argument("--field", default="fullname")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    run(parser.parse_args())
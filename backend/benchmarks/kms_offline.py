@@ -0,0 +1,78 @@
+"""
+Offline throughput benchmark for the vault's key and crypto path.
+
+Runs encrypt (generate + wrap + AES-GCM), cold decrypt (unwrap + AES-GCM) and
+warm decrypt (DEK cache hit) against the local KEK provider, with optional
+simulated KMS latency, so results are repeatable without Azure access.
+
+    python benchmarks/kms_offline.py --algorithm rsa-oaep --latency-ms 25 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.crypto_service import generate_dek, seal_value, decrypt_field
+from utils import key_management
+from utils.dek_cache import dek_cache
+from utils.kek_providers import LocalKEKProvider
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+async def run_phase(name, operation, items, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(item):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await operation(item)
+            latencies.append((time.perf_counter() - started) * 1000)
+            return result
+
+    wall_start = time.perf_counter()
+    results = await asyncio.gather(*(timed(item) for item in items))
+    wall = time.perf_counter() - wall_start
+    latencies.sort()
+    print(f"{name:<14} {len(items) / wall:10.1f} ops/s   p50={percentile(latencies, 50):8.3f} ms   "
+          f"p99={percentile(latencies, 99):8.3f} ms   max={latencies[-1]:8.3f} ms")
+    return results
+
+async def main(args):
+    key_management.set_kek_provider(LocalKEKProvider(args.algorithm, None, args.latency_ms, args.jitter_ms))
+    values = [f"value-{i:08d}" for i in range(args.fields)]
+
+    async def encrypt(value):
+        dek = bytearray(generate_dek())
+        wrapped = await key_management.wrap_dek_async(dek)
+        key_id = int(value[-8:])
+        return key_id, wrapped, seal_value(value, dek, key_id, 1, "field")
+
+    async def decrypt(record):
+        key_id, wrapped, envelope = record
+        dek = await key_management.unwrap_dek_cached_async(wrapped)
+        return decrypt_field(envelope, dek, key_id, 1, "field")
+
+    print(f"provider=local algorithm={args.algorithm} latency={args.latency_ms}±{args.jitter_ms} ms "
+          f"fields={args.fields} concurrency={args.concurrency}\n")
+    records = await run_phase("encrypt", encrypt, values, args.concurrency)
+    dek_cache.clear()
+    await run_phase("decrypt cold", decrypt, records, args.concurrency)
+    decrypted = await run_phase("decrypt warm", decrypt, records, args.concurrency)
+    assert decrypted == values, "round trip mismatch"
+    print(f"\nDEK cache: {dek_cache.stats()}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline KMS + AES-GCM throughput benchmark")
+    parser.add_argument("--algorithm", choices=["rsa-oaep", "aes-kw"], default="rsa-oaep")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated KMS round trip")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--fields", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
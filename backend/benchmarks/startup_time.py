@@ -0,0 +1,56 @@
+"""
+Import-time benchmark for the application module.
+
+Imports `main` in fresh interpreters (so nothing is cached between runs),
+reports the median wall time and the slowest modules from -X importtime, and
+exits non-zero when the median exceeds the budget. Importing must not touch
+the network or the databases, so this runs fully offline.
+
+    python benchmarks/startup_time.py --runs 5 --budget-ms 1500
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print((time.perf_counter() - t) * 1000)"
+
+def import_once(env) -> float:
+    result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def slowest_imports(env, top: int):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative_us), int(self_us), name))
+    return sorted(rows, reverse=True)[:top]
+
+def run(args):
+    env = dict(os.environ)
+    # A remote KMS must never be contacted at import; the local provider keeps the run hermetic either way
+    env.setdefault("KMS_PROVIDER", "local")
+    timings = [import_once(env) for _ in range(args.runs)]
+    median = statistics.median(timings)
+    print(f"import main: median {median:.1f} ms, min {min(timings):.1f} ms, max {max(timings):.1f} ms over {args.runs} runs\n")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name in slowest_imports(env, args.top):
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+    if median > args.budget_ms:
+        print(f"\nFAIL: median import time {median:.1f} ms exceeds the {args.budget_ms:.0f} ms budget")
+        sys.exit(1)
+    print(f"\nOK: within the {args.budget_ms:.0f} ms budget")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure and budget the application's import time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_IMPORT_BUDGET_MS", 1500)))
+    run(parser.parse_args())
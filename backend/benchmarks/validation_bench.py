@@ -0,0 +1,77 @@
+"""
+Micro-benchmark for PII field validation and normalisation.
+
+Compares the previous per-value path (re.sub/re.match on pattern strings, then
+the vault's ad-hoc normaliser) with the precompiled registry's validate_batch,
+both with a warm `re` cache and with the cache purged before every batch (as
+happens when other code churns through more than re's cache size of patterns).
+
+    python benchmarks/validation_bench.py --batch 25 --rounds 2000
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.validation import REGEX_MAP, validate_batch
+
+SAMPLES = {
+    "fullname": "Asha Raman", "dob": "1990-04-21", "phone": "98765 43210", "email": "asha.r@example.com",
+    "address": "12, Lake View Road, Chennai", "adhar": "1234 5678 9012", "passport": "P1234567",
+    "pan": "ABCDE1234F", "license": "TN01-2020123", "smartcard": "SC12345678", "professionallicence": "MED-12345",
+    "accnum": "1234567890", "creditnum": "4111 1111 1111 1111", "cvv": "123", "tax": "TAX-1234567",
+    "pension": "PEN-1234567", "tradingacc": "TRD12345", "empid": "EMP-42", "workemail": "asha@corp.example",
+    "emis": "1234567890", "umis": "UMIS123456", "health_insurance": "HI-123456789", "patientid": "PAT-1234",
+    "disability_certificate": "DC-123456789", "emergency_contact": "Ravi +91 9876543210",
+}
+
+def legacy_validate(field_name, value):
+    sanitized = re.sub(r'[<>/&"\'`]', '', value)
+    if field_name in REGEX_MAP and not re.match(REGEX_MAP[field_name], sanitized):
+        return None
+    clean = sanitized.strip()
+    if field_name in ("phone", "adhar", "creditnum"):
+        digits = re.sub(r'[\s-]', '', clean)
+        if field_name == "phone":
+            if digits.startswith('+'): return f"+{digits[1:3]}-{digits[3:]}"
+            elif len(digits) == 10: return f"+91-{digits}"
+        elif field_name == "adhar" and len(digits) == 12:
+            return f"{digits[0:4]}-{digits[4:8]}-{digits[8:12]}"
+        elif field_name == "creditnum" and len(digits) == 16:
+            return f"{digits[0:4]}-{digits[4:8]}-{digits[8:12]}-{digits[12:16]}"
+        return clean
+    if field_name == "pan":
+        return clean.upper()
+    return clean
+
+def legacy_batch(items):
+    return [(c, f, legacy_validate(f, v)) for c, f, v in items]
+
+def measure(name, fn, items, rounds, purge):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        if purge:
+            re.purge()
+        fn(items)
+    elapsed = time.perf_counter() - started
+    per_field_us = elapsed / (rounds * len(items)) * 1e6
+    print(f"{name:<34} {per_field_us:8.2f} us/field   {rounds * len(items) / elapsed:12,.0f} fields/s")
+
+def run(args):
+    fields = list(SAMPLES.items())
+    items = [("category", *fields[i % len(fields)]) for i in range(args.batch)]
+    # Same normalised output on valid input
+    assert [v for _, _, v in legacy_batch(items)] == [v for _, _, v in validate_batch(items)[0]]
+    for purge in (False, True):
+        label = "re cache purged" if purge else "warm re cache"
+        measure(f"legacy ({label})", legacy_batch, items, args.rounds, purge)
+        measure(f"validate_batch ({label})", validate_batch, items, args.rounds, purge)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validation micro-benchmark")
+    parser.add_argument("--batch", type=int, default=25, help="Fields per batch")
+    parser.add_argument("--rounds", type=int, default=2000)
+    run(parser.parse_args())
@@ -1,13 +1,23 @@
-from sqlalchemy import Column, Integer, String, Enum, LargeBinary, ForeignKey
+from sqlalchemy import Column, Integer, String, Enum, LargeBinary, ForeignKey, Index, TIMESTAMP, func
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+# FieldKey.key_version values
+KEY_VERSION_KMS = 1       # DEK wrapped directly by the KMS master KEK (legacy rows)
+KEY_VERSION_USER_KEK = 2  # DEK wrapped locally with AES-KW under the user's intermediate KEK
+
 class FieldKey(Base):
     __tablename__ = "field_keys"
+    __table_args__ = (
+        # One key row per field; the (user_id) prefix also serves per-user scans
+        Index("uq_field_keys_user_category_field", "user_id", "category", "field_name", unique=True),
+        # Shared medium-sensitivity DEK lookups per category
+        Index("ix_field_keys_user_category_sensitivity", "user_id", "category", "sensitivity"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(Integer, nullable=False)
     category = Column(String(100), nullable=False)
     field_name = Column(String(100), nullable=False)
     sensitivity = Column(Enum("medium", "high"), nullable=False)
@@ -15,3 +25,30 @@ class FieldKey(Base):
     iv = Column(LargeBinary, nullable=False)
     auth_tag = Column(LargeBinary, nullable=False)
     key_salt = Column(LargeBinary, nullable=False)
+    key_version = Column(Integer, nullable=False, default=KEY_VERSION_KMS, server_default=str(KEY_VERSION_KMS))
+
+class UserKEK(Base):
+    """Per-user intermediate KEK, stored wrapped by the KMS master KEK."""
+    __tablename__ = "user_keks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, unique=True)
+    wrapped_kek = Column(LargeBinary, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+class PIIFingerprint(Base):
+    """Keyed hash (the blind-index HMAC) of a stored PII value, for cross-account duplicate checks."""
+    __tablename__ = "pii_fingerprints"
+    __table_args__ = (
+        # One fingerprint per stored field
+        Index("uq_pii_fingerprints_user_category_field", "user_id", "category", "field_name", unique=True),
+        # The insert-time duplicate lookup
+        Index("ix_pii_fingerprints_field_fingerprint", "field_name", "fingerprint"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    category = Column(String(100), nullable=False)
+    field_name = Column(String(100), nullable=False)
+    fingerprint = Column(String(64), nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
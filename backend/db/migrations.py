@@ -0,0 +1,160 @@
+"""
+Idempotent schema migrations for existing deployments. create_all() only
+creates missing tables, so changes to existing tables are applied here.
+
+    python -m db.migrations indexes
+    python -m db.migrations key-hierarchy
+    python -m db.migrations blind-index
+    python -m db.migrations pii-fingerprints
+    python -m db.migrations envelope
+"""
+import argparse
+from collections import defaultdict
+from sqlalchemy import inspect, text, update, func
+
+from db.session import pii_engine, key_engine, PiiSessionLocal, KeySessionLocal
+from db.key_db import FieldKey, UserKEK, PIIFingerprint, KEY_VERSION_KMS
+from db.pii_db import CATEGORY_MODEL_MAP
+from services.crypto_service import parse_envelope, pack_legacy
+from utils.blind_index import BLIND_INDEX_SUFFIX
+
+# Superseded by the leading user_id column of uq_field_keys_user_category_field
+LEGACY_FIELD_KEY_INDEXES = ["ix_field_keys_user_id"]
+ENVELOPE_BATCH_SIZE = 1000
+
+class MigrationAborted(Exception):
+    """Raised when existing data must be fixed by hand before a migration can run."""
+
+def ensure_indexes(engine, table) -> list:
+    """Creates any index declared on the model's table that the database is missing."""
+    existing = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+    created = []
+    for index in sorted(table.indexes, key=lambda i: i.name):
+        if index.name not in existing:
+            print(f"Creating index {index.name} on {table.name}...")
+            index.create(bind=engine)
+            created.append(index.name)
+    return created
+
+def add_column_if_missing(engine, table_name: str, column_name: str, definition: str) -> bool:
+    if column_name in {column["name"] for column in inspect(engine).get_columns(table_name)}:
+        return False
+    print(f"Adding column {table_name}.{column_name}...")
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}"))
+    return True
+
+def find_duplicate_field_keys(engine) -> list:
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT user_id, category, field_name, COUNT(*) AS copies FROM field_keys "
+            "GROUP BY user_id, category, field_name HAVING COUNT(*) > 1"
+        )).fetchall()
+
+def migrate_indexes():
+    duplicates = find_duplicate_field_keys(key_engine)
+    if duplicates:
+        for row in duplicates:
+            print(f"Duplicate field key: user_id={row.user_id} category='{row.category}' field='{row.field_name}' ({row.copies} rows)")
+        raise MigrationAborted(f"{len(duplicates)} duplicated fields must be resolved before the unique index can be added.")
+
+    created = ensure_indexes(key_engine, FieldKey.__table__)
+    existing = {index["name"] for index in inspect(key_engine).get_indexes("field_keys")}
+    with key_engine.begin() as conn:
+        for name in LEGACY_FIELD_KEY_INDEXES:
+            if name in existing:
+                print(f"Dropping redundant index {name}...")
+                conn.execute(text(f"DROP INDEX {name} ON field_keys"))
+
+    for model in CATEGORY_MODEL_MAP.values():
+        created += ensure_indexes(pii_engine, model.__table__)
+    print(f"Index migration complete ({len(created)} created).")
+
+def migrate_key_hierarchy():
+    """Adds field_keys.key_version (existing rows stay on the KMS-only scheme) and the user_keks table."""
+    add_column_if_missing(key_engine, "field_keys", "key_version", f"INT NOT NULL DEFAULT {KEY_VERSION_KMS}")
+    UserKEK.__table__.create(bind=key_engine, checkfirst=True)
+    print("Key hierarchy migration complete.")
+
+def migrate_blind_index():
+    """Adds the <field>_bidx columns and their indexes; fill them with python -m services.blind_index_backfill."""
+    for model in CATEGORY_MODEL_MAP.values():
+        for column in model.__table__.columns:
+            if column.name.endswith(BLIND_INDEX_SUFFIX):
+                add_column_if_missing(pii_engine, model.__tablename__, column.name, f"VARCHAR({column.type.length}) NULL")
+        ensure_indexes(pii_engine, model.__table__)
+    print("Blind index migration complete.")
+
+def migrate_pii_fingerprints():
+    """Adds the pii_fingerprints table; python -m services.duplicate_detection --seed fills it from the blind indexes."""
+    PIIFingerprint.__table__.create(bind=key_engine, checkfirst=True)
+    print("PII fingerprint migration complete.")
+
+def migrate_envelope(batch_size: int = ENVELOPE_BATCH_SIZE):
+    """
+    Repacks legacy values (raw ciphertext in the PII column, IV/tag in field_keys)
+    into v1 envelopes, a batch of field keys at a time. Nothing is decrypted, so no
+    KMS access is needed, and key rows that still carry a tag are the resume point.
+    Key rotation in reencrypt mode later upgrades the values to v2 envelopes.
+    """
+    pii_db, key_db = PiiSessionLocal(), KeySessionLocal()
+    converted, last_id = 0, 0
+    try:
+        while True:
+            key_rows = key_db.query(FieldKey.id, FieldKey.user_id, FieldKey.category, FieldKey.field_name, FieldKey.iv, FieldKey.auth_tag).filter(
+                FieldKey.id > last_id, func.length(FieldKey.auth_tag) > 0).order_by(FieldKey.id).limit(batch_size).all()
+            if not key_rows:
+                break
+            last_id = key_rows[-1].id
+            rows_by_category = defaultdict(list)
+            for row in key_rows:
+                rows_by_category[row.category].append(row)
+
+            done = []
+            for category, rows in rows_by_category.items():
+                PiiModel = CATEGORY_MODEL_MAP.get(category)
+                if PiiModel is None:
+                    continue
+                pii_rows = {pii_row.user_id: pii_row for pii_row in pii_db.query(PiiModel).filter(PiiModel.user_id.in_({row.user_id for row in rows}))}
+                for row in rows:
+                    pii_row = pii_rows.get(row.user_id)
+                    stored = getattr(pii_row, row.field_name) if pii_row else None
+                    envelope = parse_envelope(stored) if stored is not None else None
+                    if stored is None or (envelope is not None and envelope[1] == row.id and envelope[2] == row.iv):
+                        # Nothing stored, or already packed by an interrupted run: only the tag needs clearing
+                        done.append(row)
+                        continue
+                    # Conditional, so a value rewritten by the vault meanwhile is left as it is
+                    result = pii_db.execute(update(PiiModel).where(PiiModel.id == pii_row.id, getattr(PiiModel, row.field_name) == stored)
+                                            .values({row.field_name: pack_legacy(stored, row.iv, row.auth_tag, row.id)}))
+                    if result.rowcount:
+                        done.append(row)
+            pii_db.commit()
+
+            for row in done:
+                key_db.execute(update(FieldKey).where(FieldKey.id == row.id, FieldKey.iv == row.iv).values(auth_tag=b""))
+            key_db.commit()
+            converted += len(done)
+            print(f"Repacked {converted} values (through field key {last_id})...")
+    finally:
+        pii_db.close()
+        key_db.close()
+    print(f"Envelope migration complete ({converted} values).")
+
+MIGRATIONS = {
+    "indexes": migrate_indexes,
+    "key-hierarchy": migrate_key_hierarchy,
+    "blind-index": migrate_blind_index,
+    "pii-fingerprints": migrate_pii_fingerprints,
+    "envelope": migrate_envelope,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema migrations to existing databases.")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    args = parser.parse_args()
+    try:
+        MIGRATIONS[args.migration]()
+    except MigrationAborted as e:
+        print(f"Migration aborted: {e}")
+        raise SystemExit(1)
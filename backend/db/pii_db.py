@@ -41,30 +41,35 @@ class LoginAttempt(Base):
 class BasicIdentifiers(Base):
     __tablename__ = "basic_identifiers"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     fullname = Column(LargeBinary, nullable=True)
     dob = Column(LargeBinary, nullable=True)
     phone = Column(LargeBinary, nullable=True)
     email = Column(LargeBinary, nullable=True)
     address = Column(LargeBinary, nullable=True)
+    # Blind indexes (HMAC of the normalized value) for exact-match lookup; see utils/blind_index.py
+    email_bidx = Column(String(64), nullable=True, index=True)
     created_at = Column(TIMESTAMP, server_default=func.now())
 
 class GovernmentIdentifiers(Base):
     __tablename__ = "government_identifiers"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     adhar = Column(LargeBinary, nullable=True)
     passport = Column(LargeBinary, nullable=True)
     pan = Column(LargeBinary, nullable=True)
     license = Column(LargeBinary, nullable=True)
     smartcard = Column(LargeBinary, nullable=True)
     professionallicence = Column(LargeBinary, nullable=True)
+    adhar_bidx = Column(String(64), nullable=True, index=True)
+    passport_bidx = Column(String(64), nullable=True, index=True)
+    pan_bidx = Column(String(64), nullable=True, index=True)
     created_at = Column(TIMESTAMP, server_default=func.now())
 
 class FinancialInfo(Base):
     __tablename__ = "financial_info"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     accnum = Column(LargeBinary, nullable=True)
     creditnum = Column(LargeBinary, nullable=True)
     cvv = Column(LargeBinary, nullable=True)
@@ -76,7 +81,7 @@ class FinancialInfo(Base):
 class EmploymentEducation(Base):
     __tablename__ = "employment_education"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     empid = Column(LargeBinary, nullable=True)
     workemail = Column(LargeBinary, nullable=True)
     emis = Column(LargeBinary, nullable=True)
@@ -86,9 +91,15 @@ class EmploymentEducation(Base):
 class HealthInsurance(Base):
     __tablename__ = "health_insurance"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     health_insurance = Column(LargeBinary, nullable=True)
     patientid = Column(LargeBinary, nullable=True)
     disability_certificate = Column(LargeBinary, nullable=True)
     emergency_contact = Column(LargeBinary, nullable=True)
     created_at = Column(TIMESTAMP, server_default=func.now())
+
+CATEGORY_MODEL_MAP = {
+    "Basic Identifiers": BasicIdentifiers, "Government Identifiers": GovernmentIdentifiers,
+    "Financial Info": FinancialInfo, "Employment Education": EmploymentEducation,
+    "Health Insurance": HealthInsurance,
+}
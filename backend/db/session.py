@@ -1,6 +1,12 @@
+import asyncio
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from urllib.parse import quote_plus
 from .pii_db import Base as PiiBase
 from .key_db import Base as KeyBase
@@ -24,12 +30,104 @@ KEY_DB_NAME = "key_storage_db"
 PII_DB_URL = f"mysql+pymysql://{MYSQL_USER}:{encoded_password}@{MYSQL_HOST}:{MYSQL_PORT}/{PII_DB_NAME}"
 KEY_DB_URL = f"mysql+pymysql://{MYSQL_USER}:{encoded_password}@{MYSQL_HOST}:{MYSQL_PORT}/{KEY_DB_NAME}"
 
-pii_engine = create_engine(PII_DB_URL)
-key_engine = create_engine(KEY_DB_URL)
+# --- Connection pool configuration ---
+# Global defaults, overridable per database with a PII_DB_ / KEY_DB_ prefix (e.g. KEY_DB_POOL_SIZE)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# Recycle well below MySQL's wait_timeout so the server never closes a pooled connection first
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Connections opened per pool at startup
+DB_POOL_PREWARM = int(os.getenv("DB_POOL_PREWARM", 5))
+
+def pool_options(prefix: str) -> dict:
+    return {
+        "pool_size": int(os.getenv(f"{prefix}_POOL_SIZE", DB_POOL_SIZE)),
+        "max_overflow": int(os.getenv(f"{prefix}_MAX_OVERFLOW", DB_MAX_OVERFLOW)),
+        "pool_timeout": float(os.getenv(f"{prefix}_POOL_TIMEOUT", DB_POOL_TIMEOUT)),
+        "pool_recycle": int(os.getenv(f"{prefix}_POOL_RECYCLE", DB_POOL_RECYCLE)),
+        "pool_pre_ping": os.getenv(f"{prefix}_POOL_PRE_PING", str(DB_POOL_PRE_PING)).lower() == "true",
+    }
+
+class PoolMetrics:
+    """Checkout wait-time counters, carried over when a pool is recreated on dispose()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float, timed_out: bool):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.wait_total / attempts * 1000, 3) if attempts else 0.0,
+                "max_wait_ms": round(self.wait_max * 1000, 3),
+            }
+
+class _TimedCheckoutMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record(time.perf_counter() - started, True)
+            raise
+        self.metrics.record(time.perf_counter() - started, False)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+class TimedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+PII_POOL_OPTIONS = pool_options("PII_DB")
+KEY_POOL_OPTIONS = pool_options("KEY_DB")
+
+pii_engine = create_engine(PII_DB_URL, poolclass=TimedQueuePool, **PII_POOL_OPTIONS)
+key_engine = create_engine(KEY_DB_URL, poolclass=TimedQueuePool, **KEY_POOL_OPTIONS)
 
 PiiSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=pii_engine)
 KeySessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=key_engine)
 
+# 4. Async engines for the vault request path (aiomysql by default, asyncmy also works)
+MYSQL_ASYNC_DRIVER = os.getenv("MYSQL_ASYNC_DRIVER", "aiomysql")
+ASYNC_PII_DB_URL = f"mysql+{MYSQL_ASYNC_DRIVER}://{MYSQL_USER}:{encoded_password}@{MYSQL_HOST}:{MYSQL_PORT}/{PII_DB_NAME}"
+ASYNC_KEY_DB_URL = f"mysql+{MYSQL_ASYNC_DRIVER}://{MYSQL_USER}:{encoded_password}@{MYSQL_HOST}:{MYSQL_PORT}/{KEY_DB_NAME}"
+
+async_pii_engine = create_async_engine(ASYNC_PII_DB_URL, poolclass=TimedAsyncQueuePool, **PII_POOL_OPTIONS)
+async_key_engine = create_async_engine(ASYNC_KEY_DB_URL, poolclass=TimedAsyncQueuePool, **KEY_POOL_OPTIONS)
+
+ENGINES = {"pii": pii_engine, "key": key_engine, "async_pii": async_pii_engine, "async_key": async_key_engine}
+
+# expire_on_commit=False so ORM attributes stay readable after commit without an implicit (sync) refresh
+AsyncPiiSessionLocal = async_sessionmaker(bind=async_pii_engine, autoflush=False, expire_on_commit=False)
+AsyncKeySessionLocal = async_sessionmaker(bind=async_key_engine, autoflush=False, expire_on_commit=False)
+
 def init_db():
     print("Initializing MySQL tables...")
     PiiBase.metadata.create_all(bind=pii_engine)
@@ -48,4 +146,60 @@ def get_key_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_pii_db():
+    async with AsyncPiiSessionLocal() as db:
+        yield db
+
+async def get_async_key_db():
+    async with AsyncKeySessionLocal() as db:
+        yield db
+
+async def dispose_async_engines():
+    await async_pii_engine.dispose()
+    await async_key_engine.dispose()
+
+def prewarm_pools(count: int = DB_POOL_PREWARM):
+    """Opens up to `count` connections per sync pool and returns them, so early requests skip connection setup."""
+    for name, engine in (("pii", pii_engine), ("key", key_engine)):
+        connections = []
+        try:
+            for _ in range(min(count, engine.pool.size())):
+                connection = engine.connect()
+                connections.append(connection)
+                connection.execute(text("SELECT 1"))
+        except Exception as e:
+            print(f"WARN: could not pre-warm the {name} connection pool: {e}")
+        finally:
+            for connection in connections:
+                connection.close()
+
+async def prewarm_async_pools(count: int = DB_POOL_PREWARM):
+    async def open_and_ping(engine):
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    for name, engine in (("async_pii", async_pii_engine), ("async_key", async_key_engine)):
+        # Concurrent connects, so each one holds its connection and the pool grows to `count`
+        results = await asyncio.gather(*(open_and_ping(engine) for _ in range(min(count, engine.pool.size()))), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            print(f"WARN: could not pre-warm the {name} connection pool: {errors[0]}")
+
+def pool_stats() -> dict:
+    stats = {}
+    for name, engine in ENGINES.items():
+        pool = engine.pool
+        stats[name] = {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": pool._max_overflow,
+            "timeout_seconds": pool.timeout(),
+            "recycle_seconds": pool._recycle,
+            "pre_ping": pool._pre_ping,
+            **pool.metrics.snapshot(),
+        }
+    return stats
@@ -1,19 +1,48 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from db.session import init_db
-from routes import auth, vault,admin
+from db.session import init_db, dispose_async_engines, prewarm_pools, prewarm_async_pools
+from utils.executor import run_blocking, shutdown_executor
+from services.backup_scheduler import backup_scheduler
+from services.login_audit import login_audit_writer
+from services.readiness import readiness, initialise_until_ready
+from utils.key_management import close_async_clients, get_kek_provider
+from utils.password_hashing import password_hasher
+from routes import auth, vault,admin, health
 
 limiter = Limiter(key_func=get_remote_address)
 app = FastAPI(title="Secure PII Service")
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+startup_tasks = []
+
+async def prepare_database():
+    await initialise_until_ready(readiness, "database", init_db)
+    await run_blocking(prewarm_pools)
+    await prewarm_async_pools()
+
 @app.on_event("startup")
-def on_startup():
-    init_db()
+async def on_startup():
+    backup_scheduler.start()
+    login_audit_writer.start()
+    # Schema checks and KMS initialisation run in the background so the port binds immediately; /readyz reports progress
+    startup_tasks.append(asyncio.create_task(prepare_database()))
+    startup_tasks.append(asyncio.create_task(initialise_until_ready(readiness, "kms", get_kek_provider)))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for task in startup_tasks:
+        task.cancel()
+    await run_blocking(backup_scheduler.stop, True)
+    await run_blocking(login_audit_writer.stop)
+    await dispose_async_engines()
+    await close_async_clients()
+    shutdown_executor()
+    password_hasher.shutdown()
 
 origins = [
     "http://localhost:5173", "http://127.0.0.1:5173",
@@ -23,8 +52,10 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=origins, allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(vault.router, prefix="/api/vault", tags=["Vault"])
-app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
\ No newline at end of file
+app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
+app.include_router(health.router, tags=["Health"])
\ No newline at end of file
@@ -0,0 +1,127 @@
+import argparse
+import os
+import shutil
+import subprocess
+
+from backup_script import CHUNK_SIZE, get_database_creds, load_manifest, open_backup_reader, verify_backup_set
+from backup_changelog import SNAPSHOT_DIR, list_segments, read_segment, deserialize_row
+from db.session import PiiSessionLocal, KeySessionLocal
+from db.key_db import FieldKey, UserKEK, PIIFingerprint
+from db.pii_db import User, CATEGORY_MODEL_MAP
+
+def load_snapshot() -> bool:
+    """Streams each database's (compressed) snapshot file into its own server with the mysql client."""
+    all_creds = get_database_creds()
+    if not all_creds:
+        return False
+    manifest = load_manifest(SNAPSHOT_DIR)
+    if not manifest or not verify_backup_set(SNAPSHOT_DIR):
+        print(f"Error: snapshot in {SNAPSHOT_DIR} is missing or failed checksum verification.")
+        return False
+    files = {f["database"]: f["file"] for f in manifest["files"]}
+    for creds in all_creds:
+        if creds['db_name'] not in files:
+            print(f"Error: snapshot has no dump for {creds['db_name']}")
+            return False
+        snapshot_path = os.path.join(SNAPSHOT_DIR, files[creds['db_name']])
+        command = [
+            "mysql",
+            f"--user={creds['user']}",
+            f"--password={creds['password']}",
+            f"--host={creds['host']}",
+            f"--port={creds['port']}",
+            creds['db_name']
+        ]
+        try:
+            with open_backup_reader(snapshot_path) as reader:
+                process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+                shutil.copyfileobj(reader, process.stdin, CHUNK_SIZE)
+                process.stdin.close()
+                stderr = process.stderr.read()
+                process.wait()
+        except FileNotFoundError:
+            print("Error: 'mysql' command not found. Please ensure MySQL Client is installed and in your system's PATH.")
+            return False
+        if process.returncode != 0:
+            print(f"Restore failed for {creds['db_name']}. Error: {stderr.decode(errors='replace').strip()}")
+            return False
+        print(f"Snapshot restored for {creds['db_name']}")
+    return True
+
+def apply_record(record: dict, pii_db, key_db):
+    """Replaces one user's (or one user/category's) rows with the state captured in the record."""
+    user_id, category = record["user_id"], record["category"]
+
+    key_query = key_db.query(FieldKey).filter(FieldKey.user_id == user_id)
+    if category:
+        key_query = key_query.filter(FieldKey.category == category)
+    key_query.delete(synchronize_session=False)
+    for row in record["field_keys"]:
+        key_db.add(FieldKey(**deserialize_row(row)))
+    # Segments written before these were captured have no entry for them; leave those rows as they are
+    if "fingerprints" in record:
+        fingerprint_query = key_db.query(PIIFingerprint).filter(PIIFingerprint.user_id == user_id)
+        if category:
+            fingerprint_query = fingerprint_query.filter(PIIFingerprint.category == category)
+        fingerprint_query.delete(synchronize_session=False)
+        for row in record["fingerprints"]:
+            key_db.add(PIIFingerprint(**deserialize_row(row)))
+    if "user_kek" in record:
+        key_db.query(UserKEK).filter(UserKEK.user_id == user_id).delete(synchronize_session=False)
+        if record["user_kek"]:
+            key_db.add(UserKEK(**deserialize_row(record["user_kek"])))
+
+    # The users row first, so the category rows' foreign key is satisfied
+    if record.get("user"):
+        pii_db.merge(User(**deserialize_row(record["user"])))
+        pii_db.flush()
+    for name, row in record["pii_rows"].items():
+        PiiModel = CATEGORY_MODEL_MAP[name]
+        pii_db.query(PiiModel).filter(PiiModel.user_id == user_id).delete(synchronize_session=False)
+        if row:
+            pii_db.add(PiiModel(**deserialize_row(row)))
+    if record["type"] == "user_state" and not record.get("user"):
+        pii_db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+
+def replay_segments(segments) -> int:
+    pii_db, key_db = PiiSessionLocal(), KeySessionLocal()
+    applied = 0
+    try:
+        for seq, path in segments:
+            for record in read_segment(path):
+                apply_record(record, pii_db, key_db)
+                applied += 1
+            key_db.commit()
+            pii_db.commit()
+            print(f"Replayed segment {seq}")
+    except Exception:
+        key_db.rollback()
+        pii_db.rollback()
+        raise
+    finally:
+        pii_db.close()
+        key_db.close()
+    return applied
+
+def main():
+    parser = argparse.ArgumentParser(description="Restore the vault databases from the snapshot plus change-log segments.")
+    parser.add_argument("--verify-only", action="store_true", help="Only verify segment checksums.")
+    parser.add_argument("--skip-snapshot", action="store_true", help="Replay segments onto the databases as they are.")
+    args = parser.parse_args()
+
+    segments = list_segments()
+    # Verify everything before touching the databases
+    for seq, path in segments:
+        read_segment(path)
+    print(f"{len(segments)} change-log segments verified.")
+    if args.verify_only:
+        return
+
+    if not args.skip_snapshot and not load_snapshot():
+        print("Restore aborted.")
+        return
+    applied = replay_segments(segments)
+    print(f"Restore finished: {applied} change records replayed.")
+
+if __name__ == "__main__":
+    main()
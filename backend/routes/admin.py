@@ -1,11 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from collections import defaultdict
+from typing import List, Dict, Any, Optional
+import json
+from pydantic import BaseModel
 
-from db.session import get_pii_db, get_key_db
-from db.pii_db import User
-from db.key_db import FieldKey
+from db.session import get_pii_db, get_key_db, PiiSessionLocal, KeySessionLocal, pool_stats
+from db.pii_db import User, CATEGORY_MODEL_MAP
+from db.key_db import FieldKey, UserKEK, PIIFingerprint
 from routes.auth import get_current_admin_user # Use the admin-specific dependency
+from utils.blind_index import BLIND_INDEX_CATEGORY, blind_index_enabled, blind_index_column, blind_index_for
+from utils.dek_cache import dek_cache
+from utils.key_hierarchy import forget_user_kek
+from utils.listing_etags import listing_etags
+from utils.principal_cache import principal_cache
+from services.backup_scheduler import backup_scheduler
+from services.key_rotation import start_rotation, stop_rotation, rotation_status
+from services.blind_index_backfill import start_backfill, stop_backfill, backfill_status
+from services.duplicate_detection import duplicate_report
+from services.classification import sensitivity_map
+from utils.logger import get_log_stats, log_pii_action
+from utils.validation import validate_and_sanitize
 
 router = APIRouter()
 
@@ -18,30 +34,42 @@ def mask_email(email: str) -> str:
     except:
         return "m***@e***.com"
 
-@router.get("/users-data", response_model=List[Dict[str, Any]])
-def get_all_users_data(
-    db: Session = Depends(get_pii_db),
-    key_db: Session = Depends(get_key_db),
-    current_admin: User = Depends(get_current_admin_user)
-):
-    all_users = db.query(User).all()
-    response_data = []
+ADMIN_PAGE_SIZE = 500
+ADMIN_MAX_PAGE_SIZE = 1000
+
+def fetch_users_page(db: Session, key_db: Session, after_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
+    """
+    Builds one keyset page of users (ordered by id, starting after after_id) with
+    their field metadata, using one users query and one grouped FieldKey query.
+    """
+    user_query = db.query(User.id, User.name, User.email, User.created_at).order_by(User.id)
+    if after_id is not None:
+        user_query = user_query.filter(User.id > after_id)
+    users = user_query.limit(limit).all()
+    if not users:
+        return []
+
+    keys_by_user = defaultdict(list)
+    for user_id, category, field_name in key_db.query(FieldKey.user_id, FieldKey.category, FieldKey.field_name).filter(
+        FieldKey.user_id.in_([user.id for user in users])
+    ).order_by(FieldKey.user_id, FieldKey.id):
+        keys_by_user[user_id].append((category, field_name))
 
-    for user in all_users:
-        all_keys = key_db.query(FieldKey).filter(FieldKey.user_id == user.id).all()
-        
+    page = []
+    for user in users:
+        all_keys = keys_by_user.get(user.id, [])
         records_by_category = {}
-        for key in all_keys:
-            if key.category not in records_by_category:
-                records_by_category[key.category] = {
-                    "type": key.category,
+        for category, field_name in all_keys:
+            if category not in records_by_category:
+                records_by_category[category] = {
+                    "type": category,
                     "fields": [],
                     "maskedData": {}
                 }
-            records_by_category[key.category]["fields"].append(key.field_name)
-            records_by_category[key.category]["maskedData"][key.field_name] = "********"
+            records_by_category[category]["fields"].append(field_name)
+            records_by_category[category]["maskedData"][field_name] = "********"
 
-        user_data = {
+        page.append({
             "id": user.id,
             "username": user.name,
             "email": mask_email(user.email),
@@ -50,15 +78,67 @@ def get_all_users_data(
             "lastActive": user.created_at.isoformat(),
             "status": "active",
             "records": list(records_by_category.values())
-        }
-        response_data.append(user_data)
+        })
+    return page
+
+@router.get("/users-data", response_model=List[Dict[str, Any]])
+def get_all_users_data(
+    response: Response,
+    cursor: Optional[int] = Query(None, description="Return users with an id greater than this cursor."),
+    limit: Optional[int] = Query(None, ge=1, le=ADMIN_MAX_PAGE_SIZE),
+    db: Session = Depends(get_pii_db),
+    key_db: Session = Depends(get_key_db),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """
+    Lists users with their field metadata. With 'limit', returns a single keyset
+    page and puts the next cursor in the X-Next-Cursor header; without it, walks
+    every page (the dashboard's original behaviour).
+    """
+    if limit is not None:
+        page = fetch_users_page(db, key_db, cursor, limit)
+        if len(page) == limit:
+            response.headers["X-Next-Cursor"] = str(page[-1]["id"])
+        return page
 
-    return response_data
+    response_data = []
+    after_id = cursor
+    while True:
+        page = fetch_users_page(db, key_db, after_id, ADMIN_PAGE_SIZE)
+        response_data.extend(page)
+        if len(page) < ADMIN_PAGE_SIZE:
+            return response_data
+        after_id = page[-1]["id"]
+
+@router.get("/users-data/export")
+def export_users_data(current_admin: User = Depends(get_current_admin_user)):
+    """Streams every user as NDJSON, one keyset page at a time, in constant memory."""
+    def generate():
+        # The stream outlives the request's dependency scope, so it manages its own sessions
+        db, key_db = PiiSessionLocal(), KeySessionLocal()
+        try:
+            after_id = None
+            while True:
+                page = fetch_users_page(db, key_db, after_id, ADMIN_PAGE_SIZE)
+                for user_data in page:
+                    yield json.dumps(user_data) + "\n"
+                if len(page) < ADMIN_PAGE_SIZE:
+                    return
+                after_id = page[-1]["id"]
+                # Drop the page's identity map so memory stays flat over 100k+ users
+                db.expunge_all()
+                key_db.expunge_all()
+        finally:
+            db.close()
+            key_db.close()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 @router.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_user(
     user_id: int,
     db: Session = Depends(get_pii_db),
+    key_db: Session = Depends(get_key_db),
     current_admin: User = Depends(get_current_admin_user)
 ):
     user_to_delete = db.query(User).filter(User.id == user_id).first()
@@ -84,5 +164,122 @@ def delete_user(
     # If checks pass, proceed with deletion
     db.delete(user_to_delete)
     db.commit()
+    # Dropping the user's intermediate KEK also makes every DEK wrapped under it unrecoverable
+    key_db.query(UserKEK).filter(UserKEK.user_id == user_id).delete(synchronize_session=False)
+    key_db.query(PIIFingerprint).filter(PIIFingerprint.user_id == user_id).delete(synchronize_session=False)
+    key_db.commit()
+    forget_user_kek(user_id)
+    listing_etags.invalidate(user_id)
+    dek_cache.flush_user(user_id)
+    principal_cache.invalidate(user_id=user_id)
+    backup_scheduler.notify(user_id)
     
     return None
+
+@router.get("/dek-cache-stats")
+def get_dek_cache_stats(current_admin: User = Depends(get_current_admin_user)):
+    """Returns hit/miss/eviction counters for the in-process DEK cache."""
+    return dek_cache.stats()
+
+@router.get("/backup-status")
+def get_backup_status(current_admin: User = Depends(get_current_admin_user)):
+    """Reports the background backup scheduler's last success time and duration."""
+    return backup_scheduler.status()
+
+@router.get("/log-stats")
+def get_logging_stats(current_admin: User = Depends(get_current_admin_user)):
+    """Reports queue depth, drops and rotations of the asynchronous JSON log pipeline."""
+    return get_log_stats()
+
+@router.get("/db-pool-stats")
+def get_db_pool_stats(current_admin: User = Depends(get_current_admin_user)):
+    """Reports checked-out/overflow connections and checkout wait times for each database pool."""
+    return pool_stats()
+
+class KeyRotationRequest(BaseModel):
+    mode: str  # "rewrap", "rewrap-keks" or "reencrypt"
+    restart: bool = False
+
+@router.post("/key-rotation", status_code=status.HTTP_202_ACCEPTED)
+def start_key_rotation(req: KeyRotationRequest, current_admin: User = Depends(get_current_admin_user)):
+    """Starts a background key rotation job; it resumes from its checkpoint unless restart is set."""
+    try:
+        start_rotation(req.mode, req.restart, on_change=backup_scheduler.notify)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return rotation_status()
+
+@router.get("/key-rotation")
+def get_key_rotation_status(current_admin: User = Depends(get_current_admin_user)):
+    """Reports progress and throughput of the current or last key rotation job."""
+    return rotation_status()
+
+@router.post("/key-rotation/stop")
+def stop_key_rotation(current_admin: User = Depends(get_current_admin_user)):
+    """Stops the running job after its current batch; starting it again resumes from the checkpoint."""
+    if not stop_rotation():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="No key rotation job is running.")
+    return rotation_status()
+
+class BlindIndexLookupRequest(BaseModel):
+    field_name: str
+    value: str
+
+@router.post("/pii-lookup")
+def lookup_pii_owners(
+    req: BlindIndexLookupRequest,
+    db: Session = Depends(get_pii_db),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Finds the users holding an exact value of a blind-indexed field, in one indexed query and without decrypting anything."""
+    category = BLIND_INDEX_CATEGORY.get(req.field_name)
+    if category is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"'{req.field_name}' has no blind index.")
+    if not blind_index_enabled():
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Blind indexing is not configured.")
+    is_valid, sanitized_value = validate_and_sanitize(req.field_name, req.value)
+    if not is_valid:
+        raise HTTPException(status_code=422, detail=f"Invalid format for '{req.field_name}'.")
+
+    PiiModel = CATEGORY_MODEL_MAP[category]
+    index_column = getattr(PiiModel, blind_index_column(req.field_name))
+    user_ids = [row.user_id for row in db.query(PiiModel.user_id).filter(index_column == blind_index_for(req.field_name, sanitized_value)).order_by(PiiModel.user_id)]
+    log_pii_action(current_admin.id, current_admin.name, category, req.field_name, sensitivity_map.get(req.field_name), "blind_index_lookup")
+    return {"category": category, "field_name": req.field_name, "user_ids": user_ids}
+
+class BlindIndexBackfillRequest(BaseModel):
+    reset: bool = False
+
+@router.post("/blind-index/backfill", status_code=status.HTTP_202_ACCEPTED)
+def start_blind_index_backfill(req: BlindIndexBackfillRequest, current_admin: User = Depends(get_current_admin_user)):
+    """Builds missing blind indexes in the background; reset clears them all first (after a BLIND_INDEX_KEY change)."""
+    try:
+        start_backfill(req.reset, on_change=backup_scheduler.notify)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return backfill_status()
+
+@router.get("/blind-index/backfill")
+def get_blind_index_backfill_status(current_admin: User = Depends(get_current_admin_user)):
+    """Reports progress of the current or last blind index backfill."""
+    return backfill_status()
+
+@router.post("/blind-index/backfill/stop")
+def stop_blind_index_backfill(current_admin: User = Depends(get_current_admin_user)):
+    """Stops the running backfill after its current batch; starting it again fills in the remaining rows."""
+    if not stop_backfill():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="No blind index backfill is running.")
+    return backfill_status()
+
+@router.get("/duplicate-report")
+def get_duplicate_report(
+    limit: int = Query(100, ge=1, le=1000),
+    key_db: Session = Depends(get_key_db),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Lists PII values stored by more than one account, from fingerprints alone (no decryption or KMS calls)."""
+    return duplicate_report(key_db, limit)
@@ -2,7 +2,6 @@ from fastapi import APIRouter, Depends, HTTPException, status, Form, Request, Ba
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr, validator
 from sqlalchemy.orm import Session
-from passlib.hash import bcrypt
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 import re
@@ -18,8 +17,15 @@ import bleach
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from utils.logger import logger
+from utils.dek_cache import dek_cache
+from utils.principal_cache import principal_cache, Principal
+from utils.password_hashing import password_hasher, PasswordHashingBusy
+from utils.lockout import LockoutEngine
+from utils.executor import run_blocking
+from services.login_audit import login_audit_writer
+from services.backup_scheduler import backup_scheduler
 from db.session import get_pii_db
-from db.pii_db import User, PasswordResetOTP, LoginAttempt
+from db.pii_db import User, PasswordResetOTP
 
 router = APIRouter()
 limiter = Limiter(key_func=get_remote_address)
@@ -41,6 +47,8 @@ COMPANY_NAME = os.getenv("COMPANY_NAME", "SecureVault")
 RECAPTCHA_SECRET_KEY = os.getenv("RECAPTCHA_SECRET_KEY")
 RECAPTCHA_VERIFY_URL = "https://www.google.com/recaptcha/api/siteverify"
 
+lockout_engine = LockoutEngine(MAX_LOGIN_ATTEMPTS, LOCKOUT_TIME_MINUTES, IP_MAX_ATTEMPTS, IP_LOCKOUT_MINUTES)
+
 # --- Schemas ---
 class UserCreate(BaseModel):
     name: str
@@ -91,12 +99,29 @@ def create_access_token(data: dict):
     # The role is now expected to be in the data dictionary
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def verify_password(plain_password, hashed_password):
-    return bcrypt.verify(plain_password, hashed_password)
+async def run_password_hashing(fn, *args):
+    """
+    Awaits a bcrypt call on the dedicated hashing pool, answering 429 when it is
+    saturated. The handler holds no thread while it waits, so logins can't use up
+    the threadpool that sync routes and dependencies share.
+    """
+    try:
+        return await fn(*args)
+    except PasswordHashingBusy:
+        raise HTTPException(status_code=429, detail="Server is busy. Please try again shortly.", headers={"Retry-After": "1"})
+
+async def verify_password(plain_password, hashed_password):
+    return await run_password_hashing(password_hasher.verify_async, plain_password, hashed_password)
+
+async def hash_password(plain_password):
+    return await run_password_hashing(password_hasher.hash_async, plain_password)
 
 def get_user_by_email(db: Session, email: str):
     return db.query(User).filter(User.email == email).first()
 
+def get_valid_otp(db: Session, email: str, otp: str):
+    return db.query(PasswordResetOTP).filter(PasswordResetOTP.email == email, PasswordResetOTP.otp_code == otp, PasswordResetOTP.expires_at > datetime.utcnow(), PasswordResetOTP.is_used == False).first()
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_pii_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -111,9 +136,15 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         token_data = TokenData(email=email, role=role)
     except JWTError:
         raise credentials_exception
+    # Serve repeat requests from the principal cache so authorization costs no DB round trip
+    principal = principal_cache.get(user_id=payload.get("user_id"), email=token_data.email)
+    if principal is not None:
+        return principal
     user = get_user_by_email(db, email=token_data.email)
     if user is None: raise credentials_exception
-    return user
+    principal = Principal.from_user(user)
+    principal_cache.put(principal)
+    return principal
 
 def send_email_fully_formatted(recipient: str, subject: str, body: str):
     if not SMTP_USERNAME or not SMTP_PASSWORD:
@@ -138,19 +169,16 @@ def send_email_fully_formatted(recipient: str, subject: str, body: str):
         print(f"Error sending email: {e}")
         return False
 
-def check_and_handle_lockout(db: Session, email: str, ip_address: str):
-    user = get_user_by_email(db, email)
+def check_and_handle_lockout(email: str, ip_address: str, user: Optional[User] = None):
+    # Persistent lock set on the account (survives restarts)
     if user and user.is_locked and user.lock_until and user.lock_until > datetime.utcnow():
         raise HTTPException(status_code=429, detail="Account locked.")
-    
-    ip_failures = db.query(LoginAttempt).filter(
-        LoginAttempt.ip_address == ip_address, LoginAttempt.successful == False, 
-        LoginAttempt.attempt_time > datetime.utcnow() - timedelta(minutes=IP_LOCKOUT_MINUTES)
-    ).count()
-    if ip_failures >= IP_MAX_ATTEMPTS:
+    if lockout_engine.is_account_locked(email):
+        raise HTTPException(status_code=429, detail="Account locked.")
+    if lockout_engine.is_ip_blocked(ip_address):
         raise HTTPException(status_code=429, detail="Too many failed login attempts from this IP.")
 
-def record_login_attempt(db: Session, email: str, ip: str, success: bool):
+def record_login_attempt(db: Session, email: str, ip: str, success: bool, user: Optional[User] = None):
     # --- NEW: JSON Logging for ELK Stack ---
     log_status = "success" if success else "failure"
     log_message = f"User login attempt: {log_status}"
@@ -169,65 +197,92 @@ def record_login_attempt(db: Session, email: str, ip: str, success: bool):
         logger.warning(log_message, extra={'extra_data': extra_log_data})
     # --- END: JSON Logging ---
 
-    # The rest of the function remains the same (database logic)
-    db.add(LoginAttempt(username=email, ip_address=ip, successful=success))
-    user = get_user_by_email(db, email)
-    if user:
-        if success:
+    # Audit row is written in a batch off the request path; counters live in memory
+    login_audit_writer.record(email, ip, success)
+    if success:
+        lockout_engine.record_success(email)
+        # Only touch the users row when there is a lock to clear
+        if user and (user.is_locked or user.failed_attempts):
             user.failed_attempts = 0
             user.is_locked = False
             user.lock_until = None
-        else:
-            user.failed_attempts = (user.failed_attempts or 0) + 1
-            if user.failed_attempts >= MAX_LOGIN_ATTEMPTS:
-                user.is_locked = True
-                user.lock_until = datetime.utcnow() + timedelta(minutes=LOCKOUT_TIME_MINUTES)
-    db.commit()
+            db.commit()
+            principal_cache.invalidate(user_id=user.id)
+        return
+
+    failures = lockout_engine.record_failure(email, ip)
+    lock_active = bool(user and user.is_locked and user.lock_until and user.lock_until > datetime.utcnow())
+    if user and failures >= MAX_LOGIN_ATTEMPTS and not lock_active:
+        # Persist the lock once the threshold is crossed so it holds across workers and restarts
+        user.failed_attempts = failures
+        user.is_locked = True
+        user.lock_until = datetime.utcnow() + timedelta(minutes=LOCKOUT_TIME_MINUTES)
+        db.commit()
+        principal_cache.invalidate(user_id=user.id)
 
 # --- Endpoints ---
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 @limiter.limit("10/hour")
-def register(request: Request, name: str = Form(...), email: str = Form(...), password: str = Form(...), recaptcha_token: str = Form(...), db: Session = Depends(get_pii_db)):
-    if not verify_recaptcha(recaptcha_token):
+async def register(request: Request, name: str = Form(...), email: str = Form(...), password: str = Form(...), recaptcha_token: str = Form(...), db: Session = Depends(get_pii_db)):
+    if not await run_blocking(verify_recaptcha, recaptcha_token):
         raise HTTPException(status_code=400, detail="Invalid reCAPTCHA.")
     try:
         user_data = UserCreate(name=name, email=email, password=password)
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e))
-    if get_user_by_email(db, email=user_data.email):
+    if await run_blocking(get_user_by_email, db, email=user_data.email):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Note: We removed the manual 'salt' creation here.
-    new_user = User(name=user_data.name, email=user_data.email, hashed_password=bcrypt.hash(user_data.password))
-    db.add(new_user)
-    db.commit()
+    new_user = User(name=user_data.name, email=user_data.email, hashed_password=await hash_password(user_data.password))
+
+    def save_user():
+        db.add(new_user)
+        db.commit()
+        return new_user.id
+
+    backup_scheduler.notify(await run_blocking(save_user))
     return {"message": "User registered successfully"}
 
 @router.post("/login", response_model=Token)
 @limiter.limit("20/minute")
-def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_pii_db)):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_pii_db)):
     client_ip = get_client_ip(request)
     recaptcha_token = request.headers.get("X-Recaptcha-Token")
-    if not recaptcha_token or not verify_recaptcha(recaptcha_token):
+    if not recaptcha_token or not await run_blocking(verify_recaptcha, recaptcha_token):
        raise HTTPException(status_code=400, detail="Invalid or missing reCAPTCHA token.")
     
     sanitized_username = bleach.clean(form_data.username, strip=True)
-    check_and_handle_lockout(db, sanitized_username, client_ip)
-    user = get_user_by_email(db, email=sanitized_username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
-        record_login_attempt(db, sanitized_username, client_ip, success=False)
+    user = await run_blocking(get_user_by_email, db, email=sanitized_username)
+    check_and_handle_lockout(sanitized_username, client_ip, user)
+    is_valid, new_hash = (False, None)
+    if user:
+        is_valid, new_hash = await run_password_hashing(password_hasher.verify_and_update_async, form_data.password, user.hashed_password)
+    if not is_valid:
+        await run_blocking(record_login_attempt, db, sanitized_username, client_ip, success=False, user=user)
         raise HTTPException(status_code=401, detail="Incorrect email or password")
-    
-    record_login_attempt(db, sanitized_username, client_ip, success=True)
     # --- MODIFICATION: Added user's name and role to the token payload ---
-    access_token = create_access_token(
-        data={"sub": user.email, "user_id": user.id, "name": user.name, "role": user.role}
-    )
+    # Read before any commit below expires the row, which would reload it on the event loop
+    token_data = {"sub": user.email, "user_id": user.id, "name": user.name, "role": user.role}
+    if new_hash:
+        # Transparently upgrade hashes made with a different BCRYPT_ROUNDS
+        user.hashed_password = new_hash
+        await run_blocking(db.commit)
+        backup_scheduler.notify(token_data["user_id"])
+    
+    await run_blocking(record_login_attempt, db, sanitized_username, client_ip, success=True, user=user)
+    access_token = create_access_token(data=token_data)
     return {"access_token": access_token, "token_type": "bearer"}
 
+@router.post("/logout")
+def logout(current_user: User = Depends(get_current_user)):
+    # Tokens are stateless, but any DEKs unwrapped for this user are wiped from memory
+    dek_cache.flush_user(current_user.id)
+    return {"message": "Logged out successfully."}
+
 @router.post("/forgot-password")
 @limiter.limit("5/hour")
-async def forgot_password(request: Request, background_tasks: BackgroundTasks, email: str = Form(...), db: Session = Depends(get_pii_db)):
+def forgot_password(request: Request, background_tasks: BackgroundTasks, email: str = Form(...), db: Session = Depends(get_pii_db)):
     sanitized_email = bleach.clean(email, strip=True)
     user = get_user_by_email(db, sanitized_email)
     if user:
@@ -241,10 +296,10 @@ async def forgot_password(request: Request, background_tasks: BackgroundTasks, e
 
 @router.post("/verify-otp")
 @limiter.limit("10/minute")
-async def verify_otp(request: Request, email: str = Form(...), otp: str = Form(...), db: Session = Depends(get_pii_db)):
+def verify_otp(request: Request, email: str = Form(...), otp: str = Form(...), db: Session = Depends(get_pii_db)):
     sanitized_email = bleach.clean(email, strip=True)
     sanitized_otp = bleach.clean(otp, strip=True)
-    otp_record = db.query(PasswordResetOTP).filter(PasswordResetOTP.email == sanitized_email, PasswordResetOTP.otp_code == sanitized_otp, PasswordResetOTP.expires_at > datetime.utcnow(), PasswordResetOTP.is_used == False).first()
+    otp_record = get_valid_otp(db, sanitized_email, sanitized_otp)
     if not otp_record:
         raise HTTPException(status_code=400, detail="Invalid or expired OTP.")
     return {"message": "OTP verified successfully."}
@@ -254,19 +309,22 @@ async def verify_otp(request: Request, email: str = Form(...), otp: str = Form(.
 async def reset_password(request: Request, email: str = Form(...), otp: str = Form(...), new_password: str = Form(...), db: Session = Depends(get_pii_db)):
     sanitized_email = bleach.clean(email, strip=True)
     sanitized_otp = bleach.clean(otp, strip=True)
-    otp_record = db.query(PasswordResetOTP).filter(PasswordResetOTP.email == sanitized_email, PasswordResetOTP.otp_code == sanitized_otp, PasswordResetOTP.expires_at > datetime.utcnow(), PasswordResetOTP.is_used == False).first()
+    otp_record = await run_blocking(get_valid_otp, db, sanitized_email, sanitized_otp)
     if not otp_record: raise HTTPException(status_code=400, detail="Invalid or expired OTP.")
     try:
         UserCreate(name="dummy_user", email="dummy@email.com", password=new_password)
     except ValueError as e:
         raise HTTPException(status_code=422, detail=f"Validation error: {e}")
 
-    user = get_user_by_email(db, sanitized_email)
+    user = await run_blocking(get_user_by_email, db, sanitized_email)
     if not user: raise HTTPException(status_code=404, detail="User not found.")
     
-    user.hashed_password = bcrypt.hash(new_password)
+    user_id = user.id
+    user.hashed_password = await hash_password(new_password)
     otp_record.is_used = True
-    db.commit()
+    await run_blocking(db.commit)
+    principal_cache.invalidate(user_id=user_id)
+    backup_scheduler.notify(user_id)
     return {"message": "Password has been reset successfully."}
 
 # --- NEW: Dependency to check for Admin Role ---
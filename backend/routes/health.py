@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from services.readiness import readiness
+from utils.key_management import kms_status
+
+router = APIRouter()
+
+@router.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and the event loop is responsive. Never touches dependencies."""
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readyz():
+    """Readiness: 200 once the database schema and KMS client are initialised, else 503."""
+    report = readiness.report()
+    report["kms"] = kms_status()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
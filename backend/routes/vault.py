@@ -1,18 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from sqlalchemy import select, delete, update, literal, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from collections import defaultdict
+from typing import List, Optional
+import asyncio
+import json
 import os
-import re
 
-from backup_script import create_database_backup
-from db.session import get_key_db, get_pii_db
-from db.key_db import FieldKey
-from db.pii_db import User, BasicIdentifiers, GovernmentIdentifiers, FinancialInfo, EmploymentEducation, HealthInsurance
-from services.crypto_service import generate_dek, encrypt_value, decrypt_value
+from db.session import get_async_key_db, get_async_pii_db
+from db.key_db import FieldKey, PIIFingerprint
+from db.pii_db import User, CATEGORY_MODEL_MAP
+from services.crypto_service import generate_dek, seal_value, seal_values, decrypt_field, decrypt_fields, envelope_nonce
 from services.classification import sensitivity_map
-from utils.key_management import wrap_dek_with_kms, unwrap_dek_with_kms
+from services.backup_scheduler import backup_scheduler
+from services.duplicate_detection import duplicate_policy, fingerprints_for, find_duplicates, fingerprint_rows
+from utils.key_hierarchy import wrap_dek_for_user, unwrap_field_dek
+from utils.executor import run_blocking
+from utils.blind_index import blind_index_columns
+from utils.dek_cache import dek_cache
+from utils.listing_etags import listing_etags, compute_etag, etag_matches, listing_headers
 from utils.logger import log_pii_action
-from utils.validation import validate_and_sanitize
+from utils.validation import validate_and_sanitize, normalize_pii_value, validate_batch
 from routes.auth import get_current_user
 from pydantic import BaseModel
 
@@ -32,6 +41,11 @@ CANONICAL_FIELD_ORDER = {
     "Health Insurance": ["health_insurance", "patientid", "disability_certificate", "emergency_contact"]
 }
 
+# Sort keys for the listing, built once
+CATEGORY_RANK = {category: i for i, category in enumerate(CANONICAL_CATEGORY_ORDER)}
+FIELD_RANK = {category: {field: i for i, field in enumerate(fields)} for category, fields in CANONICAL_FIELD_ORDER.items()}
+UNRANKED = float('inf')
+
 def overwrite(buf: bytearray):
     """Securely zero out a mutable bytearray."""
     for i in range(len(buf)):
@@ -54,81 +68,91 @@ class UpdateFieldRequest(BaseModel):
 class DeleteFieldRequest(BaseModel):
     category: str
     field_name: str
+
+class FieldRef(BaseModel):
+    category: str
+    field_name: str
+
+class EncryptBatchRequest(BaseModel):
+    fields: List[EncryptRequest]
+
+class DecryptBatchRequest(BaseModel):
+    # Either a whole category, or an explicit list of category/field pairs
+    category: Optional[str] = None
+    fields: Optional[List[FieldRef]] = None
     
-CATEGORY_MODEL_MAP = {
-    "Basic Identifiers": BasicIdentifiers, "Government Identifiers": GovernmentIdentifiers,
-    "Financial Info": FinancialInfo, "Employment Education": EmploymentEducation,
-    "Health Insurance": HealthInsurance,
-}
 
-def normalize_pii_value(field_name: str, value: str) -> str:
-    clean_value = value.strip()
-    if field_name == "phone":
-        digits = re.sub(r'[\s-]', '', clean_value)
-        if digits.startswith('+'): return f"+{digits[1:3]}-{digits[3:]}"
-        elif len(digits) == 10: return f"+91-{digits}"
-        return clean_value
-    elif field_name == "adhar":
-        digits = re.sub(r'[\s-]', '', clean_value)
-        if len(digits) == 12: return f"{digits[0:4]}-{digits[4:8]}-{digits[8:12]}"
-        return clean_value
-    elif field_name == "creditnum":
-        digits = re.sub(r'[\s-]', '', clean_value)
-        if len(digits) == 16: return f"{digits[0:4]}-{digits[4:8]}-{digits[8:12]}-{digits[12:16]}"
-        return clean_value
-    elif field_name == "pan":
-        return clean_value.upper()
-    return clean_value
+async def enforce_duplicate_policy(key_db: AsyncSession, current_user: User, fingerprints: dict):
+    """Refuses values another account already stores where the policy says reject, and logs the others."""
+    duplicates = await find_duplicates(key_db, current_user.id, fingerprints)
+    rejected = [field_name for _, field_name in duplicates if duplicate_policy(field_name) == "reject"]
+    if rejected:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Already registered to another account: {', '.join(rejected)}.")
+    for category, field_name in duplicates:
+        log_pii_action(current_user.id, current_user.name, category, field_name, sensitivity_map.get(field_name), "duplicate_detected")
 
 @router.get("/")
 async def get_vault_contents(
-    key_db: Session = Depends(get_key_db), pii_db: Session = Depends(get_pii_db),
+    request: Request,
+    key_db: AsyncSession = Depends(get_async_key_db), pii_db: AsyncSession = Depends(get_async_pii_db),
     current_user: User = Depends(get_current_user)
 ):
-    user_keys = key_db.query(FieldKey).filter(FieldKey.user_id == current_user.id).all()
-    if not user_keys: return []
-    
+    if_none_match = request.headers.get("if-none-match")
+    known_etag = listing_etags.get(current_user.id)
+    if known_etag and etag_matches(if_none_match, known_etag):
+        # Nothing changed since this listing was served; no database access needed
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=listing_headers(known_etag))
+
+    # One metadata query per database: field names from field_keys, created_at from every category table at once
+    key_rows = (await key_db.execute(select(FieldKey.category, FieldKey.field_name).where(FieldKey.user_id == current_user.id))).all()
     grouped_by_category = defaultdict(list)
-    for key in user_keys: grouped_by_category[key.category].append(key.field_name)
+    for category_name, field_name in key_rows: grouped_by_category[category_name].append(field_name)
 
-    all_records = []
-    for category_name, fields in grouped_by_category.items():
-        PiiModel = CATEGORY_MODEL_MAP.get(category_name)
-        if not PiiModel: continue
-        pii_record_tuple = pii_db.query(PiiModel.created_at).filter(PiiModel.user_id == current_user.id).first()
-        
-        field_order_map = {field: i for i, field in enumerate(CANONICAL_FIELD_ORDER.get(category_name, []))}
-        sorted_fields = sorted(fields, key=lambda f: field_order_map.get(f, float('inf')))
+    created_at = {}
+    models = [(name, CATEGORY_MODEL_MAP[name]) for name in grouped_by_category if name in CATEGORY_MODEL_MAP]
+    if models:
+        created_query = union_all(*(
+            select(literal(name).label("category"), Model.created_at).where(Model.user_id == current_user.id)
+            for name, Model in models
+        ))
+        for category_name, added in (await pii_db.execute(created_query)).all():
+            created_at.setdefault(category_name, added)
 
+    all_records = []
+    for category_name, _ in sorted(models, key=lambda item: CATEGORY_RANK.get(item[0], UNRANKED)):
+        field_rank = FIELD_RANK.get(category_name, {})
+        added = created_at.get(category_name)
         all_records.append({
             "id": category_name, "name": f"User {current_user.id} {category_name}",
-            "type": category_name, "dateAdded": pii_record_tuple[0].strftime("%Y-%m-%d") if pii_record_tuple else "N/A",
-            "status": "encrypted", "fields": sorted_fields,
+            "type": category_name, "dateAdded": added.strftime("%Y-%m-%d") if added else "N/A",
+            "status": "encrypted", "fields": sorted(grouped_by_category[category_name], key=lambda f: field_rank.get(f, UNRANKED)),
         })
-    
-    category_order_map = {category: i for i, category in enumerate(CANONICAL_CATEGORY_ORDER)}
-    sorted_all_records = sorted(all_records, key=lambda r: category_order_map.get(r['type'], float('inf')))
-    
-    return sorted_all_records
+
+    body = json.dumps(all_records, separators=(",", ":")).encode("utf-8")
+    etag = compute_etag(body)
+    listing_etags.put(current_user.id, etag)
+    headers = listing_headers(etag)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.post("/decrypt")
 async def decrypt_data(
-    req: DecryptRequest, key_db: Session = Depends(get_key_db),
-    pii_db: Session = Depends(get_pii_db), current_user: User = Depends(get_current_user)
+    req: DecryptRequest, key_db: AsyncSession = Depends(get_async_key_db),
+    pii_db: AsyncSession = Depends(get_async_pii_db), current_user: User = Depends(get_current_user)
 ):
-    key_record = key_db.query(FieldKey).filter(FieldKey.user_id == current_user.id, FieldKey.field_name == req.field_name).first()
+    key_record = await key_db.scalar(select(FieldKey).where(FieldKey.user_id == current_user.id, FieldKey.category == req.category, FieldKey.field_name == req.field_name))
     if not key_record: raise HTTPException(status_code=404, detail="Key not found.")
     PiiModel = CATEGORY_MODEL_MAP.get(req.category)
     if not PiiModel: raise HTTPException(status_code=400, detail="Invalid category.")
-    pii_record = pii_db.query(PiiModel).filter(PiiModel.user_id == current_user.id).first()
+    pii_record = await pii_db.scalar(select(PiiModel).where(PiiModel.user_id == current_user.id).limit(1))
     if not pii_record: raise HTTPException(status_code=404, detail="PII record not found.")
     ciphertext = getattr(pii_record, req.field_name, None)
     if ciphertext is None: raise HTTPException(status_code=404, detail="Field has no data.")
     dek_buffer = None
     try:
-        dek_bytes = unwrap_dek_with_kms(key_record.wrapped_dek)
-        dek_buffer = bytearray(dek_bytes)
-        plaintext = decrypt_value(ciphertext, key_record.iv, key_record.auth_tag, dek_buffer)
+        dek_buffer = await unwrap_field_dek(key_record.wrapped_dek, key_record.key_version, current_user.id)
+        plaintext = await run_blocking(decrypt_field, ciphertext, dek_buffer, key_record.id, current_user.id, req.field_name, key_record.iv, key_record.auth_tag)
         return {"plaintext": plaintext}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Decryption failed: {e}")
@@ -137,14 +161,89 @@ async def decrypt_data(
             overwrite(dek_buffer)
             del dek_buffer
 
+@router.post("/decrypt-batch")
+async def decrypt_batch(
+    req: DecryptBatchRequest, key_db: AsyncSession = Depends(get_async_key_db),
+    pii_db: AsyncSession = Depends(get_async_pii_db), current_user: User = Depends(get_current_user)
+):
+    if req.fields:
+        requested = [(f.category, f.field_name) for f in req.fields]
+        categories = {category for category, _ in requested}
+    elif req.category:
+        requested, categories = None, {req.category}
+    else:
+        raise HTTPException(status_code=400, detail="Provide a category or a list of fields.")
+    if any(category not in CATEGORY_MODEL_MAP for category in categories):
+        raise HTTPException(status_code=400, detail="Invalid category.")
+
+    # One FieldKey query for every requested field
+    key_query = select(FieldKey).where(FieldKey.user_id == current_user.id)
+    if requested is None:
+        key_query = key_query.where(FieldKey.category == req.category)
+    else:
+        key_query = key_query.where(FieldKey.field_name.in_({field for _, field in requested}))
+    keys_by_field = {key.field_name: key for key in (await key_db.scalars(key_query)).all()}
+    if requested is None:
+        if not keys_by_field: raise HTTPException(status_code=404, detail="No records found in this category.")
+        field_order_map = {field: i for i, field in enumerate(CANONICAL_FIELD_ORDER.get(req.category, []))}
+        requested = [(req.category, field) for field in sorted(keys_by_field, key=lambda f: field_order_map.get(f, float('inf')))]
+
+    # One PII row fetch per category table
+    pii_records = {}
+    for category in categories:
+        PiiModel = CATEGORY_MODEL_MAP[category]
+        pii_records[category] = await pii_db.scalar(select(PiiModel).where(PiiModel.user_id == current_user.id).limit(1))
+
+    # Medium fields of a category share one wrapped DEK, so each distinct blob is unwrapped once;
+    # the remaining (high-sensitivity) unwraps run concurrently.
+    wrapped_deks = list({(keys_by_field[field].wrapped_dek, keys_by_field[field].key_version) for _, field in requested if field in keys_by_field})
+    unwrapped = await asyncio.gather(
+        *(unwrap_field_dek(wrapped, key_version, current_user.id) for wrapped, key_version in wrapped_deks),
+        return_exceptions=True,
+    )
+    deks = {wrapped: dek for (wrapped, _), dek in zip(wrapped_deks, unwrapped)}
+
+    def decrypt_all():
+        # AES-GCM for the whole batch runs in one hop on the blocking pool, one cipher context per DEK
+        errors, pending = [], []
+        for category, field_name in requested:
+            key_record = keys_by_field.get(field_name)
+            if not key_record or key_record.category != category:
+                errors.append({"category": category, "field_name": field_name, "detail": "Key not found."})
+                continue
+            pii_record = pii_records.get(category)
+            ciphertext = getattr(pii_record, field_name, None) if pii_record else None
+            if ciphertext is None:
+                errors.append({"category": category, "field_name": field_name, "detail": "Field has no data."})
+                continue
+            dek_buffer = deks[key_record.wrapped_dek]
+            if isinstance(dek_buffer, Exception):
+                errors.append({"category": category, "field_name": field_name, "detail": f"Decryption failed: {dek_buffer}"})
+                continue
+            pending.append((category, field_name, (dek_buffer, key_record.id, current_user.id, field_name, ciphertext, key_record.iv, key_record.auth_tag)))
+        results = []
+        for (category, field_name, _), plaintext in zip(pending, decrypt_fields(item for _, _, item in pending)):
+            if isinstance(plaintext, Exception):
+                errors.append({"category": category, "field_name": field_name, "detail": f"Decryption failed: {plaintext}"})
+            else:
+                results.append({"category": category, "field_name": field_name, "plaintext": plaintext})
+        return results, errors
+
+    try:
+        results, errors = await run_blocking(decrypt_all)
+    finally:
+        for dek_buffer in deks.values():
+            if isinstance(dek_buffer, bytearray): overwrite(dek_buffer)
+    return {"results": results, "errors": errors}
+
 @router.post("/encrypt")
 async def encrypt_data(
-    req: EncryptRequest, key_db: Session = Depends(get_key_db),
-    pii_db: Session = Depends(get_pii_db), current_user: User = Depends(get_current_user)
+    req: EncryptRequest, key_db: AsyncSession = Depends(get_async_key_db),
+    pii_db: AsyncSession = Depends(get_async_pii_db), current_user: User = Depends(get_current_user)
 ):
-    existing_field = key_db.query(FieldKey).filter(
-        FieldKey.user_id == current_user.id, FieldKey.field_name == req.field_name
-    ).first()
+    existing_field = await key_db.scalar(select(FieldKey.id).where(
+        FieldKey.user_id == current_user.id, FieldKey.category == req.category, FieldKey.field_name == req.field_name
+    ))
     if existing_field:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"The field '{req.field_name}' already exists.")
     
@@ -154,118 +253,290 @@ async def encrypt_data(
     normalized_value = normalize_pii_value(req.field_name, sanitized_value)
     sensitivity = sensitivity_map.get(req.field_name)
     if not sensitivity: raise HTTPException(status_code=400, detail="Unknown field for classification")
+    fingerprints = fingerprints_for([(req.category, req.field_name, normalized_value)])
+    await enforce_duplicate_policy(key_db, current_user, fingerprints)
 
-    dek_buffer, wrapped_dek = None, None
+    dek_buffer, wrapped_dek, key_version = None, None, None
     try:
         if sensitivity == 'high':
             dek_buffer = bytearray(generate_dek())
-            wrapped_dek = wrap_dek_with_kms(dek_buffer)
+            wrapped_dek, key_version = await wrap_dek_for_user(dek_buffer, current_user.id)
+            dek_cache.put(wrapped_dek, dek_buffer, current_user.id)
         elif sensitivity == 'medium':
-            existing_key = key_db.query(FieldKey).filter_by(user_id=current_user.id, category=req.category, sensitivity='medium').first()
+            existing_key = await key_db.scalar(select(FieldKey).filter_by(user_id=current_user.id, category=req.category, sensitivity='medium').limit(1))
             if existing_key:
-                wrapped_dek = existing_key.wrapped_dek
-                dek_bytes = unwrap_dek_with_kms(wrapped_dek)
-                dek_buffer = bytearray(dek_bytes)
+                wrapped_dek, key_version = existing_key.wrapped_dek, existing_key.key_version
+                dek_buffer = await unwrap_field_dek(wrapped_dek, key_version, current_user.id)
             else:
                 dek_buffer = bytearray(generate_dek())
-                wrapped_dek = wrap_dek_with_kms(dek_buffer)
+                wrapped_dek, key_version = await wrap_dek_for_user(dek_buffer, current_user.id)
+                dek_cache.put(wrapped_dek, dek_buffer, current_user.id)
         
         if not dek_buffer or not wrapped_dek: raise ValueError("DEK generation or wrapping failed.")
-        ciphertext, iv, auth_tag = encrypt_value(normalized_value, dek_buffer)
+        # The nonce and tag travel inside the envelope; the key row is flushed first because the envelope names its id
+        key_record = FieldKey(user_id=current_user.id, category=req.category, field_name=req.field_name, sensitivity=sensitivity, wrapped_dek=wrapped_dek, iv=b"", auth_tag=b"", key_salt=os.urandom(16), key_version=key_version)
+        key_db.add(key_record)
+        key_db.add_all(fingerprint_rows(current_user.id, fingerprints))
+        try:
+            await key_db.flush()
+        except IntegrityError:
+            # A concurrent request stored the same field first
+            await key_db.rollback()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"The field '{req.field_name}' already exists.")
+        ciphertext = await run_blocking(seal_value, normalized_value, dek_buffer, key_record.id, current_user.id, req.field_name)
+        key_record.iv = envelope_nonce(ciphertext)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Key management or encryption failed: {e}")
     finally:
         if dek_buffer: overwrite(dek_buffer)
-
-    key_db.add(FieldKey(user_id=current_user.id, category=req.category, field_name=req.field_name, sensitivity=sensitivity, wrapped_dek=wrapped_dek, iv=iv, auth_tag=auth_tag, key_salt=os.urandom(16)))
-    key_db.commit()
+    await key_db.commit()
 
     PiiModel = CATEGORY_MODEL_MAP.get(req.category)
-    user_record = pii_db.query(PiiModel).filter(PiiModel.user_id == current_user.id).first()
+    columns = {req.field_name: ciphertext, **blind_index_columns(req.category, {req.field_name: normalized_value})}
+    user_record = await pii_db.scalar(select(PiiModel).where(PiiModel.user_id == current_user.id).limit(1))
     if user_record:
-        setattr(user_record, req.field_name, ciphertext)
+        for column, value in columns.items(): setattr(user_record, column, value)
     else:
-        pii_db.add(PiiModel(**{"user_id": current_user.id, req.field_name: ciphertext}))
-    pii_db.commit()
+        pii_db.add(PiiModel(user_id=current_user.id, **columns))
+    await pii_db.commit()
 
-    create_database_backup()
+    listing_etags.invalidate(current_user.id)
+    backup_scheduler.notify(current_user.id, req.category)
     log_pii_action(current_user.id, current_user.name, req.category, req.field_name, sensitivity, "encrypted")
     return {"status": "success", "message": f"{req.field_name} encrypted successfully"}
 
+@router.post("/encrypt-batch")
+async def encrypt_batch(
+    req: EncryptBatchRequest, key_db: AsyncSession = Depends(get_async_key_db),
+    pii_db: AsyncSession = Depends(get_async_pii_db), current_user: User = Depends(get_current_user)
+):
+    if not req.fields: raise HTTPException(status_code=400, detail="No fields provided.")
+    field_names = [item.field_name for item in req.fields]
+    if len(set(field_names)) != len(field_names):
+        raise HTTPException(status_code=400, detail="Each field may only appear once per batch.")
+
+    # Validate everything up front so a bad field never leaves a half-written profile
+    validated, invalid = validate_batch(((item.category, item.field_name, item.value) for item in req.fields), CANONICAL_FIELD_ORDER)
+    prepared = []
+    for category, field_name, normalized_value in validated:
+        sensitivity = sensitivity_map.get(field_name)
+        if not sensitivity:
+            invalid.append({"category": category, "field_name": field_name, "code": "unclassified_field", "detail": "Unknown field for classification"})
+            continue
+        prepared.append((category, field_name, normalized_value, sensitivity))
+    if invalid: raise HTTPException(status_code=422, detail=invalid)
+
+    existing_fields = (await key_db.scalars(select(FieldKey.field_name).where(
+        FieldKey.user_id == current_user.id, FieldKey.field_name.in_(field_names)
+    ))).all()
+    if existing_fields:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"These fields already exist: {', '.join(existing_fields)}.")
+    fingerprints = fingerprints_for((category, field_name, normalized_value) for category, field_name, normalized_value, _ in prepared)
+    await enforce_duplicate_policy(key_db, current_user, fingerprints)
+
+    # Medium fields reuse the category's existing shared DEK, or get one new DEK per category
+    medium_categories = {category for category, _, _, sensitivity in prepared if sensitivity == 'medium'}
+    existing_medium = {}
+    if medium_categories:
+        for key in (await key_db.scalars(select(FieldKey).where(
+            FieldKey.user_id == current_user.id, FieldKey.sensitivity == 'medium', FieldKey.category.in_(medium_categories)
+        ))).all():
+            existing_medium.setdefault(key.category, (key.wrapped_dek, key.key_version))
+
+    async def generate_and_wrap():
+        dek_buffer = bytearray(generate_dek())
+        wrapped_dek, key_version = await wrap_dek_for_user(dek_buffer, current_user.id)
+        dek_cache.put(wrapped_dek, dek_buffer, current_user.id)
+        return dek_buffer, wrapped_dek, key_version
+
+    async def unwrap_existing(wrapped_dek, key_version):
+        return await unwrap_field_dek(wrapped_dek, key_version, current_user.id), wrapped_dek, key_version
+
+    # Slot per high field, and per medium category; all KMS calls run concurrently
+    slots = [("field", field_name) for _, field_name, _, sensitivity in prepared if sensitivity == 'high']
+    slots += [("category", category) for category in sorted(medium_categories)]
+    jobs = [
+        unwrap_existing(*existing_medium[name]) if kind == "category" and name in existing_medium
+        else generate_and_wrap()
+        for kind, name in slots
+    ]
+    outcomes = await asyncio.gather(*jobs, return_exceptions=True)
+    keys = dict(zip(slots, outcomes))
+
+    def slot_for(category, field_name, sensitivity):
+        return ("field", field_name) if sensitivity == 'high' else ("category", category)
+
+    def encrypt_all():
+        envelopes = seal_values(
+            (keys[slot_for(category, field_name, sensitivity)][0], key.id, current_user.id, field_name, normalized_value)
+            for (category, field_name, normalized_value, sensitivity), key in zip(prepared, new_keys)
+        )
+        return [(category, field_name, sensitivity, envelope) for (category, field_name, _, sensitivity), envelope in zip(prepared, envelopes)]
+
+    # Blind-index columns per category, from the normalized values
+    blind_indexes = defaultdict(dict)
+    for category, field_name, normalized_value, _ in prepared:
+        blind_indexes[category].update(blind_index_columns(category, {field_name: normalized_value}))
+
+    # One transaction per database; the key rows are flushed first because each envelope names its FieldKey id
+    try:
+        failures = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+        if failures: raise failures[0]
+        new_keys = []
+        for category, field_name, _, sensitivity in prepared:
+            _, wrapped_dek, key_version = keys[slot_for(category, field_name, sensitivity)]
+            new_keys.append(FieldKey(user_id=current_user.id, category=category, field_name=field_name, sensitivity=sensitivity, wrapped_dek=wrapped_dek, iv=b"", auth_tag=b"", key_salt=os.urandom(16), key_version=key_version))
+        new_fingerprints = fingerprint_rows(current_user.id, fingerprints)
+        key_db.add_all(new_keys + new_fingerprints)
+        try:
+            await key_db.flush()
+        except IntegrityError:
+            await key_db.rollback()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="One or more of these fields already exist.")
+        encrypted = await run_blocking(encrypt_all)
+        for key, (_, _, _, ciphertext) in zip(new_keys, encrypted): key.iv = envelope_nonce(ciphertext)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Key management or encryption failed: {e}")
+    finally:
+        for outcome in outcomes:
+            if isinstance(outcome, tuple): overwrite(outcome[0])
+    await key_db.commit()
+
+    try:
+        for category in {category for category, *_ in encrypted}:
+            PiiModel = CATEGORY_MODEL_MAP[category]
+            columns = {field_name: ciphertext for cat, field_name, _, ciphertext in encrypted if cat == category}
+            columns.update(blind_indexes[category])
+            user_record = await pii_db.scalar(select(PiiModel).where(PiiModel.user_id == current_user.id).limit(1))
+            if user_record:
+                for field_name, ciphertext in columns.items(): setattr(user_record, field_name, ciphertext)
+            else:
+                pii_db.add(PiiModel(user_id=current_user.id, **columns))
+        await pii_db.commit()
+    except Exception as e:
+        # Roll the key rows back too, so no FieldKey points at a missing ciphertext
+        await pii_db.rollback()
+        for row in new_keys + new_fingerprints: await key_db.delete(row)
+        await key_db.commit()
+        raise HTTPException(status_code=500, detail=f"Storing encrypted fields failed: {e}")
+
+    listing_etags.invalidate(current_user.id)
+    for category in {category for category, *_ in encrypted}:
+        backup_scheduler.notify(current_user.id, category)
+    for category, field_name, sensitivity, *_ in encrypted:
+        log_pii_action(current_user.id, current_user.name, category, field_name, sensitivity, "encrypted")
+    return {"status": "success", "message": f"{len(encrypted)} fields encrypted successfully", "fields": [field_name for _, field_name, *_ in encrypted]}
+
 @router.put("/field")
 async def update_field(
-    req: UpdateFieldRequest, key_db: Session = Depends(get_key_db),
-    pii_db: Session = Depends(get_pii_db), current_user: User = Depends(get_current_user)
+    req: UpdateFieldRequest, key_db: AsyncSession = Depends(get_async_key_db),
+    pii_db: AsyncSession = Depends(get_async_pii_db), current_user: User = Depends(get_current_user)
 ):
     is_valid, sanitized_value = validate_and_sanitize(req.field_name, req.new_value)
     if not is_valid: raise HTTPException(status_code=422, detail=f"Invalid format for '{req.field_name}'.")
     
     normalized_value = normalize_pii_value(req.field_name, sanitized_value)
-    key_record = key_db.query(FieldKey).filter(FieldKey.user_id == current_user.id, FieldKey.field_name == req.field_name).first()
+    key_record = await key_db.scalar(select(FieldKey).where(FieldKey.user_id == current_user.id, FieldKey.category == req.category, FieldKey.field_name == req.field_name))
     if not key_record: raise HTTPException(status_code=404, detail="Key not found.")
+    fingerprints = fingerprints_for([(req.category, req.field_name, normalized_value)])
+    await enforce_duplicate_policy(key_db, current_user, fingerprints)
+
+    PiiModel = CATEGORY_MODEL_MAP.get(req.category)
+    pii_record = await pii_db.scalar(select(PiiModel).where(PiiModel.user_id == current_user.id).limit(1))
+    if not pii_record: raise HTTPException(status_code=404, detail="PII record not found.")
+    old_ciphertext = getattr(pii_record, req.field_name)
+    wrapped_dek, key_version = key_record.wrapped_dek, key_record.key_version
 
     dek_buffer = None
     try:
-        dek_bytes = unwrap_dek_with_kms(key_record.wrapped_dek)
-        dek_buffer = bytearray(dek_bytes)
-        new_ciphertext, new_iv, new_auth_tag = encrypt_value(normalized_value, dek_buffer)
+        dek_buffer = await unwrap_field_dek(wrapped_dek, key_version, current_user.id)
+        new_ciphertext = await run_blocking(seal_value, normalized_value, dek_buffer, key_record.id, current_user.id, req.field_name)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Encryption failed: {e}")
     finally:
         if dek_buffer: overwrite(dek_buffer)
 
-    PiiModel = CATEGORY_MODEL_MAP.get(req.category)
-    pii_record = pii_db.query(PiiModel).filter(PiiModel.user_id == current_user.id).first()
-    if not pii_record: raise HTTPException(status_code=404, detail="PII record not found.")
-    
-    setattr(pii_record, req.field_name, new_ciphertext)
-    pii_db.commit()
+    # A reencrypt run may swap this field's DEK and ciphertext meanwhile, so both writes are conditional
+    # on what was read. The key row goes first and stays locked until the commit below.
+    # The value is now a self-contained envelope: no legacy tag, and iv mirrors the new nonce.
+    key_result = await key_db.execute(
+        update(FieldKey).where(FieldKey.id == key_record.id, FieldKey.wrapped_dek == wrapped_dek, FieldKey.key_version == key_version)
+        .values(iv=envelope_nonce(new_ciphertext), auth_tag=b"")
+    )
+    pii_result = None
+    if key_result.rowcount:
+        values = {req.field_name: new_ciphertext, **blind_index_columns(req.category, {req.field_name: normalized_value})}
+        pii_result = await pii_db.execute(
+            update(PiiModel).where(PiiModel.id == pii_record.id, getattr(PiiModel, req.field_name) == old_ciphertext).values(values)
+        )
+    if not pii_result or not pii_result.rowcount:
+        await pii_db.rollback()
+        await key_db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"{req.field_name} was changed concurrently; please retry.")
+    await pii_db.commit()
 
-    key_record.iv, key_record.auth_tag = new_iv, new_auth_tag
-    key_db.commit()
+    await key_db.execute(delete(PIIFingerprint).where(PIIFingerprint.user_id == current_user.id, PIIFingerprint.category == req.category, PIIFingerprint.field_name == req.field_name))
+    key_db.add_all(fingerprint_rows(current_user.id, fingerprints))
+    await key_db.commit()
 
-    create_database_backup()
+    listing_etags.invalidate(current_user.id)
+    backup_scheduler.notify(current_user.id, req.category)
     log_pii_action(current_user.id, current_user.name, req.category, req.field_name, key_record.sensitivity, "updated")
     return {"status": "success", "message": f"{req.field_name} updated successfully."}
 
 @router.delete("/field")
 async def delete_field(
-    req: DeleteFieldRequest, key_db: Session = Depends(get_key_db),
-    pii_db: Session = Depends(get_pii_db), current_user: User = Depends(get_current_user)
+    req: DeleteFieldRequest, key_db: AsyncSession = Depends(get_async_key_db),
+    pii_db: AsyncSession = Depends(get_async_pii_db), current_user: User = Depends(get_current_user)
 ):
-    key_record = key_db.query(FieldKey).filter(FieldKey.user_id == current_user.id, FieldKey.field_name == req.field_name).first()
+    key_record = await key_db.scalar(select(FieldKey).where(FieldKey.user_id == current_user.id, FieldKey.category == req.category, FieldKey.field_name == req.field_name))
     if not key_record: raise HTTPException(status_code=404, detail="Field not found.")
     
     sensitivity = key_record.sensitivity
-    key_db.delete(key_record)
-    key_db.commit()
+    if sensitivity == 'high':
+        # High-sensitivity DEKs are never shared, so drop it from the cache right away
+        dek_cache.discard(key_record.wrapped_dek)
+    await key_db.delete(key_record)
+    await key_db.execute(delete(PIIFingerprint).where(PIIFingerprint.user_id == current_user.id, PIIFingerprint.category == req.category, PIIFingerprint.field_name == req.field_name))
+    await key_db.commit()
     
     PiiModel = CATEGORY_MODEL_MAP.get(req.category)
-    pii_record = pii_db.query(PiiModel).filter(PiiModel.user_id == current_user.id).first()
+    pii_record = await pii_db.scalar(select(PiiModel).where(PiiModel.user_id == current_user.id).limit(1))
     if pii_record:
         setattr(pii_record, req.field_name, None)
-        pii_db.commit()
+        for column in blind_index_columns(req.category, {req.field_name: None}): setattr(pii_record, column, None)
+        await pii_db.commit()
     
-    create_database_backup()
+    listing_etags.invalidate(current_user.id)
+    backup_scheduler.notify(current_user.id, req.category)
     log_pii_action(current_user.id, current_user.name, req.category, req.field_name, sensitivity, "deleted_field")
     return {"status": "success", "message": f"{req.field_name} deleted."}
 
 @router.delete("/category/{category_name}")
 async def delete_category(
-    category_name: str, key_db: Session = Depends(get_key_db),
-    pii_db: Session = Depends(get_pii_db), current_user: User = Depends(get_current_user)
+    category_name: str, key_db: AsyncSession = Depends(get_async_key_db),
+    pii_db: AsyncSession = Depends(get_async_pii_db), current_user: User = Depends(get_current_user)
 ):
-    deleted_count = key_db.query(FieldKey).filter(FieldKey.user_id == current_user.id, FieldKey.category == category_name).delete()
+    wrapped_deks = (await key_db.scalars(select(FieldKey.wrapped_dek).where(FieldKey.user_id == current_user.id, FieldKey.category == category_name))).all()
+    deleted_count = (await key_db.execute(delete(FieldKey).where(FieldKey.user_id == current_user.id, FieldKey.category == category_name))).rowcount
     if deleted_count == 0: raise HTTPException(status_code=404, detail="No records found in this category.")
-    key_db.commit()
+    await key_db.execute(delete(PIIFingerprint).where(PIIFingerprint.user_id == current_user.id, PIIFingerprint.category == category_name))
+    await key_db.commit()
+    # Only this category's DEKs; the user's other DEKs and KEK stay cached
+    for wrapped_dek in set(wrapped_deks): dek_cache.discard(wrapped_dek)
 
     PiiModel = CATEGORY_MODEL_MAP.get(category_name)
     if PiiModel:
-        pii_record = pii_db.query(PiiModel).filter(PiiModel.user_id == current_user.id).first()
+        pii_record = await pii_db.scalar(select(PiiModel).where(PiiModel.user_id == current_user.id).limit(1))
         if pii_record:
-            pii_db.delete(pii_record)
-            pii_db.commit()
+            await pii_db.delete(pii_record)
+            await pii_db.commit()
 
-    create_database_backup()
+    listing_etags.invalidate(current_user.id)
+    backup_scheduler.notify(current_user.id, category_name)
     log_pii_action(current_user.id, current_user.name, category_name, "ALL_FIELDS", "N/A", "deleted_category")
     return {"status": "success", "message": f"Category '{category_name}' deleted."}
\ No newline at end of file
@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+
+from backup_script import BACKUP_DIR, BACKUP_SET_NAME, create_database_backup, load_manifest
+from backup_changelog import run_incremental_backup
+
+load_dotenv()
+
+# --- Configuration ---
+# Mutations within this window are coalesced into a single dump
+BACKUP_DEBOUNCE_SECONDS = float(os.getenv("BACKUP_DEBOUNCE_SECONDS", 30))
+# "full" re-dumps both databases each run; "incremental" appends only the changed rows
+BACKUP_MODE = os.getenv("BACKUP_MODE", "full")
+
+def run_configured_backup(changes) -> bool:
+    if BACKUP_MODE == "incremental":
+        return run_incremental_backup(changes)
+    return create_database_backup()
+
+class BackupScheduler:
+    """
+    Runs database backups on a background thread. Vault mutations call notify(),
+    and the scheduler takes at most one dump per debounce window, so a burst of
+    writes costs a single backup instead of one per request.
+    """
+
+    def __init__(self, backup_fn=run_configured_backup, window_seconds: float = BACKUP_DEBOUNCE_SECONDS):
+        self.backup_fn = backup_fn
+        self.window_seconds = window_seconds
+        self._condition = threading.Condition()
+        self._dirty = False
+        self._changes = set()
+        self._first_event_at = None
+        self._stopping = False
+        self._thread = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.events = 0
+        self.last_attempt_at = None
+        self.last_success_at = None
+        self.last_duration_seconds = None
+        self.last_error = None
+
+    def start(self):
+        with self._condition:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="backup-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self, flush: bool = True, timeout: float = None):
+        """Stops the scheduler, taking one final backup first if changes are pending."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        if flush and self._dirty:
+            self._run_backup()
+
+    def notify(self, user_id=None, category=None):
+        """
+        Records that the databases changed and a backup is due. The user (and
+        category, if only one changed) lets incremental backups copy just those rows.
+        """
+        with self._condition:
+            self.events += 1
+            if user_id is not None:
+                self._changes.add((user_id, category))
+            if not self._dirty:
+                self._dirty = True
+                self._first_event_at = time.monotonic()
+                self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._dirty and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                # Let the window fill up with further mutations before dumping
+                deadline = self._first_event_at + self.window_seconds
+                while not self._stopping and (remaining := deadline - time.monotonic()) > 0:
+                    self._condition.wait(remaining)
+                if self._stopping:
+                    return
+            self._run_backup()
+
+    def _run_backup(self):
+        with self._condition:
+            changes, self._changes = self._changes, set()
+            self._dirty = False
+            self._first_event_at = None
+            self.running = True
+        started = time.monotonic()
+        self.last_attempt_at = datetime.utcnow()
+        try:
+            success = self.backup_fn(changes)
+            error = None if success else "Backup reported failure."
+        except Exception as e:
+            success, error = False, str(e)
+        duration = time.monotonic() - started
+        with self._condition:
+            self.running = False
+            self.runs += 1
+            self.last_error = error
+            if success:
+                self.last_success_at = datetime.utcnow()
+                self.last_duration_seconds = round(duration, 3)
+            else:
+                self.failures += 1
+                # Retry on the next window rather than dropping the pending changes
+                self._changes |= changes
+                if not self._dirty:
+                    self._dirty = True
+                    self._first_event_at = time.monotonic()
+                    self._condition.notify_all()
+
+    def status(self) -> dict:
+        with self._condition:
+            return {
+                "mode": BACKUP_MODE,
+                "window_seconds": self.window_seconds,
+                "pending": self._dirty,
+                "pending_changes": len(self._changes),
+                "running": self.running,
+                "runs": self.runs,
+                "failures": self.failures,
+                "mutation_events": self.events,
+                "last_attempt_at": self.last_attempt_at.isoformat() + "Z" if self.last_attempt_at else None,
+                "last_success_at": self.last_success_at.isoformat() + "Z" if self.last_success_at else None,
+                "last_duration_seconds": self.last_duration_seconds,
+                "last_error": self.last_error,
+                # Sizes, checksums and throughput of the newest full backup set
+                "latest_manifest": load_manifest(os.path.join(BACKUP_DIR, BACKUP_SET_NAME)),
+            }
+
+# Shared process-wide scheduler instance
+backup_scheduler = BackupScheduler()
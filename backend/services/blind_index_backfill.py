@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import and_, or_, update
+from dotenv import load_dotenv
+
+from db.session import KeySessionLocal, PiiSessionLocal
+from db.key_db import FieldKey
+from db.pii_db import CATEGORY_MODEL_MAP
+from services.crypto_service import decrypt_field
+from services.key_rotation import TokenBucket, UserKeyring
+from utils.blind_index import BLIND_INDEXED_FIELDS, blind_index_enabled, blind_index_column, blind_index_for
+from utils.key_management import get_kek_provider
+
+load_dotenv()
+
+# --- Configuration ---
+BLIND_INDEX_WORKERS = int(os.getenv("BLIND_INDEX_WORKERS", 8))
+BLIND_INDEX_BATCH_SIZE = int(os.getenv("BLIND_INDEX_BATCH_SIZE", 500))
+# Maximum KMS unwrap calls per second across all workers (0 = unlimited)
+BLIND_INDEX_KMS_RATE = float(os.getenv("BLIND_INDEX_KMS_RATE", 50))
+
+class BlindIndexBackfillJob:
+    """
+    Builds missing blind indexes from the stored ciphertext. Each category's rows
+    are walked in keyset batches of ids and every batch is spread over a worker
+    pool. Only rows with a missing index are selected, so an interrupted run
+    simply picks up the remaining rows the next time; no checkpoint is needed.
+    """
+
+    def __init__(self, workers: int = BLIND_INDEX_WORKERS, batch_size: int = BLIND_INDEX_BATCH_SIZE,
+                 kms_rate: float = BLIND_INDEX_KMS_RATE, reset: bool = False, on_change=None):
+        if not blind_index_enabled():
+            raise ValueError("Blind indexing is disabled; set BLIND_INDEX_KEY first.")
+        self.workers = workers
+        self.batch_size = batch_size
+        self.limiter = TokenBucket(kms_rate)
+        self.reset = reset
+        self.on_change = on_change
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.state = "pending"
+        self.category = None
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.stats = {"rows": 0, "fields": 0, "skipped": 0, "failed": 0, "kms_calls": 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.stats[name] += amount
+
+    # --- KMS access (used by UserKeyring) ---
+    def kms_wrap(self, key: bytes) -> bytes:
+        self.limiter.acquire()
+        self._count("kms_calls")
+        return get_kek_provider().wrap(key)
+
+    def kms_unwrap(self, wrapped: bytes) -> bytes:
+        self.limiter.acquire()
+        self._count("kms_calls")
+        return get_kek_provider().unwrap(wrapped)
+
+    # --- Batching ---
+    def _clear_indexes(self, category: str, fields):
+        PiiModel = CATEGORY_MODEL_MAP[category]
+        pii_db = PiiSessionLocal()
+        try:
+            cleared = pii_db.execute(update(PiiModel).values({blind_index_column(field_name): None for field_name in fields})).rowcount
+            pii_db.commit()
+            print(f"Cleared blind indexes of {cleared} {category} rows.")
+        finally:
+            pii_db.close()
+
+    def _next_rows(self, category: str, fields, after: int) -> list:
+        PiiModel = CATEGORY_MODEL_MAP[category]
+        missing = or_(*(and_(getattr(PiiModel, field_name).isnot(None), getattr(PiiModel, blind_index_column(field_name)).is_(None))
+                        for field_name in fields))
+        pii_db = PiiSessionLocal()
+        try:
+            return pii_db.query(PiiModel.id, PiiModel.user_id).filter(PiiModel.id > after, missing).order_by(PiiModel.id).limit(self.batch_size).all()
+        finally:
+            pii_db.close()
+
+    def _process_row(self, category: str, fields, row_id: int, user_id: int):
+        PiiModel = CATEGORY_MODEL_MAP[category]
+        key_db, pii_db = KeySessionLocal(), PiiSessionLocal()
+        keyring = UserKeyring(self, key_db, user_id)
+        try:
+            pii_row = pii_db.query(PiiModel).filter(PiiModel.id == row_id).first()
+            if pii_row is None:
+                return
+            key_rows = key_db.query(FieldKey).filter(FieldKey.user_id == user_id, FieldKey.category == category, FieldKey.field_name.in_(fields)).all()
+            filled = 0
+            for key_row in key_rows:
+                field_name = key_row.field_name
+                ciphertext = getattr(pii_row, field_name)
+                if ciphertext is None or getattr(pii_row, blind_index_column(field_name)) is not None:
+                    continue
+                plaintext = decrypt_field(ciphertext, keyring.unwrap(key_row.wrapped_dek, key_row.key_version), key_row.id, user_id, field_name, key_row.iv, key_row.auth_tag)
+                # Conditional, so a value changed concurrently (which wrote its own index) is left alone
+                result = pii_db.execute(update(PiiModel).where(PiiModel.id == row_id, getattr(PiiModel, field_name) == ciphertext)
+                                        .values({blind_index_column(field_name): blind_index_for(field_name, plaintext)}))
+                filled += result.rowcount
+                self._count("fields" if result.rowcount else "skipped")
+            pii_db.commit()
+            self._count("rows")
+            if filled and self.on_change:
+                self.on_change(user_id, category)
+        except Exception as e:
+            pii_db.rollback()
+            self._count("failed")
+            print(f"Blind index backfill failed for {category} row {row_id} (user {user_id}): {e}")
+        finally:
+            keyring.wipe()
+            key_db.close()
+            pii_db.close()
+
+    def run(self):
+        self.state, self.started_at = "running", time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="blind-index") as pool:
+                for category, fields in BLIND_INDEXED_FIELDS.items():
+                    if not fields or self._stopping.is_set():
+                        continue
+                    self.category = category
+                    if self.reset:
+                        self._clear_indexes(category, fields)
+                    last_id = 0
+                    while not self._stopping.is_set():
+                        rows = self._next_rows(category, fields, last_id)
+                        if not rows:
+                            break
+                        list(pool.map(lambda row: self._process_row(category, fields, row.id, row.user_id), rows))
+                        last_id = rows[-1].id
+            self.state = "stopped" if self._stopping.is_set() else "finished"
+        except Exception as e:
+            self.state, self.error = "failed", str(e)
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+
+    def stop(self):
+        """Asks the job to stop after the current batch; rerunning it fills in the rest."""
+        self._stopping.set()
+
+    def status(self) -> dict:
+        end = self.finished_at or time.monotonic()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        with self._lock:
+            stats = dict(self.stats)
+        return {
+            "state": self.state,
+            "error": self.error,
+            "category": self.category,
+            "elapsed_seconds": round(elapsed, 1),
+            "rows_per_second": round(stats["rows"] / elapsed, 1) if elapsed else 0.0,
+            **stats,
+        }
+
+# --- Background runs from the admin API ---
+_current_job = None
+_current_thread = None
+
+def start_backfill(reset: bool = False, on_change=None) -> BlindIndexBackfillJob:
+    """Starts a backfill on a background thread; raises RuntimeError if one is already running."""
+    global _current_job, _current_thread
+    if _current_thread is not None and _current_thread.is_alive():
+        raise RuntimeError("A blind index backfill is already running.")
+    job = BlindIndexBackfillJob(reset=reset, on_change=on_change)
+
+    def run():
+        try:
+            job.run()
+        except Exception as e:
+            print(f"Blind index backfill failed: {e}")
+
+    _current_job = job
+    _current_thread = threading.Thread(target=run, name="blind-index-backfill", daemon=True)
+    _current_thread.start()
+    return job
+
+def stop_backfill() -> bool:
+    if _current_thread is None or not _current_thread.is_alive():
+        return False
+    _current_job.stop()
+    return True
+
+def backfill_status() -> dict:
+    return _current_job.status() if _current_job else {"state": "idle"}
+
+if __name__ == "__main__":
+    from services.backup_scheduler import backup_scheduler
+
+    parser = argparse.ArgumentParser(description="Build missing blind indexes from the encrypted PII.")
+    parser.add_argument("--workers", type=int, default=BLIND_INDEX_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=BLIND_INDEX_BATCH_SIZE)
+    parser.add_argument("--kms-rate", type=float, default=BLIND_INDEX_KMS_RATE, help="Max KMS calls per second (0 = unlimited)")
+    parser.add_argument("--reset", action="store_true", help="Clear every stored index first (after changing BLIND_INDEX_KEY)")
+    parser.add_argument("--no-backup", action="store_true", help="Skip the backup normally taken once the run completes")
+    args = parser.parse_args()
+
+    job = BlindIndexBackfillJob(args.workers, args.batch_size, args.kms_rate, reset=args.reset,
+                                on_change=None if args.no_backup else backup_scheduler.notify)
+    reporter_done = threading.Event()
+
+    def report():
+        while not reporter_done.wait(5):
+            status = job.status()
+            print(f"[{datetime.now():%H:%M:%S}] {status['category']}: rows={status['rows']} fields={status['fields']} "
+                  f"skipped={status['skipped']} failed={status['failed']} kms_calls={status['kms_calls']} "
+                  f"{status['rows_per_second']} rows/s")
+
+    threading.Thread(target=report, daemon=True).start()
+    try:
+        job.run()
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command (without --reset) to fill in the remaining rows.")
+    finally:
+        reporter_done.set()
+        print(json.dumps(job.status(), indent=2))
+    if not args.no_backup:
+        backup_scheduler.stop(flush=True)
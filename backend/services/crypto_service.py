@@ -1,21 +1,95 @@
 import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.exceptions import InvalidTag
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+# Worker processes for very large seal_values/decrypt_fields batches (0 = always in-process).
+# Off by default: DEKs are pickled to the workers, so enable it for offline jobs, not request handling.
+CRYPTO_PROCESS_WORKERS = int(os.getenv("CRYPTO_PROCESS_WORKERS", 0))
+CRYPTO_PROCESS_MIN_BATCH = int(os.getenv("CRYPTO_PROCESS_MIN_BATCH", 20000))
+CRYPTO_PROCESS_CHUNK_SIZE = int(os.getenv("CRYPTO_PROCESS_CHUNK_SIZE", 5000))
 
 def generate_dek():
     return os.urandom(32)
 
-def encrypt_value(plaintext: str, dek: bytes):
-    aesgcm = AESGCM(dek)
-    iv = os.urandom(12)
-    plaintext_bytes = plaintext.encode("utf-8")
-    ciphertext_with_tag = aesgcm.encrypt(iv, plaintext_bytes, None)
-    auth_tag = ciphertext_with_tag[-16:]
-    ciphertext = ciphertext_with_tag[:-16]
-    
-    return ciphertext, iv, auth_tag
+# Stored field format (the "envelope"), kept whole in the PII column:
+#   magic "SV" | version (1 byte) | key id = FieldKey.id (4 bytes, big-endian) | nonce (12 bytes) | ciphertext+tag
+# v1 carries a legacy ciphertext repacked as-is (its IV/tag used to live in field_keys; no AAD).
+# v2 authenticates the header, user_id and field_name as AAD, so a blob moved to another
+# user, field or key row fails to decrypt.
+# FieldKey rows of envelope values keep an empty auth_tag; their iv mirrors the envelope
+# nonce, so it still changes on every write for conditional updates to compare against.
+ENVELOPE_MAGIC = b"SV"
+ENVELOPE_V1 = 1
+ENVELOPE_V2 = 2
+_HEADER = struct.Struct(">2sBI")
+NONCE_SIZE = 12
+TAG_SIZE = 16
+HEADER_SIZE = _HEADER.size + NONCE_SIZE
+
+def _field_aad(header, user_id: int, field_name: str) -> bytes:
+    return b"".join((header, struct.pack(">Q", user_id), field_name.encode("utf-8")))
+
+def seal_value(plaintext: str, dek: bytes, key_id: int, user_id: int, field_name: str) -> bytes:
+    """Encrypts a field value into a v2 envelope."""
+    nonce = os.urandom(NONCE_SIZE)
+    header = _HEADER.pack(ENVELOPE_MAGIC, ENVELOPE_V2, key_id)
+    ciphertext_with_tag = AESGCM(dek).encrypt(nonce, plaintext.encode("utf-8"), _field_aad(header, user_id, field_name))
+    return b"".join((header, nonce, ciphertext_with_tag))
+
+def pack_legacy(ciphertext: bytes, iv: bytes, auth_tag: bytes, key_id: int) -> bytes:
+    """Repacks a legacy ciphertext and its field_keys IV/tag into a v1 envelope, without decrypting it."""
+    return b"".join((_HEADER.pack(ENVELOPE_MAGIC, ENVELOPE_V1, key_id), iv, ciphertext, auth_tag))
+
+def envelope_nonce(envelope: bytes) -> bytes:
+    return bytes(memoryview(envelope)[_HEADER.size:HEADER_SIZE])
+
+def parse_envelope(data: bytes):
+    """
+    Splits an envelope into (version, key_id, nonce, ciphertext_with_tag), the
+    last two as memoryview slices of data, or returns None if data isn't one.
+    """
+    view = memoryview(data)
+    if len(view) < HEADER_SIZE + TAG_SIZE or view[:2] != ENVELOPE_MAGIC:
+        return None
+    _, version, key_id = _HEADER.unpack_from(view)
+    if version not in (ENVELOPE_V1, ENVELOPE_V2):
+        return None
+    return version, key_id, view[_HEADER.size:HEADER_SIZE], view[HEADER_SIZE:]
+
+def open_envelope(envelope, dek: bytes, user_id: int, field_name: str, aesgcm: AESGCM = None) -> str:
+    version, key_id, nonce, ciphertext_with_tag = envelope
+    aad = _field_aad(_HEADER.pack(ENVELOPE_MAGIC, version, key_id), user_id, field_name) if version == ENVELOPE_V2 else None
+    try:
+        return (aesgcm or AESGCM(dek)).decrypt(nonce, ciphertext_with_tag, aad).decode("utf-8")
+    except InvalidTag:
+        raise ValueError("Decryption failed: Authentication tag is invalid.")
+
+def decrypt_field(stored: bytes, dek: bytes, key_id: int, user_id: int, field_name: str, legacy_iv: bytes = b"", legacy_tag: bytes = b"",
+                  aesgcm: AESGCM = None) -> str:
+    """
+    Decrypts a stored field. Envelopes for this key are opened directly; a value
+    whose FieldKey still holds a tag is also tried in the legacy raw layout,
+    which covers rows not yet repacked by `python -m db.migrations envelope`.
+    """
+    envelope = parse_envelope(stored)
+    if envelope is not None and envelope[1] == key_id:
+        try:
+            return open_envelope(envelope, dek, user_id, field_name, aesgcm)
+        except ValueError:
+            if not legacy_tag:
+                raise
+    if not legacy_tag:
+        raise ValueError("Decryption failed: the stored value is not an envelope for this key.")
+    return decrypt_value(stored, legacy_iv, legacy_tag, dek)
 
 def decrypt_value(ciphertext: bytes, iv: bytes, auth_tag: bytes, dek: bytes) -> str:
+    """Legacy layout: raw ciphertext, with the IV and tag stored in field_keys."""
     aesgcm = AESGCM(dek)
     ciphertext_with_tag = ciphertext + auth_tag
     try:
@@ -26,3 +100,64 @@ def decrypt_value(ciphertext: bytes, iv: bytes, auth_tag: bytes, dek: bytes) ->
     except Exception as e:
         raise ValueError(f"An unexpected error occurred during decryption: {e}")
 
+# --- Batch API ---
+class _CipherCache:
+    """One AESGCM per DEK buffer for the length of a batch. Keyed by object identity, so no
+    immutable copy of the key is made; fields sharing a DEK should pass the same buffer."""
+
+    def __init__(self):
+        self._ciphers = {}
+
+    def get(self, dek) -> AESGCM:
+        aesgcm = self._ciphers.get(id(dek))
+        if aesgcm is None:
+            aesgcm = self._ciphers[id(dek)] = AESGCM(dek)
+        return aesgcm
+
+def _seal_chunk(items) -> list:
+    ciphers = _CipherCache()
+    # Every nonce of the chunk comes from one urandom call, sliced without copying
+    nonces = memoryview(os.urandom(NONCE_SIZE * len(items)))
+    envelopes = []
+    for i, (dek, key_id, user_id, field_name, plaintext) in enumerate(items):
+        nonce = nonces[i * NONCE_SIZE:(i + 1) * NONCE_SIZE]
+        header = _HEADER.pack(ENVELOPE_MAGIC, ENVELOPE_V2, key_id)
+        ciphertext_with_tag = ciphers.get(dek).encrypt(nonce, plaintext.encode("utf-8"), _field_aad(header, user_id, field_name))
+        envelopes.append(b"".join((header, nonce, ciphertext_with_tag)))
+    return envelopes
+
+def _decrypt_chunk(items) -> list:
+    ciphers = _CipherCache()
+    plaintexts = []
+    for dek, key_id, user_id, field_name, stored, *legacy in items:
+        try:
+            plaintexts.append(decrypt_field(stored, dek, key_id, user_id, field_name, *legacy, aesgcm=ciphers.get(dek)))
+        except Exception as e:
+            plaintexts.append(e if isinstance(e, ValueError) else ValueError(f"Decryption failed: {e}"))
+    return plaintexts
+
+_process_pool = None
+
+def _run_batch(chunk_func, items: list) -> list:
+    global _process_pool
+    if CRYPTO_PROCESS_WORKERS <= 0 or len(items) < CRYPTO_PROCESS_MIN_BATCH:
+        return chunk_func(items)
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=CRYPTO_PROCESS_WORKERS)
+    chunks = [items[start:start + CRYPTO_PROCESS_CHUNK_SIZE] for start in range(0, len(items), CRYPTO_PROCESS_CHUNK_SIZE)]
+    return [result for chunk_results in _process_pool.map(chunk_func, chunks) for result in chunk_results]
+
+def seal_values(items) -> list:
+    """
+    Batch form of seal_value: takes (dek, key_id, user_id, field_name, plaintext)
+    items and returns their v2 envelopes in order.
+    """
+    return _run_batch(_seal_chunk, list(items))
+
+def decrypt_fields(items) -> list:
+    """
+    Batch form of decrypt_field: takes (dek, key_id, user_id, field_name, stored[,
+    legacy_iv, legacy_tag]) items and returns, in order, each plaintext or the
+    ValueError that field raised, so one bad field doesn't fail the batch.
+    """
+    return _run_batch(_decrypt_chunk, list(items))
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import threading
+from collections import defaultdict
+from sqlalchemy import select, and_, or_, func
+from sqlalchemy.exc import IntegrityError
+from dotenv import load_dotenv
+
+from db.session import KeySessionLocal, PiiSessionLocal
+from db.key_db import FieldKey, PIIFingerprint
+from db.pii_db import CATEGORY_MODEL_MAP
+from services.classification import sensitivity_map
+from services.crypto_service import decrypt_field
+from services.key_rotation import TokenBucket, UserKeyring
+from utils.blind_index import BLIND_INDEXED_FIELDS, BLIND_INDEX_CATEGORY, blind_index_enabled, blind_index_column, compute_blind_index
+from utils.key_management import get_kek_provider
+
+load_dotenv()
+
+# --- Configuration ---
+# What happens when a value another account already stores is inserted, per sensitivity class:
+#   off    - no fingerprint is kept
+#   record - a fingerprint is kept for scan reports, but inserts are not checked
+#   warn   - the insert goes ahead and a duplicate_detected event is logged
+#   reject - the insert is refused with 409
+# Values stored before a policy was enabled have no fingerprint. `--seed` creates them from the
+# blind-index columns (email, adhar, passport, pan) without any KMS call; every other field is
+# only covered after `--seed-decrypt`, which decrypts the stored values at DUPLICATE_SEED_KMS_RATE.
+DUPLICATE_POLICIES = ("off", "record", "warn", "reject")
+DUPLICATE_POLICY = {
+    "high": os.getenv("DUPLICATE_POLICY_HIGH", "warn"),
+    "medium": os.getenv("DUPLICATE_POLICY_MEDIUM", "off"),
+}
+# Low-entropy fields where equal values across accounts are expected
+DUPLICATE_EXEMPT_FIELDS = {name.strip() for name in os.getenv("DUPLICATE_EXEMPT_FIELDS", "cvv").split(",") if name.strip()}
+DUPLICATE_SEED_BATCH_SIZE = int(os.getenv("DUPLICATE_SEED_BATCH_SIZE", 5000))
+# Maximum KMS unwrap calls per second while seeding by decryption (0 = unlimited)
+DUPLICATE_SEED_KMS_RATE = float(os.getenv("DUPLICATE_SEED_KMS_RATE", 50))
+
+for _sensitivity, _policy in DUPLICATE_POLICY.items():
+    if _policy not in DUPLICATE_POLICIES:
+        print(f"WARN: Unknown duplicate policy '{_policy}' for {_sensitivity} fields; using 'off'.")
+        DUPLICATE_POLICY[_sensitivity] = "off"
+
+def duplicate_policy(field_name: str) -> str:
+    # Fingerprints are blind-index HMACs, so nothing is kept while blind indexing is disabled
+    if not blind_index_enabled() or field_name in DUPLICATE_EXEMPT_FIELDS:
+        return "off"
+    return DUPLICATE_POLICY.get(sensitivity_map.get(field_name), "off")
+
+def fingerprints_for(items) -> dict:
+    """Maps (category, field_name, normalized_value) items to {(category, field_name): fingerprint} for fields whose policy keeps one."""
+    return {(category, field_name): compute_blind_index(field_name, value)
+            for category, field_name, value in items if duplicate_policy(field_name) != "off"}
+
+async def find_duplicates(key_db, user_id: int, fingerprints: dict) -> list:
+    """
+    Returns the (category, field_name) keys whose value another account already
+    stores, checking only fields with a warn or reject policy. All fields are
+    answered by one query on ix_pii_fingerprints_field_fingerprint.
+    """
+    checked = {key: fingerprint for key, fingerprint in fingerprints.items() if duplicate_policy(key[1]) in ("warn", "reject")}
+    if not checked:
+        return []
+    matched = set((await key_db.scalars(select(PIIFingerprint.field_name).where(
+        PIIFingerprint.user_id != user_id,
+        or_(*(and_(PIIFingerprint.field_name == field_name, PIIFingerprint.fingerprint == fingerprint) for (_, field_name), fingerprint in checked.items())),
+    ).distinct())).all())
+    return [key for key in checked if key[1] in matched]
+
+def fingerprint_rows(user_id: int, fingerprints: dict) -> list:
+    return [PIIFingerprint(user_id=user_id, category=category, field_name=field_name, fingerprint=fingerprint)
+            for (category, field_name), fingerprint in fingerprints.items()]
+
+# --- Seeding fingerprints for values stored before a policy was enabled ---
+def seed_from_blind_indexes(batch_size: int = DUPLICATE_SEED_BATCH_SIZE, on_change=None) -> int:
+    """Creates missing fingerprints from the PII tables' blind-index columns, which hold the same HMAC (no KMS calls)."""
+    created = 0
+    key_db, pii_db = KeySessionLocal(), PiiSessionLocal()
+    try:
+        for category, fields in BLIND_INDEXED_FIELDS.items():
+            PiiModel = CATEGORY_MODEL_MAP[category]
+            for field_name in fields:
+                if duplicate_policy(field_name) == "off":
+                    continue
+                index_column = getattr(PiiModel, blind_index_column(field_name))
+                known = {row.user_id for row in key_db.query(PIIFingerprint.user_id).filter(
+                    PIIFingerprint.category == category, PIIFingerprint.field_name == field_name)}
+                last_id = 0
+                while True:
+                    rows = pii_db.query(PiiModel.id, PiiModel.user_id, index_column).filter(
+                        PiiModel.id > last_id, index_column.isnot(None)).order_by(PiiModel.id).limit(batch_size).all()
+                    if not rows:
+                        break
+                    new = [PIIFingerprint(user_id=user_id, category=category, field_name=field_name, fingerprint=fingerprint)
+                           for _, user_id, fingerprint in rows if user_id not in known]
+                    key_db.add_all(new)
+                    key_db.commit()
+                    known.update(row.user_id for row in new)
+                    if on_change:
+                        for row in new:
+                            on_change(row.user_id, category)
+                    created += len(new)
+                    last_id = rows[-1].id
+    finally:
+        key_db.close()
+        pii_db.close()
+    return created
+
+class CiphertextFingerprintSeeder:
+    """
+    Fingerprints fields that have no blind-index column by decrypting the stored
+    values, walking users in keyset batches with KMS unwraps rate-limited as in
+    the blind index backfill. Only fields missing a fingerprint are decrypted,
+    so an interrupted run picks up the remaining ones the next time.
+    """
+
+    def __init__(self, batch_size: int = DUPLICATE_SEED_BATCH_SIZE, kms_rate: float = DUPLICATE_SEED_KMS_RATE, on_change=None):
+        self.fields = tuple(field_name for field_name in sensitivity_map
+                            if field_name not in BLIND_INDEX_CATEGORY and duplicate_policy(field_name) != "off")
+        self.batch_size = batch_size
+        self.limiter = TokenBucket(kms_rate)
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self.stats = {"users": 0, "fields": 0, "skipped": 0, "failed": 0, "kms_calls": 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.stats[name] += amount
+
+    # --- KMS access (used by UserKeyring) ---
+    def kms_wrap(self, key: bytes) -> bytes:
+        self.limiter.acquire()
+        self._count("kms_calls")
+        return get_kek_provider().wrap(key)
+
+    def kms_unwrap(self, wrapped: bytes) -> bytes:
+        self.limiter.acquire()
+        self._count("kms_calls")
+        return get_kek_provider().unwrap(wrapped)
+
+    def _next_user_ids(self, key_db, after: int) -> list:
+        return [row[0] for row in key_db.query(FieldKey.user_id).filter(FieldKey.user_id > after, FieldKey.field_name.in_(self.fields))
+                .distinct().order_by(FieldKey.user_id).limit(self.batch_size)]
+
+    def _seed_user(self, user_id: int):
+        key_db, pii_db = KeySessionLocal(), PiiSessionLocal()
+        keyring = UserKeyring(self, key_db, user_id)
+        try:
+            known = {(row.category, row.field_name) for row in key_db.query(PIIFingerprint.category, PIIFingerprint.field_name).filter(PIIFingerprint.user_id == user_id)}
+            key_rows = [row for row in key_db.query(FieldKey).filter(FieldKey.user_id == user_id, FieldKey.field_name.in_(self.fields))
+                        if (row.category, row.field_name) not in known]
+            pii_rows = {}
+            items = []
+            for key_row in key_rows:
+                PiiModel = CATEGORY_MODEL_MAP.get(key_row.category)
+                if PiiModel is None:
+                    continue
+                if key_row.category not in pii_rows:
+                    pii_rows[key_row.category] = pii_db.query(PiiModel).filter(PiiModel.user_id == user_id).first()
+                ciphertext = getattr(pii_rows[key_row.category], key_row.field_name, None)
+                if ciphertext is None:
+                    continue
+                # Stored plaintext is already normalized, exactly as fingerprinted on insert
+                items.append((key_row.category, key_row.field_name,
+                              decrypt_field(ciphertext, keyring.unwrap(key_row.wrapped_dek, key_row.key_version), key_row.id, user_id,
+                                            key_row.field_name, key_row.iv, key_row.auth_tag)))
+            fingerprints = fingerprints_for(items)
+            if fingerprints:
+                key_db.add_all(fingerprint_rows(user_id, fingerprints))
+                try:
+                    key_db.commit()
+                except IntegrityError:
+                    # The vault fingerprinted one of them concurrently; the rest are seeded next run
+                    key_db.rollback()
+                    self._count("skipped", len(fingerprints))
+                    return
+                self._count("fields", len(fingerprints))
+                if self.on_change:
+                    for category in {category for category, _ in fingerprints}:
+                        self.on_change(user_id, category)
+            self._count("users")
+        except Exception as e:
+            key_db.rollback()
+            self._count("failed")
+            print(f"Fingerprint seeding failed for user {user_id}: {e}")
+        finally:
+            keyring.wipe()
+            key_db.close()
+            pii_db.close()
+
+    def run(self) -> dict:
+        if not self.fields:
+            return dict(self.stats)
+        last_user_id = 0
+        while True:
+            key_db = KeySessionLocal()
+            try:
+                user_ids = self._next_user_ids(key_db, last_user_id)
+            finally:
+                key_db.close()
+            if not user_ids:
+                break
+            for user_id in user_ids:
+                self._seed_user(user_id)
+            last_user_id = user_ids[-1]
+        return dict(self.stats)
+
+def duplicate_report(key_db, limit: int = 100) -> dict:
+    """Per-field duplicate counts and fingerprint coverage, plus the largest groups of accounts sharing a value."""
+    accounts = func.count(func.distinct(PIIFingerprint.user_id))
+    groups = key_db.query(PIIFingerprint.field_name, PIIFingerprint.fingerprint, accounts.label("accounts")).group_by(
+        PIIFingerprint.field_name, PIIFingerprint.fingerprint).having(accounts > 1).order_by(accounts.desc()).all()
+
+    stored = dict(key_db.query(FieldKey.field_name, func.count()).group_by(FieldKey.field_name).all())
+    fingerprinted = dict(key_db.query(PIIFingerprint.field_name, func.count()).group_by(PIIFingerprint.field_name).all())
+    fields = {}
+    for field_name in sorted(set(stored) | set(fingerprinted)):
+        policy = duplicate_policy(field_name)
+        if policy == "off" and field_name not in fingerprinted:
+            continue
+        fields[field_name] = {
+            "policy": policy, "stored": stored.get(field_name, 0), "fingerprinted": fingerprinted.get(field_name, 0),
+            "duplicate_values": 0, "accounts_involved": 0,
+        }
+    for group in groups:
+        summary = fields[group.field_name]
+        summary["duplicate_values"] += 1
+        summary["accounts_involved"] += group.accounts
+
+    top = groups[:limit]
+    members = defaultdict(list)
+    if top:
+        for field_name, fingerprint, user_id in key_db.query(PIIFingerprint.field_name, PIIFingerprint.fingerprint, PIIFingerprint.user_id).filter(
+            or_(*(and_(PIIFingerprint.field_name == group.field_name, PIIFingerprint.fingerprint == group.fingerprint) for group in top))
+        ).order_by(PIIFingerprint.user_id):
+            members[(field_name, fingerprint)].append(user_id)
+    return {
+        "fields": fields,
+        # Fingerprints are truncated: enough to tell groups apart, not to test guesses against
+        "groups": [{"field_name": group.field_name, "fingerprint": group.fingerprint[:12], "user_ids": members[(group.field_name, group.fingerprint)]}
+                   for group in top],
+    }
+
+if __name__ == "__main__":
+    from services.backup_scheduler import backup_scheduler
+
+    parser = argparse.ArgumentParser(description="Report PII values stored by more than one account from their fingerprints.")
+    parser.add_argument("--seed", action="store_true", help="First create missing fingerprints from the blind-index columns")
+    parser.add_argument("--seed-decrypt", action="store_true", help="First fingerprint fields without a blind-index column by decrypting them")
+    parser.add_argument("--kms-rate", type=float, default=DUPLICATE_SEED_KMS_RATE, help="Max KMS calls per second for --seed-decrypt (0 = unlimited)")
+    parser.add_argument("--no-backup", action="store_true", help="Skip the backup normally taken after seeding")
+    parser.add_argument("--limit", type=int, default=100, help="Largest duplicate groups to list")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if not blind_index_enabled():
+        raise SystemExit("Blind indexing is disabled; set BLIND_INDEX_KEY first.")
+    on_change = None if args.no_backup else backup_scheduler.notify
+    if args.seed:
+        print(f"Seeded {seed_from_blind_indexes(on_change=on_change)} fingerprints from blind indexes.")
+    if args.seed_decrypt:
+        print(f"Seeded fingerprints by decryption: {json.dumps(CiphertextFingerprintSeeder(kms_rate=args.kms_rate, on_change=on_change).run())}")
+    if (args.seed or args.seed_decrypt) and not args.no_backup:
+        backup_scheduler.stop(flush=True)
+    key_db = KeySessionLocal()
+    try:
+        report = duplicate_report(key_db, args.limit)
+    finally:
+        key_db.close()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,499 @@
+import argparse
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from dotenv import load_dotenv
+
+from db.session import KeySessionLocal, PiiSessionLocal
+from db.key_db import FieldKey, UserKEK, KEY_VERSION_KMS, KEY_VERSION_USER_KEK
+from db.pii_db import CATEGORY_MODEL_MAP
+from services.crypto_service import generate_dek, seal_value, decrypt_field, envelope_nonce
+from utils.dek_cache import dek_cache
+from utils.kek_providers import KEKProvider, create_kek_provider, create_target_kek_provider
+from utils.key_hierarchy import KEY_HIERARCHY_VERSION, forget_user_kek
+from utils.key_management import KMS_PROVIDER, get_kek_provider
+
+load_dotenv()
+
+# --- Configuration ---
+KEY_ROTATION_CHECKPOINT = os.getenv("KEY_ROTATION_CHECKPOINT", "key_rotation_checkpoint.json")
+KEY_ROTATION_WORKERS = int(os.getenv("KEY_ROTATION_WORKERS", 8))
+KEY_ROTATION_BATCH_SIZE = int(os.getenv("KEY_ROTATION_BATCH_SIZE", 200))
+# Maximum KMS wrap/unwrap calls per second across all workers (0 = unlimited)
+KEY_ROTATION_KMS_RATE = float(os.getenv("KEY_ROTATION_KMS_RATE", 50))
+
+# rewrap:      move KMS-wrapped (v1) DEKs under the user's KEK; ciphertext is untouched
+# rewrap-keks: re-wrap every user KEK from the current master KEK to the TARGET_* one (master KEK rotation)
+# reencrypt:   generate fresh DEKs and re-encrypt the stored ciphertext
+ROTATION_MODES = ("rewrap", "rewrap-keks", "reencrypt")
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+def _unb64(data: str) -> bytes:
+    return base64.b64decode(data)
+
+def _wipe(buf: bytearray):
+    buf[:] = bytes(len(buf))
+
+class TokenBucket:
+    """Thread-safe rate limiter; callers reserve a token and sleep until it is due."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class UserKeyring:
+    """Key material for one user while the job processes them; wiped when the user is done."""
+
+    def __init__(self, job, key_db, user_id: int):
+        self.job = job
+        self.key_db = key_db
+        self.user_id = user_id
+        self._kek = None
+        self._deks = {}
+
+    def user_kek(self) -> bytearray:
+        if self._kek is None:
+            row = self.key_db.query(UserKEK).filter(UserKEK.user_id == self.user_id).first()
+            if row is not None:
+                self._kek = bytearray(self.job.kms_unwrap(row.wrapped_kek))
+            else:
+                kek = bytearray(os.urandom(32))
+                self.key_db.add(UserKEK(user_id=self.user_id, wrapped_kek=self.job.kms_wrap(kek)))
+                try:
+                    self.key_db.commit()
+                    self._kek = kek
+                except IntegrityError:
+                    # The vault created one concurrently; use that instead
+                    self.key_db.rollback()
+                    _wipe(kek)
+                    return self.user_kek()
+        return self._kek
+
+    def unwrap(self, wrapped_dek: bytes, key_version: int) -> bytearray:
+        dek = self._deks.get(wrapped_dek)
+        if dek is None:
+            if key_version == KEY_VERSION_KMS:
+                dek = bytearray(self.job.kms_unwrap(wrapped_dek))
+            else:
+                dek = bytearray(aes_key_unwrap(self.user_kek(), wrapped_dek))
+            self._deks[wrapped_dek] = dek
+        return dek
+
+    def wrap(self, dek: bytearray):
+        """Wraps a DEK under the configured hierarchy: (wrapped_dek, key_version)."""
+        if KEY_HIERARCHY_VERSION == KEY_VERSION_KMS:
+            return self.job.kms_wrap(dek), KEY_VERSION_KMS
+        return aes_key_wrap(self.user_kek(), dek), KEY_VERSION_USER_KEK
+
+    def wipe(self):
+        for dek in self._deks.values():
+            _wipe(dek)
+        self._deks.clear()
+        if self._kek is not None:
+            _wipe(self._kek)
+            self._kek = None
+
+class KeyRotationJob:
+    """
+    Walks users in keyset-paginated batches, handing each batch to a worker
+    pool. Each user is rotated in short transactions of their own, so vault
+    traffic keeps being served. Progress is checkpointed after every batch, and
+    re-encryptions are journaled before the ciphertext is replaced, so a crashed
+    run resumes where it stopped without losing data.
+    """
+
+    def __init__(self, mode: str, workers: int = KEY_ROTATION_WORKERS, batch_size: int = KEY_ROTATION_BATCH_SIZE,
+                 kms_rate: float = KEY_ROTATION_KMS_RATE, checkpoint_path: str = KEY_ROTATION_CHECKPOINT,
+                 on_change=None, restart: bool = False, source_provider: KEKProvider = None, target_provider: KEKProvider = None):
+        if mode not in ROTATION_MODES:
+            raise ValueError(f"Unknown rotation mode '{mode}'. Expected one of: {', '.join(ROTATION_MODES)}.")
+        if mode == "rewrap" and KEY_HIERARCHY_VERSION == KEY_VERSION_KMS:
+            raise ValueError("rewrap moves DEKs under user KEKs; set KEY_HIERARCHY_VERSION=2 first.")
+        if mode == "rewrap-keks":
+            # The current master key on its own, not the vault's provider that also tries the target
+            source_provider = source_provider or create_kek_provider(KMS_PROVIDER)
+            target_provider = target_provider or create_target_kek_provider(KMS_PROVIDER)
+            if target_provider is None:
+                raise ValueError("rewrap-keks needs the new master key; set TARGET_AZURE_KEY_NAME/TARGET_AZURE_KEY_VERSION or TARGET_LOCAL_KEK_PATH first.")
+        self.source_provider = source_provider
+        self.target_provider = target_provider
+        self.mode = mode
+        self.workers = workers
+        self.batch_size = batch_size
+        self.limiter = TokenBucket(kms_rate)
+        self.checkpoint_path = checkpoint_path
+        self.on_change = on_change
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.state = "pending"
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.stats = {"users": 0, "fields": 0, "skipped": 0, "failed": 0, "kms_calls": 0}
+        self.checkpoint = self._load_checkpoint(restart)
+
+    # --- Checkpointing ---
+    def _load_checkpoint(self, restart: bool) -> dict:
+        fresh = {"mode": self.mode, "last_user_id": 0, "pending": {}, "failed_users": []}
+        if restart or not os.path.exists(self.checkpoint_path):
+            return fresh
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("mode") != self.mode:
+            if checkpoint.get("pending"):
+                raise ValueError(f"Checkpoint has unfinished '{checkpoint.get('mode')}' work; resume that mode first.")
+            return fresh
+        return checkpoint
+
+    def _save_checkpoint(self):
+        # Caller must hold self._lock. Durable before any ciphertext it journals is replaced.
+        directory = os.path.dirname(os.path.abspath(self.checkpoint_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".key_rotation_")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({**self.checkpoint, "stats": self.stats}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _journal(self, key: str, entry: dict = None):
+        with self._lock:
+            if entry is None:
+                self.checkpoint["pending"].pop(key, None)
+            else:
+                self.checkpoint["pending"][key] = entry
+            self._save_checkpoint()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.stats[name] += amount
+
+    # --- KMS access (provider defaults to the vault's) ---
+    def kms_wrap(self, key: bytes, provider: KEKProvider = None) -> bytes:
+        self.limiter.acquire()
+        self._count("kms_calls")
+        return (provider or get_kek_provider()).wrap(key)
+
+    def kms_unwrap(self, wrapped: bytes, provider: KEKProvider = None) -> bytes:
+        self.limiter.acquire()
+        self._count("kms_calls")
+        return (provider or get_kek_provider()).unwrap(wrapped)
+
+    # --- Batching ---
+    def _next_user_ids(self, after: int) -> list:
+        key_db = KeySessionLocal()
+        try:
+            if self.mode == "rewrap-keks":
+                query = key_db.query(UserKEK.user_id).filter(UserKEK.user_id > after)
+                column = UserKEK.user_id
+            else:
+                query = key_db.query(FieldKey.user_id).filter(FieldKey.user_id > after)
+                if self.mode == "rewrap":
+                    query = query.filter(FieldKey.key_version == KEY_VERSION_KMS)
+                column = FieldKey.user_id
+            return [row[0] for row in query.distinct().order_by(column).limit(self.batch_size)]
+        finally:
+            key_db.close()
+
+    def _process_user(self, user_id: int):
+        handler = {"rewrap": self._rewrap_user, "rewrap-keks": self._rewrap_user_kek, "reencrypt": self._reencrypt_user}[self.mode]
+        try:
+            handler(user_id)
+            self._count("users")
+        except Exception as e:
+            self._count("failed")
+            with self._lock:
+                self.checkpoint["failed_users"].append(user_id)
+            print(f"Key rotation ({self.mode}) failed for user {user_id}: {e}")
+
+    def run(self):
+        self.state, self.started_at = "running", time.monotonic()
+        try:
+            self._recover_pending()
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="key-rotation") as pool:
+                while not self._stopping.is_set():
+                    user_ids = self._next_user_ids(self.checkpoint["last_user_id"])
+                    if not user_ids:
+                        break
+                    list(pool.map(self._process_user, user_ids))
+                    with self._lock:
+                        self.checkpoint["last_user_id"] = user_ids[-1]
+                        self._save_checkpoint()
+            self.state = "stopped" if self._stopping.is_set() else "finished"
+        except Exception as e:
+            self.state, self.error = "failed", str(e)
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+
+    def stop(self):
+        """Asks the job to stop after the current batch; it resumes from the checkpoint."""
+        self._stopping.set()
+
+    def status(self) -> dict:
+        end = self.finished_at or time.monotonic()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        with self._lock:
+            stats = dict(self.stats)
+            last_user_id = self.checkpoint["last_user_id"]
+            pending = len(self.checkpoint["pending"])
+        return {
+            "mode": self.mode,
+            "state": self.state,
+            "error": self.error,
+            "last_user_id": last_user_id,
+            "pending_journal_entries": pending,
+            "elapsed_seconds": round(elapsed, 1),
+            "fields_per_second": round(stats["fields"] / elapsed, 1) if elapsed else 0.0,
+            "users_per_second": round(stats["users"] / elapsed, 1) if elapsed else 0.0,
+            **stats,
+        }
+
+    # --- Modes ---
+    def _rewrap_user(self, user_id: int):
+        key_db = KeySessionLocal()
+        keyring = UserKeyring(self, key_db, user_id)
+        try:
+            rows = key_db.query(FieldKey).filter(FieldKey.user_id == user_id, FieldKey.key_version == KEY_VERSION_KMS).all()
+            rewrapped = {}
+            for row in rows:
+                if row.wrapped_dek not in rewrapped:
+                    rewrapped[row.wrapped_dek] = keyring.wrap(keyring.unwrap(row.wrapped_dek, row.key_version))[0]
+                # Conditional, so a row changed concurrently is left for the next run
+                result = key_db.execute(update(FieldKey).where(FieldKey.id == row.id, FieldKey.wrapped_dek == row.wrapped_dek)
+                                        .values(wrapped_dek=rewrapped[row.wrapped_dek], key_version=KEY_VERSION_USER_KEK))
+                self._count("fields" if result.rowcount else "skipped")
+            key_db.commit()
+            if rows and self.on_change:
+                self.on_change(user_id)
+        finally:
+            keyring.wipe()
+            key_db.close()
+
+    def _rewrap_user_kek(self, user_id: int):
+        key_db = KeySessionLocal()
+        try:
+            row = key_db.query(UserKEK).filter(UserKEK.user_id == user_id).first()
+            if row is None:
+                return
+            # Read before the commit below expires the row
+            old_wrapped = row.wrapped_kek
+            try:
+                kek = bytearray(self.kms_unwrap(old_wrapped, self.source_provider))
+            except Exception:
+                # Created under the target while the rotation runs, or moved by an earlier run;
+                # an error here means neither key can unwrap it
+                self.kms_unwrap(old_wrapped, self.target_provider)
+                self._count("skipped")
+                return
+            try:
+                new_wrapped = self.kms_wrap(kek, self.target_provider)
+            finally:
+                _wipe(kek)
+            result = key_db.execute(update(UserKEK).where(UserKEK.id == row.id, UserKEK.wrapped_kek == old_wrapped).values(wrapped_kek=new_wrapped))
+            key_db.commit()
+            if not result.rowcount:
+                self._count("skipped")
+                return
+            # Drop this process's copies keyed by the old wrapped form (the KEK itself is unchanged)
+            forget_user_kek(user_id)
+            dek_cache.discard(old_wrapped)
+            self._count("fields")
+            if self.on_change:
+                self.on_change(user_id)
+        finally:
+            key_db.close()
+
+    def _reencrypt_user(self, user_id: int):
+        key_db, pii_db = KeySessionLocal(), PiiSessionLocal()
+        keyring = UserKeyring(self, key_db, user_id)
+        try:
+            rows_by_category = defaultdict(list)
+            for row in key_db.query(FieldKey).filter(FieldKey.user_id == user_id).all():
+                rows_by_category[row.category].append(row)
+            for category, rows in rows_by_category.items():
+                if self._reencrypt_category(key_db, pii_db, keyring, user_id, category, rows) and self.on_change:
+                    self.on_change(user_id, category)
+        finally:
+            keyring.wipe()
+            key_db.close()
+            pii_db.close()
+
+    def _reencrypt_category(self, key_db, pii_db, keyring, user_id, category, rows) -> bool:
+        PiiModel = CATEGORY_MODEL_MAP.get(category)
+        pii_row = pii_db.query(PiiModel).filter(PiiModel.user_id == user_id).first() if PiiModel else None
+        if pii_row is None:
+            return False
+        # Fresh DEK per high field and one shared DEK per category for medium fields, as the vault does
+        new_deks, shared_medium = [], None
+        plan = []
+        try:
+            for row in rows:
+                old_ciphertext = getattr(pii_row, row.field_name, None)
+                if old_ciphertext is None:
+                    continue
+                plaintext = decrypt_field(old_ciphertext, keyring.unwrap(row.wrapped_dek, row.key_version), row.id, user_id, row.field_name, row.iv, row.auth_tag)
+                if row.sensitivity == "medium" and shared_medium is not None:
+                    dek, wrapped_dek, key_version = shared_medium
+                else:
+                    dek = bytearray(generate_dek())
+                    new_deks.append(dek)
+                    wrapped_dek, key_version = keyring.wrap(dek)
+                    if row.sensitivity == "medium":
+                        shared_medium = (dek, wrapped_dek, key_version)
+                # Re-encryption also upgrades legacy and v1 values to v2 envelopes
+                ciphertext = seal_value(plaintext, dek, row.id, user_id, row.field_name)
+                plan.append((row, old_ciphertext, ciphertext, wrapped_dek, key_version))
+        finally:
+            for dek in new_deks:
+                _wipe(dek)
+        if not plan:
+            return False
+
+        # Journal the new key material first: if the process dies after the ciphertext
+        # is replaced, recovery can still point the FieldKey rows at the right DEKs.
+        journal_key = f"{user_id}:{category}"
+        self._journal(journal_key, {
+            "user_id": user_id, "category": category,
+            "items": [{
+                "field_key_id": row.id, "field_name": row.field_name, "old_iv": _b64(row.iv),
+                "wrapped_dek": _b64(wrapped_dek), "key_version": key_version,
+            } for row, _, _, wrapped_dek, key_version in plan],
+        })
+        # Only replace ciphertext nobody changed since it was read
+        conditions = [getattr(PiiModel, row.field_name) == old for row, old, *_ in plan]
+        result = pii_db.execute(update(PiiModel).where(PiiModel.user_id == user_id, *conditions)
+                                .values({row.field_name: ciphertext for row, _, ciphertext, *_ in plan}))
+        pii_db.commit()
+        if result.rowcount:
+            self._apply_field_keys(key_db, [(row.id, row.iv, wrapped_dek, key_version, envelope_nonce(ciphertext))
+                                            for row, _, ciphertext, wrapped_dek, key_version in plan])
+            self._count("fields", len(plan))
+        else:
+            self._count("skipped", len(plan))
+        self._journal(journal_key)
+        return bool(result.rowcount)
+
+    def _apply_field_keys(self, key_db, updates):
+        for field_key_id, old_iv, wrapped_dek, key_version, nonce in updates:
+            key_db.execute(update(FieldKey).where(FieldKey.id == field_key_id, FieldKey.iv == old_iv)
+                           .values(wrapped_dek=wrapped_dek, key_version=key_version, iv=nonce, auth_tag=b""))
+        key_db.commit()
+
+    def _recover_pending(self):
+        """Finishes journaled re-encryptions: rows whose ciphertext already opens with the new DEK get the new key."""
+        for journal_key, entry in list(self.checkpoint["pending"].items()):
+            user_id, PiiModel = entry["user_id"], CATEGORY_MODEL_MAP[entry["category"]]
+            key_db, pii_db = KeySessionLocal(), PiiSessionLocal()
+            keyring = UserKeyring(self, key_db, user_id)
+            try:
+                pii_row = pii_db.query(PiiModel).filter(PiiModel.user_id == user_id).first()
+                updates = []
+                for item in entry["items"]:
+                    ciphertext = getattr(pii_row, item["field_name"], None) if pii_row else None
+                    wrapped_dek = _unb64(item["wrapped_dek"])
+                    try:
+                        decrypt_field(ciphertext, keyring.unwrap(wrapped_dek, item["key_version"]), item["field_key_id"], user_id, item["field_name"])
+                    except Exception:
+                        continue  # Ciphertext was never replaced (or changed since); the old key still applies
+                    updates.append((item["field_key_id"], _unb64(item["old_iv"]), wrapped_dek, item["key_version"], envelope_nonce(ciphertext)))
+                if updates:
+                    self._apply_field_keys(key_db, updates)
+                    print(f"Recovered {len(updates)} re-encrypted fields for user {user_id} ({entry['category']}).")
+                self._journal(journal_key)
+            finally:
+                keyring.wipe()
+                key_db.close()
+                pii_db.close()
+
+# --- Background runs from the admin API ---
+_current_job = None
+_current_thread = None
+
+def start_rotation(mode: str, restart: bool = False, on_change=None) -> KeyRotationJob:
+    """Starts a rotation job on a background thread; raises RuntimeError if one is already running."""
+    global _current_job, _current_thread
+    if _current_thread is not None and _current_thread.is_alive():
+        raise RuntimeError("A key rotation job is already running.")
+    job = KeyRotationJob(mode, restart=restart, on_change=on_change)
+
+    def run():
+        try:
+            job.run()
+        except Exception as e:
+            print(f"Key rotation ({mode}) failed: {e}")
+
+    _current_job = job
+    _current_thread = threading.Thread(target=run, name="key-rotation", daemon=True)
+    _current_thread.start()
+    return job
+
+def stop_rotation() -> bool:
+    if _current_thread is None or not _current_thread.is_alive():
+        return False
+    _current_job.stop()
+    return True
+
+def rotation_status() -> dict:
+    return _current_job.status() if _current_job else {"state": "idle"}
+
+if __name__ == "__main__":
+    from services.backup_scheduler import backup_scheduler
+
+    parser = argparse.ArgumentParser(description="Rotate field keys: re-wrap DEKs or re-encrypt PII with fresh DEKs.")
+    parser.add_argument("mode", choices=ROTATION_MODES)
+    parser.add_argument("--workers", type=int, default=KEY_ROTATION_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=KEY_ROTATION_BATCH_SIZE)
+    parser.add_argument("--kms-rate", type=float, default=KEY_ROTATION_KMS_RATE, help="Max KMS calls per second (0 = unlimited)")
+    parser.add_argument("--checkpoint", default=KEY_ROTATION_CHECKPOINT)
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start from the first user")
+    parser.add_argument("--no-backup", action="store_true", help="Skip the backup normally taken once the run completes")
+    args = parser.parse_args()
+
+    job = KeyRotationJob(args.mode, args.workers, args.batch_size, args.kms_rate, args.checkpoint,
+                         on_change=None if args.no_backup else backup_scheduler.notify, restart=args.restart)
+    reporter_done = threading.Event()
+
+    def report():
+        while not reporter_done.wait(5):
+            status = job.status()
+            print(f"[{datetime.now():%H:%M:%S}] users={status['users']} fields={status['fields']} "
+                  f"skipped={status['skipped']} failed={status['failed']} kms_calls={status['kms_calls']} "
+                  f"{status['fields_per_second']} fields/s (last user {status['last_user_id']})")
+
+    threading.Thread(target=report, daemon=True).start()
+    try:
+        job.run()
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume from the checkpoint.")
+    finally:
+        reporter_done.set()
+        print(json.dumps(job.status(), indent=2))
+    if not args.no_backup:
+        # One backup for the whole run instead of one per field
+        backup_scheduler.stop(flush=True)
@@ -0,0 +1,124 @@
+import argparse
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+from db.session import PiiSessionLocal
+from db.pii_db import LoginAttempt
+
+load_dotenv()
+
+# --- Configuration ---
+LOGIN_AUDIT_BATCH_SIZE = int(os.getenv("LOGIN_AUDIT_BATCH_SIZE", 200))
+LOGIN_AUDIT_FLUSH_SECONDS = float(os.getenv("LOGIN_AUDIT_FLUSH_SECONDS", 2))
+LOGIN_AUDIT_MAX_QUEUE = int(os.getenv("LOGIN_AUDIT_MAX_QUEUE", 50000))
+LOGIN_ATTEMPT_RETENTION_DAYS = int(os.getenv("LOGIN_ATTEMPT_RETENTION_DAYS", 90))
+LOGIN_ATTEMPT_PRUNE_INTERVAL_SECONDS = float(os.getenv("LOGIN_ATTEMPT_PRUNE_INTERVAL_SECONDS", 3600))
+PRUNE_CHUNK_SIZE = 10000
+
+def prune_login_attempts(retention_days: int = LOGIN_ATTEMPT_RETENTION_DAYS) -> int:
+    """Deletes login attempts older than the retention period in chunks, returning the row count."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = 0
+    db = PiiSessionLocal()
+    try:
+        while True:
+            ids = [row.id for row in db.query(LoginAttempt.id).filter(LoginAttempt.attempt_time < cutoff).limit(PRUNE_CHUNK_SIZE)]
+            if not ids:
+                return deleted
+            db.query(LoginAttempt).filter(LoginAttempt.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+            deleted += len(ids)
+    finally:
+        db.close()
+
+class LoginAuditWriter:
+    """
+    Writes LoginAttempt audit rows in batches from a background thread, so the
+    login path only enqueues. Also runs the retention job on a fixed interval.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=LOGIN_AUDIT_MAX_QUEUE)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._last_prune = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.pruned = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="login-audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def record(self, username: str, ip_address: str, successful: bool, user_agent: str = None):
+        row = {
+            "username": username, "ip_address": ip_address, "successful": successful,
+            "user_agent": user_agent, "attempt_time": datetime.utcnow(),
+        }
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Lockout decisions use the in-memory counters, so losing an audit row never weakens them
+            self.dropped += 1
+
+    def _drain(self, first_timeout: float) -> list:
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=first_timeout))
+            while len(batch) < LOGIN_AUDIT_BATCH_SIZE:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, batch: list):
+        db = PiiSessionLocal()
+        try:
+            db.bulk_insert_mappings(LoginAttempt, batch)
+            db.commit()
+            self.written += len(batch)
+        except Exception as e:
+            db.rollback()
+            self.dropped += len(batch)
+            print(f"Error writing login audit batch: {e}")
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._drain(LOGIN_AUDIT_FLUSH_SECONDS)
+            if batch:
+                self._write(batch)
+            if time.monotonic() - self._last_prune >= LOGIN_ATTEMPT_PRUNE_INTERVAL_SECONDS:
+                self._last_prune = time.monotonic()
+                try:
+                    self.pruned += prune_login_attempts()
+                except Exception as e:
+                    print(f"Error pruning login attempts: {e}")
+        # Flush whatever is left on shutdown
+        while batch := self._drain(0):
+            self._write(batch)
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped, "pruned": self.pruned}
+
+# Shared process-wide writer
+login_audit_writer = LoginAuditWriter()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete login attempts older than the retention period.")
+    parser.add_argument("--days", type=int, default=LOGIN_ATTEMPT_RETENTION_DAYS)
+    args = parser.parse_args()
+    print(f"Deleted {prune_login_attempts(args.days)} login attempts older than {args.days} days.")
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+
+from utils.executor import run_blocking
+
+load_dotenv()
+
+# --- Configuration ---
+STARTUP_RETRY_INITIAL_SECONDS = float(os.getenv("STARTUP_RETRY_INITIAL_SECONDS", 1))
+STARTUP_RETRY_MAX_SECONDS = float(os.getenv("STARTUP_RETRY_MAX_SECONDS", 30))
+
+class Readiness:
+    """Tracks which startup dependencies are initialised, for the /readyz probe."""
+
+    def __init__(self, components):
+        self._lock = threading.Lock()
+        self._state = {name: {"ready": False, "error": None, "since": None, "attempts": 0} for name in components}
+        self._started = time.monotonic()
+
+    def mark_ready(self, name: str):
+        with self._lock:
+            self._state[name].update(ready=True, error=None, since=datetime.utcnow().isoformat() + "Z")
+
+    def mark_failed(self, name: str, error: str):
+        with self._lock:
+            state = self._state[name]
+            state.update(ready=False, error=error, attempts=state["attempts"] + 1)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "ready": all(state["ready"] for state in self._state.values()),
+                "uptime_seconds": round(time.monotonic() - self._started, 1),
+                "components": {name: dict(state) for name, state in self._state.items()},
+            }
+
+async def initialise_until_ready(readiness: Readiness, name: str, func):
+    """Runs a blocking initialiser off the event loop, retrying with capped exponential backoff."""
+    delay = STARTUP_RETRY_INITIAL_SECONDS
+    while True:
+        try:
+            await run_blocking(func)
+            readiness.mark_ready(name)
+            return
+        except Exception as e:
+            readiness.mark_failed(name, str(e))
+            print(f"WARN: {name} initialisation failed, retrying in {delay:.0f}s: {e}")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
+
+# Shared process-wide readiness state
+readiness = Readiness(["database", "kms"])
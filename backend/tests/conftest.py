@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules import each other relative to backend/ (e.g. "from db.session import ..."), as when run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
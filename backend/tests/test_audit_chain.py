@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip("dotenv")
+
+from utils.audit_chain import AuditChainWriter, check_anchor, verify_log
+
+KEY = b"test-audit-key"
+BLOCK_SIZE = 4
+
+def write_log(path, records: int) -> AuditChainWriter:
+    writer = AuditChainWriter(str(path), KEY, BLOCK_SIZE)
+    for i in range(records):
+        writer.append({"event": "pii_action", "n": i})
+    writer.close()
+    return writer
+
+def verify(path, key: bytes = KEY) -> dict:
+    return verify_log(str(path), key, BLOCK_SIZE, workers=1)
+
+def rewrite_lines(path, edit):
+    lines = path.read_bytes().splitlines(keepends=True)
+    path.write_bytes(b"".join(edit(lines)))
+
+def test_intact_chain_verifies_and_resumes(tmp_path):
+    log = tmp_path / "audit.log"
+    write_log(log, 10)
+    # A second writer continues the same chain from the file's last line
+    writer = write_log(log, 3)
+    report = verify(log)
+    assert report["ok"], report["errors"]
+    assert (report["records_checked"], report["seq"], report["head"]) == (13, 13, writer.head)
+
+def test_modified_record_is_detected(tmp_path):
+    log = tmp_path / "audit.log"
+    write_log(log, 10)
+    rewrite_lines(log, lambda lines: [line.replace(b'"n":6', b'"n":7') for line in lines])
+    assert not verify(log)["ok"]
+
+def test_removed_record_is_detected(tmp_path):
+    log = tmp_path / "audit.log"
+    write_log(log, 10)
+    rewrite_lines(log, lambda lines: lines[:2] + lines[3:])
+    assert not verify(log)["ok"]
+
+def test_wrong_key_fails_verification(tmp_path):
+    log = tmp_path / "audit.log"
+    write_log(log, 3)
+    assert not verify(log, b"another-key")["ok"]
+
+def test_truncated_tail_needs_an_external_anchor(tmp_path):
+    log = tmp_path / "audit.log"
+    writer = AuditChainWriter(str(log), KEY, BLOCK_SIZE)
+    for i in range(7):
+        writer.append({"n": i})
+    anchor = writer.anchor()
+    writer.close()
+    assert check_anchor(str(log), anchor["seq"], anchor["head"])
+
+    # Dropping the last records leaves a valid, shorter chain; only the anchor exposes it
+    rewrite_lines(log, lambda lines: lines[:-2])
+    assert verify(log)["ok"]
+    assert not check_anchor(str(log), anchor["seq"], anchor["head"])
+
+def test_writer_refuses_to_run_without_a_key(tmp_path):
+    with pytest.raises(ValueError):
+        AuditChainWriter(str(tmp_path / "audit.log"), b"", BLOCK_SIZE)
+    with pytest.raises(ValueError):
+        verify(tmp_path / "audit.log", b"")
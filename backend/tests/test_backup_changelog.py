@@ -0,0 +1,119 @@
+import os
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+pytest.importorskip("cryptography")
+pytest.importorskip("dotenv")
+# db.session builds its MySQL engines at import time
+pytest.importorskip("pymysql")
+pytest.importorskip("aiomysql")
+
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import backup_changelog
+from backup_changelog import capture_changes, write_segment, read_segment
+from restore_backup import apply_record
+from db.key_db import Base as KeyBase, FieldKey, UserKEK, PIIFingerprint, KEY_VERSION_USER_KEK
+from db.pii_db import Base as PiiBase, User, FinancialInfo
+from services.crypto_service import generate_dek, seal_value, envelope_nonce, decrypt_field
+from utils.kek_providers import LocalKEKProvider
+
+CATEGORY = "Financial Info"
+
+def make_sessions():
+    """In-memory PII and key databases; foreign keys are enforced like on MySQL."""
+    pii_engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    key_engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    event.listen(pii_engine, "connect", lambda connection, _: connection.execute("PRAGMA foreign_keys=ON"))
+    PiiBase.metadata.create_all(pii_engine)
+    KeyBase.metadata.create_all(key_engine)
+    return sessionmaker(bind=pii_engine), sessionmaker(bind=key_engine)
+
+@pytest.fixture
+def live(monkeypatch, tmp_path):
+    pii_sessions, key_sessions = make_sessions()
+    monkeypatch.setattr(backup_changelog, "PiiSessionLocal", pii_sessions)
+    monkeypatch.setattr(backup_changelog, "KeySessionLocal", key_sessions)
+    monkeypatch.setattr(backup_changelog, "CHANGELOG_DIR", str(tmp_path))
+    return pii_sessions, key_sessions
+
+def store_value(pii_sessions, key_sessions, master, value: str) -> int:
+    """Registers a user and stores one creditnum the way the vault does: DEK under the user's KEK, KEK under the master."""
+    pii_db, key_db = pii_sessions(), key_sessions()
+    try:
+        user = User(name="New User", email="new@example.com", hashed_password="$2b$12$hash")
+        pii_db.add(user)
+        pii_db.commit()
+        kek, dek = os.urandom(32), generate_dek()
+        key_db.add(UserKEK(user_id=user.id, wrapped_kek=master.wrap(kek)))
+        key_row = FieldKey(user_id=user.id, category=CATEGORY, field_name="creditnum", sensitivity="high",
+                           wrapped_dek=aes_key_wrap(kek, dek), iv=b"", auth_tag=b"", key_salt=b"", key_version=KEY_VERSION_USER_KEK)
+        key_db.add(key_row)
+        key_db.flush()
+        envelope = seal_value(value, dek, key_row.id, user.id, "creditnum")
+        key_row.iv = envelope_nonce(envelope)
+        pii_db.add(FinancialInfo(user_id=user.id, creditnum=envelope))
+        key_db.add(PIIFingerprint(user_id=user.id, category=CATEGORY, field_name="creditnum", fingerprint="f" * 64))
+        key_db.commit()
+        pii_db.commit()
+        return user.id
+    finally:
+        pii_db.close()
+        key_db.close()
+
+def replay(records, pii_sessions, key_sessions):
+    path = write_segment(1, records)
+    pii_db, key_db = pii_sessions(), key_sessions()
+    try:
+        for record in read_segment(path):
+            apply_record(record, pii_db, key_db)
+        key_db.commit()
+        pii_db.commit()
+    finally:
+        pii_db.close()
+        key_db.close()
+
+def test_new_user_round_trips_through_the_change_log(live):
+    master = LocalKEKProvider(algorithm="aes-kw", key_path=None)
+    user_id = store_value(*live, master, "4111111111111111")
+
+    # Restored from a snapshot taken before the user registered
+    restored_pii, restored_keys = make_sessions()
+    replay(capture_changes({(user_id, CATEGORY)}), restored_pii, restored_keys)
+
+    pii_db, key_db = restored_pii(), restored_keys()
+    try:
+        assert pii_db.query(User).filter(User.id == user_id).one().email == "new@example.com"
+        wrapped_kek = key_db.query(UserKEK.wrapped_kek).filter(UserKEK.user_id == user_id).scalar()
+        key_row = key_db.query(FieldKey).filter(FieldKey.user_id == user_id).one()
+        stored = pii_db.query(FinancialInfo.creditnum).filter(FinancialInfo.user_id == user_id).scalar()
+        dek = aes_key_unwrap(master.unwrap(wrapped_kek), key_row.wrapped_dek)
+        assert decrypt_field(stored, dek, key_row.id, user_id, "creditnum", key_row.iv, key_row.auth_tag) == "4111111111111111"
+        assert key_db.query(PIIFingerprint.fingerprint).filter(PIIFingerprint.user_id == user_id).scalar() == "f" * 64
+    finally:
+        pii_db.close()
+        key_db.close()
+
+def test_category_record_carries_password_change(live):
+    pii_sessions, key_sessions = live
+    master = LocalKEKProvider(algorithm="aes-kw", key_path=None)
+    user_id = store_value(pii_sessions, key_sessions, master, "4111111111111111")
+    restored_pii, restored_keys = make_sessions()
+    replay(capture_changes({(user_id, CATEGORY)}), restored_pii, restored_keys)
+
+    pii_db = pii_sessions()
+    try:
+        pii_db.query(User).filter(User.id == user_id).one().hashed_password = "$2b$12$changed"
+        pii_db.commit()
+    finally:
+        pii_db.close()
+    replay(capture_changes({(user_id, CATEGORY)}), restored_pii, restored_keys)
+
+    pii_db = restored_pii()
+    try:
+        assert pii_db.query(User.hashed_password).filter(User.id == user_id).scalar() == "$2b$12$changed"
+    finally:
+        pii_db.close()
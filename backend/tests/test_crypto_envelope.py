@@ -0,0 +1,92 @@
+import os
+import pytest
+
+pytest.importorskip("cryptography")
+pytest.importorskip("dotenv")
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from services import crypto_service
+from services.crypto_service import (ENVELOPE_V1, ENVELOPE_V2, generate_dek, seal_value, pack_legacy, parse_envelope,
+                                     envelope_nonce, decrypt_field, decrypt_fields, seal_values)
+
+def legacy_encrypt(plaintext: str, dek: bytes):
+    """The pre-envelope layout: raw ciphertext in the PII column, IV and tag in field_keys."""
+    iv = os.urandom(12)
+    sealed = AESGCM(dek).encrypt(iv, plaintext.encode("utf-8"), None)
+    return sealed[:-16], iv, sealed[-16:]
+
+def test_envelope_round_trip():
+    dek = generate_dek()
+    envelope = seal_value("4111111111111111", dek, 7, 42, "creditnum")
+    version, key_id, nonce, _ = parse_envelope(envelope)
+    assert (version, key_id, bytes(nonce)) == (ENVELOPE_V2, 7, envelope_nonce(envelope))
+    assert decrypt_field(envelope, dek, 7, 42, "creditnum") == "4111111111111111"
+
+@pytest.mark.parametrize("key_id, user_id, field_name", [(8, 42, "creditnum"), (7, 43, "creditnum"), (7, 42, "accnum")])
+def test_envelope_is_bound_to_its_key_user_and_field(key_id, user_id, field_name):
+    dek = generate_dek()
+    envelope = seal_value("4111111111111111", dek, 7, 42, "creditnum")
+    with pytest.raises(ValueError):
+        decrypt_field(envelope, dek, key_id, user_id, field_name)
+
+def test_tampered_envelope_is_rejected():
+    dek = generate_dek()
+    envelope = bytearray(seal_value("4111111111111111", dek, 7, 42, "creditnum"))
+    envelope[-1] ^= 1
+    with pytest.raises(ValueError):
+        decrypt_field(bytes(envelope), dek, 7, 42, "creditnum")
+
+def test_legacy_values_still_decrypt():
+    dek = generate_dek()
+    ciphertext, iv, tag = legacy_encrypt("AB1234567", dek)
+    assert decrypt_field(ciphertext, dek, 7, 42, "passport", iv, tag) == "AB1234567"
+    # Without the field_keys IV/tag a raw value is refused rather than misread
+    with pytest.raises(ValueError):
+        decrypt_field(ciphertext, dek, 7, 42, "passport")
+
+def test_repacked_legacy_value_opens_as_v1():
+    dek = generate_dek()
+    ciphertext, iv, tag = legacy_encrypt("AB1234567", dek)
+    envelope = pack_legacy(ciphertext, iv, tag, 7)
+    assert parse_envelope(envelope)[0] == ENVELOPE_V1
+    assert decrypt_field(envelope, dek, 7, 42, "passport") == "AB1234567"
+
+def test_batch_api_matches_per_call():
+    deks = [bytearray(generate_dek()) for _ in range(3)]
+    items = [(deks[i % 3], i, 42, "field", f"value-{i}") for i in range(10)]
+    envelopes = seal_values(items)
+    assert [decrypt_field(envelope, dek, key_id, user_id, field_name)
+            for (dek, key_id, user_id, field_name, _), envelope in zip(items, envelopes)] == [item[4] for item in items]
+    results = decrypt_fields([(dek, key_id, user_id, "other" if key_id == 3 else field_name, envelope)
+                              for (dek, key_id, user_id, field_name, _), envelope in zip(items, envelopes)])
+    assert isinstance(results[3], ValueError)
+    assert [result for i, result in enumerate(results) if i != 3] == [item[4] for i, item in enumerate(items) if i != 3]
+
+def test_batch_round_trip_isolates_a_tampered_item():
+    dek = bytearray(generate_dek())
+    envelopes = seal_values([(dek, i, 42, "creditnum", f"4111-1111-1111-111{i}") for i in range(4)])
+    assert len({envelope_nonce(envelope) for envelope in envelopes}) == 4
+    tampered = bytearray(envelopes[2])
+    tampered[-1] ^= 1
+    envelopes[2] = bytes(tampered)
+    ciphertext, iv, tag = legacy_encrypt("AB1234567", dek)
+
+    results = decrypt_fields([(dek, i, 42, "creditnum", envelope) for i, envelope in enumerate(envelopes)]
+                             + [(dek, 9, 42, "passport", ciphertext, iv, tag)])
+
+    assert isinstance(results[2], ValueError)
+    assert [result for i, result in enumerate(results) if i != 2] == ["4111-1111-1111-1110", "4111-1111-1111-1111", "4111-1111-1111-1113", "AB1234567"]
+
+def test_process_pool_batches_keep_their_order(monkeypatch):
+    monkeypatch.setattr(crypto_service, "CRYPTO_PROCESS_WORKERS", 2)
+    monkeypatch.setattr(crypto_service, "CRYPTO_PROCESS_MIN_BATCH", 1)
+    monkeypatch.setattr(crypto_service, "CRYPTO_PROCESS_CHUNK_SIZE", 3)
+    monkeypatch.setattr(crypto_service, "_process_pool", None)
+    dek = bytearray(generate_dek())
+    try:
+        envelopes = seal_values([(dek, i, 42, "field", f"value-{i}") for i in range(10)])
+        results = decrypt_fields([(dek, i, 42, "field", envelope) for i, envelope in enumerate(envelopes)])
+    finally:
+        crypto_service._process_pool.shutdown()
+    assert results == [f"value-{i}" for i in range(10)]
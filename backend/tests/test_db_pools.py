@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("dotenv")
+# db.session builds its MySQL engines at import time; the pools under test run on SQLite
+pytest.importorskip("pymysql")
+pytest.importorskip("aiomysql")
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from db import session
+from db.session import TimedQueuePool, pool_options
+
+def sqlite_engine(path, **options):
+    return create_engine(f"sqlite:///{path}", poolclass=TimedQueuePool,
+                         **{"pool_size": 2, "max_overflow": 0, "pool_timeout": 0.05, **options})
+
+def test_per_database_settings_override_the_defaults(monkeypatch):
+    monkeypatch.setenv("KEY_DB_POOL_SIZE", "3")
+    monkeypatch.setenv("KEY_DB_POOL_PRE_PING", "false")
+    options = pool_options("KEY_DB")
+    assert (options["pool_size"], options["pool_pre_ping"]) == (3, False)
+    assert pool_options("PII_DB")["pool_size"] == session.DB_POOL_SIZE
+
+def test_checkout_waits_and_timeouts_are_counted(tmp_path):
+    engine = sqlite_engine(tmp_path / "pool.db", pool_size=1)
+    held = engine.connect()
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    held.close()
+
+    metrics = engine.pool.metrics.snapshot()
+    assert (metrics["checkouts"], metrics["timeouts"]) == (1, 1)
+    assert metrics["max_wait_ms"] >= 40
+    # dispose() recreates the pool; the counters carry over
+    engine.dispose()
+    assert engine.pool.metrics.snapshot()["timeouts"] == 1
+
+def test_prewarm_opens_connections_and_survives_a_bad_pool(tmp_path, monkeypatch, capsys):
+    pii_engine = sqlite_engine(tmp_path / "pii.db", pool_size=3)
+    key_engine = sqlite_engine(tmp_path / "missing" / "key.db")
+    monkeypatch.setattr(session, "pii_engine", pii_engine)
+    monkeypatch.setattr(session, "key_engine", key_engine)
+    monkeypatch.setattr(session, "ENGINES", {"pii": pii_engine, "key": key_engine})
+
+    session.prewarm_pools(2)
+
+    assert "could not pre-warm the key connection pool" in capsys.readouterr().out
+    stats = session.pool_stats()
+    assert (stats["pii"]["checked_in"], stats["pii"]["checkouts"]) == (2, 2)
+    assert (stats["key"]["checked_in"], stats["key"]["size"]) == (0, 2)
@@ -0,0 +1,80 @@
+import os
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("cryptography")
+pytest.importorskip("dotenv")
+# db.session builds its MySQL engines at import time
+pytest.importorskip("pymysql")
+pytest.importorskip("aiomysql")
+
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.key_db import Base as KeyBase, FieldKey, UserKEK, PIIFingerprint, KEY_VERSION_USER_KEK
+from db.pii_db import Base as PiiBase, User, FinancialInfo
+from services import duplicate_detection
+from services.crypto_service import generate_dek, seal_value, envelope_nonce
+from services.duplicate_detection import CiphertextFingerprintSeeder
+from utils import blind_index
+from utils.kek_providers import LocalKEKProvider
+
+@pytest.fixture
+def sessions(monkeypatch):
+    pii_engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    key_engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    PiiBase.metadata.create_all(pii_engine)
+    KeyBase.metadata.create_all(key_engine)
+    pii_sessions, key_sessions = sessionmaker(bind=pii_engine), sessionmaker(bind=key_engine)
+    master = LocalKEKProvider(algorithm="aes-kw", key_path=None)
+    monkeypatch.setattr(duplicate_detection, "PiiSessionLocal", pii_sessions)
+    monkeypatch.setattr(duplicate_detection, "KeySessionLocal", key_sessions)
+    monkeypatch.setattr(duplicate_detection, "get_kek_provider", lambda: master)
+    monkeypatch.setattr(blind_index, "BLIND_INDEX_KEY", b"test-blind-index-key")
+    monkeypatch.setitem(duplicate_detection.DUPLICATE_POLICY, "high", "warn")
+    return pii_sessions, key_sessions, master
+
+def store_creditnum(sessions, email: str, value: str) -> int:
+    pii_sessions, key_sessions, master = sessions
+    pii_db, key_db = pii_sessions(), key_sessions()
+    try:
+        user = User(name="User", email=email, hashed_password="$2b$12$hash")
+        pii_db.add(user)
+        pii_db.commit()
+        kek, dek = os.urandom(32), generate_dek()
+        key_db.add(UserKEK(user_id=user.id, wrapped_kek=master.wrap(kek)))
+        key_row = FieldKey(user_id=user.id, category="Financial Info", field_name="creditnum", sensitivity="high",
+                           wrapped_dek=aes_key_wrap(kek, dek), iv=b"", auth_tag=b"", key_salt=b"", key_version=KEY_VERSION_USER_KEK)
+        key_db.add(key_row)
+        key_db.flush()
+        envelope = seal_value(value, dek, key_row.id, user.id, "creditnum")
+        key_row.iv = envelope_nonce(envelope)
+        pii_db.add(FinancialInfo(user_id=user.id, creditnum=envelope))
+        key_db.commit()
+        pii_db.commit()
+        return user.id
+    finally:
+        pii_db.close()
+        key_db.close()
+
+def test_seeding_by_decryption_fingerprints_fields_without_a_blind_index(sessions):
+    first = store_creditnum(sessions, "a@example.com", "4111111111111111")
+    second = store_creditnum(sessions, "b@example.com", "4111111111111111")
+    changed = []
+
+    stats = CiphertextFingerprintSeeder(kms_rate=0, on_change=lambda *change: changed.append(change)).run()
+
+    assert (stats["users"], stats["fields"], stats["failed"]) == (2, 2, 0)
+    assert sorted(changed) == [(first, "Financial Info"), (second, "Financial Info")]
+    key_db = sessions[1]()
+    try:
+        fingerprints = dict(key_db.query(PIIFingerprint.user_id, PIIFingerprint.fingerprint).filter(PIIFingerprint.field_name == "creditnum"))
+    finally:
+        key_db.close()
+    assert fingerprints[first] == fingerprints[second] == blind_index.compute_blind_index("creditnum", "4111111111111111")
+
+    # Already fingerprinted fields are not decrypted again
+    rerun = CiphertextFingerprintSeeder(kms_rate=0).run()
+    assert (rerun["fields"], rerun["kms_calls"]) == (0, 0)
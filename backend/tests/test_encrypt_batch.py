@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("cryptography")
+pytest.importorskip("dotenv")
+pytest.importorskip("fastapi")
+# db.session builds its MySQL engines at import time; the test itself runs on SQLite
+pytest.importorskip("pymysql")
+pytest.importorskip("aiomysql")
+pytest.importorskip("aiosqlite")
+
+from cryptography.hazmat.primitives.keywrap import aes_key_unwrap
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from db.key_db import Base as KeyBase, FieldKey, UserKEK, KEY_VERSION_USER_KEK
+from db.pii_db import Base as PiiBase, User, FinancialInfo
+from routes import vault
+from routes.vault import EncryptBatchRequest, encrypt_batch
+from services.crypto_service import decrypt_field
+from utils import blind_index, key_hierarchy, key_management
+from utils.kek_providers import LocalKEKProvider
+
+CATEGORY = "Financial Info"
+PROFILE = {"creditnum": "4111 1111 1111 1111", "cvv": "123", "tax": "TAX-1234567", "pension": "PEN-1234567"}
+
+@pytest.fixture
+def vault_dbs(monkeypatch, tmp_path):
+    pii_url, key_url = f"sqlite:///{tmp_path / 'pii.db'}", f"sqlite:///{tmp_path / 'keys.db'}"
+    PiiBase.metadata.create_all(create_engine(pii_url))
+    KeyBase.metadata.create_all(create_engine(key_url))
+    pii_sessions = sessionmaker(bind=create_engine(pii_url))
+    pii_db = pii_sessions()
+    try:
+        user = User(name="User", email="user@example.com", hashed_password="$2b$12$hash")
+        pii_db.add(user)
+        pii_db.commit()
+        user_id = user.id
+    finally:
+        pii_db.close()
+    master = LocalKEKProvider(algorithm="aes-kw", key_path=None)
+    async_key_url = key_url.replace("sqlite:", "sqlite+aiosqlite:")
+    monkeypatch.setattr(key_management, "_provider", master)
+    monkeypatch.setattr(key_hierarchy, "KEY_HIERARCHY_VERSION", KEY_VERSION_USER_KEK)
+    monkeypatch.setattr(key_hierarchy, "_wrapped_keks", {})
+    monkeypatch.setattr(key_hierarchy, "AsyncKeySessionLocal", async_sessionmaker(bind=create_async_engine(async_key_url), expire_on_commit=False))
+    monkeypatch.setattr(blind_index, "BLIND_INDEX_KEY", b"test-blind-index-key")
+    monkeypatch.setattr(vault, "log_pii_action", lambda *args: None)
+    monkeypatch.setattr(vault.backup_scheduler, "notify", lambda *args: None)
+    return SimpleNamespace(user_id=user_id, master=master, pii_url=pii_url, key_url=key_url,
+                           pii_sessions=pii_sessions, key_sessions=sessionmaker(bind=create_engine(key_url)))
+
+def post_batch(dbs, fields: dict, pii_commit=None):
+    async def scenario():
+        pii_engine = create_async_engine(dbs.pii_url.replace("sqlite:", "sqlite+aiosqlite:"))
+        key_engine = create_async_engine(dbs.key_url.replace("sqlite:", "sqlite+aiosqlite:"))
+        try:
+            async with async_sessionmaker(bind=pii_engine, expire_on_commit=False)() as pii_db, \
+                       async_sessionmaker(bind=key_engine, expire_on_commit=False)() as key_db:
+                if pii_commit:
+                    pii_db.commit = pii_commit
+                req = EncryptBatchRequest(fields=[{"category": CATEGORY, "field_name": name, "value": value} for name, value in fields.items()])
+                return await encrypt_batch(req, key_db=key_db, pii_db=pii_db, current_user=SimpleNamespace(id=dbs.user_id, name="User"))
+        finally:
+            await pii_engine.dispose()
+            await key_engine.dispose()
+
+    return asyncio.run(scenario())
+
+def stored_profile(dbs) -> dict:
+    pii_db, key_db = dbs.pii_sessions(), dbs.key_sessions()
+    try:
+        pii_row = pii_db.query(FinancialInfo).filter(FinancialInfo.user_id == dbs.user_id).first()
+        key_rows = key_db.query(FieldKey).filter(FieldKey.user_id == dbs.user_id).all()
+        if not key_rows:
+            return {}
+        kek = dbs.master.unwrap(key_db.query(UserKEK.wrapped_kek).filter(UserKEK.user_id == dbs.user_id).scalar())
+        return {row.field_name: decrypt_field(getattr(pii_row, row.field_name), aes_key_unwrap(kek, row.wrapped_dek),
+                                              row.id, dbs.user_id, row.field_name, row.iv, row.auth_tag)
+                for row in key_rows}
+    finally:
+        pii_db.close()
+        key_db.close()
+
+def test_batch_stores_a_whole_profile(vault_dbs):
+    response = post_batch(vault_dbs, PROFILE)
+
+    assert sorted(response["fields"]) == sorted(PROFILE)
+    assert stored_profile(vault_dbs) == {**PROFILE, "creditnum": "4111-1111-1111-1111"}
+    key_db = vault_dbs.key_sessions()
+    try:
+        wrapped = dict(key_db.query(FieldKey.field_name, FieldKey.wrapped_dek))
+    finally:
+        key_db.close()
+    # One shared DEK for the category's medium fields, a DEK of its own for each high field
+    assert wrapped["tax"] == wrapped["pension"]
+    assert len({wrapped["creditnum"], wrapped["cvv"], wrapped["tax"]}) == 3
+
+def test_invalid_fields_are_all_reported_and_nothing_is_written(vault_dbs):
+    with pytest.raises(HTTPException) as rejected:
+        post_batch(vault_dbs, {**PROFILE, "cvv": "12", "dob": "2000-01-01"})
+
+    assert rejected.value.status_code == 422
+    assert sorted((error["field_name"], error["code"]) for error in rejected.value.detail) == [("cvv", "invalid_format"), ("dob", "unknown_field")]
+    assert stored_profile(vault_dbs) == {}
+
+def test_kms_failure_for_one_field_writes_none(vault_dbs, monkeypatch):
+    wrap = vault.wrap_dek_for_user
+    calls = []
+
+    async def flaky_wrap(dek, user_id):
+        calls.append(user_id)
+        if len(calls) == 2:
+            raise ConnectionError("KMS unavailable")
+        return await wrap(dek, user_id)
+
+    monkeypatch.setattr(vault, "wrap_dek_for_user", flaky_wrap)
+    with pytest.raises(HTTPException) as failed:
+        post_batch(vault_dbs, PROFILE)
+
+    assert failed.value.status_code == 500
+    assert stored_profile(vault_dbs) == {}
+
+def test_failed_pii_write_removes_the_new_key_rows(vault_dbs):
+    async def failing_commit():
+        raise ConnectionError("PII database went away")
+
+    with pytest.raises(HTTPException) as failed:
+        post_batch(vault_dbs, PROFILE, pii_commit=failing_commit)
+
+    assert failed.value.status_code == 500
+    assert stored_profile(vault_dbs) == {}
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("cryptography")
+pytest.importorskip("dotenv")
+# db.session builds its MySQL engines at import time; the test itself runs on SQLite
+pytest.importorskip("pymysql")
+pytest.importorskip("aiomysql")
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from db.key_db import Base as KeyBase, UserKEK, KEY_VERSION_KMS, KEY_VERSION_USER_KEK
+from utils import key_hierarchy, key_management
+from utils.dek_cache import dek_cache
+from utils.kek_providers import LocalKEKProvider
+
+@pytest.fixture
+def master(monkeypatch):
+    provider = LocalKEKProvider(algorithm="aes-kw", key_path=None)
+    monkeypatch.setattr(key_management, "_provider", provider)
+    monkeypatch.setattr(key_hierarchy, "KEY_HIERARCHY_VERSION", KEY_VERSION_USER_KEK)
+    monkeypatch.setattr(key_hierarchy, "_wrapped_keks", {})
+    return provider
+
+async def key_sessions():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as connection:
+        await connection.run_sync(KeyBase.metadata.create_all)
+    return async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+def test_dek_round_trips_through_the_user_kek(master, monkeypatch):
+    async def scenario():
+        sessions = await key_sessions()
+        monkeypatch.setattr(key_hierarchy, "AsyncKeySessionLocal", sessions)
+        dek = os.urandom(32)
+        wrapped_dek, key_version = await key_hierarchy.wrap_dek_for_user(dek, 5)
+        assert key_version == KEY_VERSION_USER_KEK
+
+        async with sessions() as key_db:
+            wrapped_kek = await key_db.scalar(select(UserKEK.wrapped_kek).where(UserKEK.user_id == 5))
+        # Cold start: nothing cached, so the KEK is read back and unwrapped by the KMS
+        key_hierarchy.forget_user_kek(5)
+        dek_cache.flush_user(5)
+        unwrapped = await key_hierarchy.unwrap_field_dek(wrapped_dek, key_version, 5)
+        assert bytes(unwrapped) == dek
+        assert len(master.unwrap(wrapped_kek)) == 32
+
+    asyncio.run(scenario())
+
+def test_concurrent_first_use_creates_one_kek(master, monkeypatch):
+    async def scenario():
+        sessions = await key_sessions()
+        monkeypatch.setattr(key_hierarchy, "AsyncKeySessionLocal", sessions)
+        deks = [os.urandom(32) for _ in range(5)]
+        wrapped = await asyncio.gather(*(key_hierarchy.wrap_dek_for_user(dek, 6) for dek in deks))
+        async with sessions() as key_db:
+            assert await key_db.scalar(select(func.count()).select_from(UserKEK).where(UserKEK.user_id == 6)) == 1
+        dek_cache.flush_user(6)
+        for dek, (wrapped_dek, key_version) in zip(deks, wrapped):
+            assert bytes(await key_hierarchy.unwrap_field_dek(wrapped_dek, key_version, 6)) == dek
+
+    asyncio.run(scenario())
+
+def test_kms_wrapped_deks_still_unwrap(master):
+    dek = os.urandom(32)
+    unwrapped = asyncio.run(key_hierarchy.unwrap_field_dek(master.wrap(dek), KEY_VERSION_KMS, 7))
+    assert bytes(unwrapped) == dek
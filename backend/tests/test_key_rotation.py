@@ -0,0 +1,80 @@
+import os
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("cryptography")
+pytest.importorskip("dotenv")
+# db.session builds its MySQL engines at import time
+pytest.importorskip("pymysql")
+pytest.importorskip("aiomysql")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.key_db import Base as KeyBase, UserKEK
+from services import key_rotation
+from services.key_rotation import KeyRotationJob
+from utils import key_hierarchy
+from utils.dek_cache import dek_cache
+from utils.kek_providers import LocalKEKProvider, RotatingKEKProvider
+
+@pytest.fixture
+def key_sessions(monkeypatch, tmp_path):
+    # File-backed, so each rotation worker thread gets a connection of its own
+    engine = create_engine(f"sqlite:///{tmp_path / 'keys.db'}")
+    KeyBase.metadata.create_all(engine)
+    sessions = sessionmaker(bind=engine)
+    monkeypatch.setattr(key_rotation, "KeySessionLocal", sessions)
+    return sessions
+
+def add_keks(key_sessions, provider, user_ids) -> dict:
+    keks = {user_id: os.urandom(32) for user_id in user_ids}
+    key_db = key_sessions()
+    try:
+        key_db.add_all(UserKEK(user_id=user_id, wrapped_kek=provider.wrap(kek)) for user_id, kek in keks.items())
+        key_db.commit()
+    finally:
+        key_db.close()
+    return keks
+
+def wrapped_keks(key_sessions) -> dict:
+    key_db = key_sessions()
+    try:
+        return dict(key_db.query(UserKEK.user_id, UserKEK.wrapped_kek).all())
+    finally:
+        key_db.close()
+
+def test_rewrap_keks_moves_keks_to_the_target_master_key(key_sessions, tmp_path):
+    old_master = LocalKEKProvider(algorithm="aes-kw", key_path=None)
+    new_master = LocalKEKProvider(algorithm="aes-kw", key_path=None)
+    keks = add_keks(key_sessions, old_master, [1, 2])
+    # A KEK the vault created under the target while the rotation was under way
+    keks.update(add_keks(key_sessions, new_master, [3]))
+    old_wrapped = wrapped_keks(key_sessions)
+    key_hierarchy._wrapped_keks[1] = old_wrapped[1]
+    dek_cache.put(old_wrapped[1], bytearray(keks[1]), 1)
+
+    job = KeyRotationJob("rewrap-keks", workers=2, kms_rate=0, checkpoint_path=str(tmp_path / "checkpoint.json"),
+                         source_provider=old_master, target_provider=new_master)
+    job.run()
+
+    assert job.state == "finished"
+    assert (job.stats["fields"], job.stats["skipped"], job.stats["failed"]) == (2, 1, 0)
+    for user_id, wrapped in wrapped_keks(key_sessions).items():
+        assert new_master.unwrap(wrapped) == keks[user_id]
+    assert 1 not in key_hierarchy._wrapped_keks
+    assert dek_cache.get(old_wrapped[1]) is None
+
+def test_rewrap_keks_requires_a_target(key_sessions, tmp_path, monkeypatch):
+    monkeypatch.setattr(key_rotation, "create_target_kek_provider", lambda name: None)
+    with pytest.raises(ValueError):
+        KeyRotationJob("rewrap-keks", checkpoint_path=str(tmp_path / "checkpoint.json"),
+                       source_provider=LocalKEKProvider(algorithm="aes-kw", key_path=None))
+
+def test_rotating_provider_unwraps_under_either_key():
+    old_master = LocalKEKProvider(algorithm="aes-kw", key_path=None)
+    new_master = LocalKEKProvider(algorithm="aes-kw", key_path=None)
+    provider = RotatingKEKProvider(new_master, old_master)
+    kek = os.urandom(32)
+    assert provider.unwrap(old_master.wrap(kek)) == kek
+    assert new_master.unwrap(provider.wrap(kek)) == kek
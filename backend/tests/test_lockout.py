@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip("dotenv")
+
+from utils import lockout
+from utils.lockout import LockoutEngine, MemorySlidingWindow
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(lockout.time, "monotonic", clock)
+    return clock
+
+def engine(store=None) -> LockoutEngine:
+    # 3 failures per account in 15 minutes, 5 per IP in 60 minutes
+    return LockoutEngine(3, 15, 5, 60, store=store or MemorySlidingWindow())
+
+def test_account_locks_and_unlocks_when_the_window_slides_past(clock):
+    lockout_engine = engine()
+    for _ in range(3):
+        clock.now += 60
+        assert not lockout_engine.is_account_locked("a@example.com")
+        lockout_engine.record_failure("a@example.com", "10.0.0.1")
+    assert lockout_engine.is_account_locked("a@example.com")
+
+    # 15 minutes after the first failure it drops out of the window; the other two still count
+    clock.now += 15 * 60 - 120
+    assert not lockout_engine.is_account_locked("a@example.com")
+    assert lockout_engine.record_failure("a@example.com", "10.0.0.1") == 3
+    assert lockout_engine.is_account_locked("a@example.com")
+
+def test_ip_counter_spans_accounts_and_outlives_a_successful_login(clock):
+    lockout_engine = engine()
+    for i in range(5):
+        lockout_engine.record_failure(f"user{i}@example.com", "10.0.0.2")
+    assert lockout_engine.is_ip_blocked("10.0.0.2")
+    assert not lockout_engine.is_ip_blocked("10.0.0.3")
+    assert not lockout_engine.is_account_locked("user0@example.com")
+
+    lockout_engine.record_failure("a@example.com", "10.0.0.4")
+    lockout_engine.record_failure("a@example.com", "10.0.0.4")
+    lockout_engine.record_success("a@example.com")
+    assert lockout_engine.record_failure("a@example.com", "10.0.0.4") == 1
+    assert lockout_engine.store.count("ip:10.0.0.4", 3600) == 3
+
+    clock.now += 3600
+    assert not lockout_engine.is_ip_blocked("10.0.0.2")
+
+def test_tracked_keys_stay_bounded(clock):
+    store = MemorySlidingWindow(max_keys=10)
+    for i in range(50):
+        clock.now += 1
+        store.add(f"ip:10.0.0.{i}", 900)
+    assert len(store._events) <= 10
+    # The newest key is always kept
+    assert store.count("ip:10.0.0.49", 900) == 1
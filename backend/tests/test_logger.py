@@ -0,0 +1,58 @@
+import json
+import logging
+import queue
+import time
+import pytest
+
+pytest.importorskip("dotenv")
+
+from utils.audit_chain import AuditChainWriter, verify_log
+from utils.logger import BoundedQueueHandler, BatchingLogWriter, JSONFormatter
+
+def record(message: str, event: str = None) -> logging.LogRecord:
+    extra_data = {"event": event, "user_id": 1} if event else {}
+    return logging.makeLogRecord({"msg": message, "levelname": "INFO", "levelno": logging.INFO, "extra_data": extra_data})
+
+def test_drop_policy_discards_records_once_the_queue_is_full():
+    handler = BoundedQueueHandler(queue.Queue(maxsize=2), policy="drop")
+    started = time.perf_counter()
+    for i in range(5):
+        handler.emit(record(f"event {i}"))
+
+    assert (handler.enqueued, handler.dropped) == (2, 3)
+    assert time.perf_counter() - started < 0.5
+    # The oldest records are kept; later ones are the ones lost
+    assert [handler.queue.get_nowait().getMessage() for _ in range(2)] == ["event 0", "event 1"]
+
+def test_block_policy_waits_briefly_before_dropping():
+    handler = BoundedQueueHandler(queue.Queue(maxsize=1), policy="block", block_seconds=0.05)
+    handler.emit(record("kept"))
+    started = time.perf_counter()
+    handler.emit(record("dropped"))
+
+    assert time.perf_counter() - started >= 0.04
+    assert (handler.enqueued, handler.dropped) == (1, 1)
+
+def test_writer_batches_records_and_chains_audit_events(tmp_path):
+    log_queue = queue.Queue()
+    for i in range(10):
+        log_queue.put(record(f"event {i}", "pii_action" if i % 2 else "login"))
+    chain = AuditChainWriter(str(tmp_path / "audit.log"), b"test-audit-key", 4)
+    writer = BatchingLogWriter(log_queue, str(tmp_path / "app_logs.json"), JSONFormatter(), audit_chain=chain)
+    writer.start()
+    writer.stop()
+
+    lines = (tmp_path / "app_logs.json").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["message"] for line in lines] == [f"event {i}" for i in range(10)]
+    assert writer.written == 10 and writer.batches < 10
+    report = verify_log(str(tmp_path / "audit.log"), b"test-audit-key", 4, workers=1)
+    assert report["ok"] and report["records_checked"] == 5
+
+def test_write_failures_are_counted_not_raised(tmp_path):
+    log_queue = queue.Queue()
+    log_queue.put(record("lost"))
+    writer = BatchingLogWriter(log_queue, str(tmp_path / "missing" / "app_logs.json"), JSONFormatter())
+    writer.start()
+    writer.stop()
+
+    assert (writer.written, writer.write_errors) == (0, 1)
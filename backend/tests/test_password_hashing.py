@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import pytest
+
+pytest.importorskip("passlib")
+pytest.importorskip("dotenv")
+
+from utils.password_hashing import PasswordHasher, PasswordHashingBusy, hash_rounds, _hash
+
+# The lowest cost bcrypt accepts, so the tests stay fast
+ROUNDS = 4
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(workers=1, max_queue=1, pool_kind="thread", rounds=ROUNDS)
+    yield hasher
+    hasher.shutdown()
+
+def test_saturated_pool_rejects_instead_of_queueing(hasher):
+    release = threading.Event()
+    running = [hasher.submit(release.wait, 5) for _ in range(2)]  # one on the worker, one queued
+
+    with pytest.raises(PasswordHashingBusy):
+        hasher.submit(release.wait, 5)
+    with pytest.raises(PasswordHashingBusy):
+        asyncio.run(hasher.verify_async("Password1!", _hash("Password1!", ROUNDS)))
+    assert hasher.rejected == 2
+
+    release.set()
+    for future in running:
+        future.result(timeout=5)
+    # Slots are handed back as calls finish
+    assert hasher.verify("Password1!", hasher.hash("Password1!"))
+
+def test_busy_pool_answers_429():
+    pytest.importorskip("fastapi")
+    pytest.importorskip("jose")
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("pymysql")
+    pytest.importorskip("aiomysql")
+    from fastapi import HTTPException
+    from routes.auth import run_password_hashing
+
+    async def busy(*args):
+        raise PasswordHashingBusy("Password hashing pool is saturated.")
+
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(run_password_hashing(busy, "Password1!"))
+    assert rejected.value.status_code == 429
+    assert rejected.value.headers["Retry-After"] == "1"
+
+def test_login_rehashes_at_the_configured_cost(hasher):
+    weaker = _hash("Password1!", ROUNDS + 1)
+
+    assert hasher.verify_and_update("Wrong1!", weaker) == (False, None)
+    valid, new_hash = hasher.verify_and_update("Password1!", weaker)
+    assert valid and hash_rounds(new_hash) == ROUNDS
+    assert hasher.verify("Password1!", new_hash)
+    # Already at the configured cost: nothing to store
+    assert hasher.verify_and_update("Password1!", new_hash) == (True, None)
+    assert asyncio.run(hasher.verify_and_update_async("Password1!", new_hash)) == (True, None)
+    valid, new_hash = asyncio.run(hasher.verify_and_update_async("Password1!", weaker))
+    assert valid and hash_rounds(new_hash) == ROUNDS
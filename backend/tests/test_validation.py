@@ -0,0 +1,44 @@
+import pytest
+
+from utils.validation import validate_batch, validate_and_sanitize, normalize_pii_value
+
+ALLOWED = {"Financial Info": ["accnum", "creditnum", "cvv"], "Government Identifiers": ["adhar", "pan"]}
+
+def test_valid_items_come_back_normalized_in_order():
+    valid, errors = validate_batch([
+        ("Financial Info", "creditnum", "4111 1111 1111 1111"),
+        ("Government Identifiers", "adhar", "1234 5678 9012"),
+        ("Government Identifiers", "pan", "ABCDE1234F"),
+    ], ALLOWED)
+    assert errors == []
+    assert valid == [
+        ("Financial Info", "creditnum", "4111-1111-1111-1111"),
+        ("Government Identifiers", "adhar", "1234-5678-9012"),
+        ("Government Identifiers", "pan", "ABCDE1234F"),
+    ]
+
+def test_every_rejected_item_gets_a_structured_error():
+    valid, errors = validate_batch([
+        ("Financial Info", "cvv", "12"),
+        ("Financial Info", "accnum", "12345678"),
+        ("Financial Info", "adhar", "1234-5678-9012"),  # a real field, in the wrong category
+        ("Unknown", "cvv", "123"),
+    ], ALLOWED)
+    assert valid == [("Financial Info", "accnum", "12345678")]
+    assert errors == [
+        {"category": "Financial Info", "field_name": "cvv", "code": "invalid_format", "detail": "Invalid format for 'cvv'."},
+        {"category": "Financial Info", "field_name": "adhar", "code": "unknown_field", "detail": "Unknown field for this category."},
+        {"category": "Unknown", "field_name": "cvv", "code": "unknown_field", "detail": "Unknown field for this category."},
+    ]
+
+def test_markup_is_stripped_before_the_format_check():
+    valid, errors = validate_batch([("Financial Info", "cvv", "<12>3")], ALLOWED)
+    assert (valid, errors) == ([("Financial Info", "cvv", "123")], [])
+
+@pytest.mark.parametrize("field_name, value", [("creditnum", "4111 1111 1111 1111"), ("cvv", "99"), ("pan", "abcde1234f"), ("nickname", "<b>x</b>")])
+def test_batch_agrees_with_the_single_field_path(field_name, value):
+    is_valid, sanitized_value = validate_and_sanitize(field_name, value)
+    valid, errors = validate_batch([("Any", field_name, value)])
+    assert bool(valid) == is_valid and bool(errors) != is_valid
+    if is_valid:
+        assert valid[0][2] == normalize_pii_value(field_name, sanitized_value)
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import pytest
+from types import SimpleNamespace
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("dotenv")
+pytest.importorskip("fastapi")
+# db.session builds its MySQL engines at import time; the test itself runs on SQLite
+pytest.importorskip("pymysql")
+pytest.importorskip("aiomysql")
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
+
+from db.key_db import Base as KeyBase, FieldKey
+from db.pii_db import Base as PiiBase, User, FinancialInfo
+from routes import vault
+from routes.vault import DeleteFieldRequest, delete_field, get_vault_contents
+from utils import listing_etags as listing_etags_module
+from utils.listing_etags import ListingETagCache, etag_matches
+
+CATEGORY = "Financial Info"
+
+@pytest.fixture
+def vault_dbs(monkeypatch, tmp_path):
+    pii_url, key_url = f"sqlite:///{tmp_path / 'pii.db'}", f"sqlite:///{tmp_path / 'keys.db'}"
+    PiiBase.metadata.create_all(create_engine(pii_url))
+    KeyBase.metadata.create_all(create_engine(key_url))
+    pii_db, key_db = sessionmaker(bind=create_engine(pii_url))(), sessionmaker(bind=create_engine(key_url))()
+    try:
+        user = User(name="User", email="user@example.com", hashed_password="$2b$12$hash")
+        pii_db.add(user)
+        pii_db.commit()
+        for field_name in ("creditnum", "accnum"):
+            key_db.add(FieldKey(user_id=user.id, category=CATEGORY, field_name=field_name, sensitivity="high",
+                                wrapped_dek=field_name.encode(), iv=b"", auth_tag=b"", key_salt=b"", key_version=2))
+        pii_db.add(FinancialInfo(user_id=user.id, creditnum=b"sealed", accnum=b"sealed"))
+        key_db.commit()
+        pii_db.commit()
+        user_id = user.id
+    finally:
+        pii_db.close()
+        key_db.close()
+    monkeypatch.setattr(vault, "listing_etags", ListingETagCache(ttl_seconds=60))
+    monkeypatch.setattr(vault, "log_pii_action", lambda *args: None)
+    monkeypatch.setattr(vault.backup_scheduler, "notify", lambda *args: None)
+    return SimpleNamespace(user=SimpleNamespace(id=user_id, name="User"),
+                           pii_url=pii_url.replace("sqlite:", "sqlite+aiosqlite:"), key_url=key_url.replace("sqlite:", "sqlite+aiosqlite:"))
+
+def call(dbs, route, *args):
+    async def scenario():
+        pii_engine, key_engine = create_async_engine(dbs.pii_url), create_async_engine(dbs.key_url)
+        try:
+            async with async_sessionmaker(bind=pii_engine, expire_on_commit=False)() as pii_db, \
+                       async_sessionmaker(bind=key_engine, expire_on_commit=False)() as key_db:
+                return await route(*args, key_db=key_db, pii_db=pii_db, current_user=dbs.user)
+        finally:
+            await pii_engine.dispose()
+            await key_engine.dispose()
+
+    return asyncio.run(scenario())
+
+def listing_request(etag: str = None) -> Request:
+    headers = [(b"if-none-match", etag.encode())] if etag else []
+    return Request({"type": "http", "method": "GET", "path": "/vault/", "headers": headers})
+
+def test_write_invalidates_the_remembered_etag(vault_dbs):
+    first = call(vault_dbs, get_vault_contents, listing_request())
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and first.headers["cache-control"] == "private, no-cache"
+    assert json.loads(first.body)[0]["fields"] == ["accnum", "creditnum"]
+
+    # Answered from the remembered ETag, without touching either database
+    unchanged = asyncio.run(get_vault_contents(listing_request(etag), key_db=None, pii_db=None, current_user=vault_dbs.user))
+    assert (unchanged.status_code, unchanged.headers["etag"], unchanged.headers["cache-control"]) == (304, etag, "private, no-cache")
+
+    call(vault_dbs, delete_field, DeleteFieldRequest(category=CATEGORY, field_name="accnum"))
+
+    changed = call(vault_dbs, get_vault_contents, listing_request(etag))
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert json.loads(changed.body)[0]["fields"] == ["creditnum"]
+    # The rebuilt listing's own ETag is honoured again
+    assert call(vault_dbs, get_vault_contents, listing_request(changed.headers["etag"])).status_code == 304
+
+def test_remembered_etags_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(listing_etags_module.time, "monotonic", lambda: now[0])
+    cache = ListingETagCache(ttl_seconds=10, max_entries=2)
+    cache.put(1, '"a"')
+    cache.put(2, '"b"')
+    cache.put(3, '"c"')
+    assert (cache.get(1), cache.get(2)) == (None, '"b"')
+    now[0] += 10
+    assert cache.get(3) is None
+
+@pytest.mark.parametrize("if_none_match, matches", [('"a"', True), ('W/"a"', True), ('"b", "a"', True), ("*", True), ('"b"', False), (None, False)])
+def test_if_none_match_uses_weak_comparison(if_none_match, matches):
+    assert etag_matches(if_none_match, '"a"') is matches
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import pytest
+from types import SimpleNamespace
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("cryptography")
+pytest.importorskip("dotenv")
+pytest.importorskip("fastapi")
+# db.session builds its MySQL engines at import time; the test itself runs on SQLite
+pytest.importorskip("pymysql")
+pytest.importorskip("aiomysql")
+pytest.importorskip("aiosqlite")
+
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from db.key_db import Base as KeyBase, FieldKey, UserKEK, KEY_VERSION_USER_KEK
+from db.pii_db import Base as PiiBase, User, FinancialInfo
+from routes import vault
+from routes.vault import UpdateFieldRequest, update_field
+from services import key_rotation
+from services.crypto_service import generate_dek, seal_value, envelope_nonce, decrypt_field
+from services.key_rotation import KeyRotationJob
+from utils import blind_index, key_hierarchy, key_management
+from utils.kek_providers import LocalKEKProvider
+
+CATEGORY = "Financial Info"
+
+@pytest.fixture
+def vault_dbs(monkeypatch, tmp_path):
+    """File-backed databases, so the rotation's sync sessions and the route's async sessions see the same rows."""
+    pii_path, key_path = tmp_path / "pii.db", tmp_path / "keys.db"
+    PiiBase.metadata.create_all(create_engine(f"sqlite:///{pii_path}"))
+    KeyBase.metadata.create_all(create_engine(f"sqlite:///{key_path}"))
+    master = LocalKEKProvider(algorithm="aes-kw", key_path=None)
+    monkeypatch.setattr(key_management, "_provider", master)
+    monkeypatch.setattr(key_hierarchy, "KEY_HIERARCHY_VERSION", KEY_VERSION_USER_KEK)
+    monkeypatch.setattr(key_hierarchy, "_wrapped_keks", {})
+    monkeypatch.setattr(key_hierarchy, "AsyncKeySessionLocal", async_sessionmaker(bind=create_async_engine(f"sqlite+aiosqlite:///{key_path}"), expire_on_commit=False))
+    monkeypatch.setattr(key_rotation, "PiiSessionLocal", sessionmaker(bind=create_engine(f"sqlite:///{pii_path}")))
+    monkeypatch.setattr(key_rotation, "KeySessionLocal", sessionmaker(bind=create_engine(f"sqlite:///{key_path}")))
+    monkeypatch.setattr(blind_index, "BLIND_INDEX_KEY", b"test-blind-index-key")
+    monkeypatch.setattr(vault, "log_pii_action", lambda *args: None)
+    monkeypatch.setattr(vault.backup_scheduler, "notify", lambda *args: None)
+    return pii_path, key_path, master
+
+def store_creditnum(vault_dbs, value: str) -> int:
+    master = vault_dbs[2]
+    pii_db, key_db = key_rotation.PiiSessionLocal(), key_rotation.KeySessionLocal()
+    try:
+        user = User(name="User", email="user@example.com", hashed_password="$2b$12$hash")
+        pii_db.add(user)
+        pii_db.commit()
+        kek, dek = os.urandom(32), generate_dek()
+        key_db.add(UserKEK(user_id=user.id, wrapped_kek=master.wrap(kek)))
+        key_row = FieldKey(user_id=user.id, category=CATEGORY, field_name="creditnum", sensitivity="high",
+                           wrapped_dek=aes_key_wrap(kek, dek), iv=b"", auth_tag=b"", key_salt=b"", key_version=KEY_VERSION_USER_KEK)
+        key_db.add(key_row)
+        key_db.flush()
+        envelope = seal_value(value, dek, key_row.id, user.id, "creditnum")
+        key_row.iv = envelope_nonce(envelope)
+        pii_db.add(FinancialInfo(user_id=user.id, creditnum=envelope))
+        key_db.commit()
+        pii_db.commit()
+        return user.id
+    finally:
+        pii_db.close()
+        key_db.close()
+
+def stored_creditnum(vault_dbs, user_id: int) -> str:
+    master = vault_dbs[2]
+    pii_db, key_db = key_rotation.PiiSessionLocal(), key_rotation.KeySessionLocal()
+    try:
+        kek = master.unwrap(key_db.query(UserKEK.wrapped_kek).filter(UserKEK.user_id == user_id).scalar())
+        key_row = key_db.query(FieldKey).filter(FieldKey.user_id == user_id).one()
+        stored = pii_db.query(FinancialInfo.creditnum).filter(FinancialInfo.user_id == user_id).scalar()
+        return decrypt_field(stored, aes_key_unwrap(kek, key_row.wrapped_dek), key_row.id, user_id, "creditnum", key_row.iv, key_row.auth_tag)
+    finally:
+        pii_db.close()
+        key_db.close()
+
+def put_creditnum(vault_dbs, user_id: int, value: str):
+    pii_path, key_path, _ = vault_dbs
+
+    async def scenario():
+        pii_engine, key_engine = create_async_engine(f"sqlite+aiosqlite:///{pii_path}"), create_async_engine(f"sqlite+aiosqlite:///{key_path}")
+        try:
+            async with async_sessionmaker(bind=pii_engine, expire_on_commit=False)() as pii_db, \
+                       async_sessionmaker(bind=key_engine, expire_on_commit=False)() as key_db:
+                return await update_field(UpdateFieldRequest(category=CATEGORY, field_name="creditnum", new_value=value),
+                                          key_db=key_db, pii_db=pii_db, current_user=SimpleNamespace(id=user_id, name="User"))
+        finally:
+            await pii_engine.dispose()
+            await key_engine.dispose()
+
+    return asyncio.run(scenario())
+
+def test_update_replaces_the_value(vault_dbs):
+    user_id = store_creditnum(vault_dbs, "4111-1111-1111-1111")
+    assert put_creditnum(vault_dbs, user_id, "5555 5555 5555 4444")["status"] == "success"
+    assert stored_creditnum(vault_dbs, user_id) == "5555-5555-5555-4444"
+
+def test_update_racing_a_reencrypt_never_loses_the_value(vault_dbs, monkeypatch, tmp_path):
+    user_id = store_creditnum(vault_dbs, "4111-1111-1111-1111")
+    job = KeyRotationJob("reencrypt", kms_rate=0, checkpoint_path=str(tmp_path / "checkpoint.json"))
+    sealing = vault.run_blocking
+
+    async def reencrypt_then_seal(func, *args):
+        # The rotation replaces the DEK and ciphertext after the route read the key row, before it writes
+        job._reencrypt_user(user_id)
+        return await sealing(func, *args)
+
+    monkeypatch.setattr(vault, "run_blocking", reencrypt_then_seal)
+    with pytest.raises(HTTPException) as conflict:
+        put_creditnum(vault_dbs, user_id, "5555 5555 5555 4444")
+
+    assert conflict.value.status_code == 409
+    assert job.stats["fields"] == 1
+    # The rotated value is intact and still opens with the key row's (new) DEK
+    assert stored_creditnum(vault_dbs, user_id) == "4111-1111-1111-1111"
@@ -0,0 +1,277 @@
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+AUDIT_LOG_FILE = os.getenv("AUDIT_LOG_FILE", "pii_audit.log")
+# No default: with a key anyone can read in the source, a rewritten chain would still verify
+AUDIT_HMAC_KEY = os.getenv("AUDIT_HMAC_KEY", "").encode("utf-8")
+AUDIT_BLOCK_SIZE = int(os.getenv("AUDIT_BLOCK_SIZE", 1024))
+# Blocks handed to each verifier process per task
+VERIFY_BLOCKS_PER_TASK = 64
+
+GENESIS_MAC = "0" * 64
+
+# Line format: <canonical JSON body>\t<hex HMAC>\n, where
+#   mac_i = HMAC-SHA256(key, bytes.fromhex(mac_{i-1}) + body_i)
+# Bodies always start with {"seq":N, so the verifier can read seq without parsing JSON.
+# After every AUDIT_BLOCK_SIZE records a checkpoint entry (itself part of the chain) closes
+# the block, and the sidecar index records where each block ends and its chain head.
+#
+# The chain shows that no record was altered, reordered or removed from the middle. It can't
+# show that records were cut from the end: a truncated log (and index) is still a valid,
+# shorter chain. Catching that needs an anchor kept off this host, e.g. the audit_chain_anchor
+# (seq and head) reported by /admin/logging-stats, recorded periodically by monitoring and
+# checked with --anchor SEQ:HEAD: a truncated log no longer reaches the recorded seq.
+
+def chain_mac(key: bytes, prev_mac: str, body: bytes) -> str:
+    return hmac.new(key, bytes.fromhex(prev_mac) + body, hashlib.sha256).hexdigest()
+
+def _seq_of(body: bytes) -> int:
+    return int(body[7:body.index(b",", 7)])
+
+def index_path(log_path: str) -> str:
+    return f"{log_path}.idx"
+
+class AuditChainWriter:
+    """Appends hash-chained audit records, resuming the chain from the file's last line."""
+
+    def __init__(self, path: str = AUDIT_LOG_FILE, key: bytes = AUDIT_HMAC_KEY, block_size: int = AUDIT_BLOCK_SIZE):
+        if not key:
+            raise ValueError("AUDIT_HMAC_KEY is not set; refusing to write an audit chain without a secret key.")
+        self.path = path
+        self.key = key
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._file = None
+        self._index = None
+        self.seq = 0
+        self.head = GENESIS_MAC
+
+    def _open(self):
+        self._resume()
+        self._file = open(self.path, "ab")
+        self._index = open(index_path(self.path), "ab")
+        # A crash between the last record of a block and its checkpoint is repaired here
+        if self.seq and self.seq % self.block_size == 0 and not self._last_was_checkpoint:
+            self._write_checkpoint()
+
+    def _resume(self):
+        self._last_was_checkpoint = False
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            tail_start = max(0, size - 65536)
+            f.seek(tail_start)
+            tail = f.read()
+            if not tail.endswith(b"\n"):
+                # Drop a partially written final line left behind by a crash
+                cut = tail.rfind(b"\n") + 1
+                f.truncate(tail_start + cut)
+                tail = tail[:cut]
+                print(f"WARN: truncated a partial trailing audit record in {self.path}")
+        lines = tail.splitlines()
+        if not lines:
+            return
+        body, mac = lines[-1].rsplit(b"\t", 1)
+        self.seq = _seq_of(body)
+        self.head = mac.decode("ascii")
+        self._last_was_checkpoint = b'"type":"checkpoint"' in body
+
+    def _append(self, body: bytes):
+        self.head = chain_mac(self.key, self.head, body)
+        self._file.write(body + b"\t" + self.head.encode("ascii") + b"\n")
+
+    def _write_checkpoint(self):
+        block = self.seq // self.block_size - 1
+        body = json.dumps({"seq": self.seq, "type": "checkpoint", "block": block}, separators=(",", ":")).encode("utf-8")
+        self._append(body)
+        end_offset = self._file.tell()
+        self._index.write(json.dumps({"block": block, "seq": self.seq, "end_offset": end_offset, "head": self.head}).encode("utf-8") + b"\n")
+
+    def append(self, data: dict):
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self.seq += 1
+            record = {"seq": self.seq, "ts": datetime.utcnow().isoformat() + "Z", "data": data}
+            self._append(json.dumps(record, separators=(",", ":"), default=str).encode("utf-8"))
+            if self.seq % self.block_size == 0:
+                self._write_checkpoint()
+
+    def anchor(self) -> dict:
+        """The current seq and chain head, read together, to be recorded off-host."""
+        with self._lock:
+            if self._file is None:
+                self._open()
+            return {"seq": self.seq, "head": self.head}
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._index.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._index.close()
+                self._file = self._index = None
+
+# --- Verification ---
+def load_index(log_path: str) -> list:
+    path = index_path(log_path)
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def rebuild_index(log_path: str) -> list:
+    """Rebuilds block boundaries with one sequential scan (no HMAC work) when the index is missing."""
+    entries, offset = [], 0
+    with open(log_path, "rb") as f:
+        for line in f:
+            offset += len(line)
+            if b'"type":"checkpoint"' in line[:64]:
+                body, mac = line.rstrip(b"\n").rsplit(b"\t", 1)
+                checkpoint = json.loads(body)
+                entries.append({"block": checkpoint["block"], "seq": checkpoint["seq"], "end_offset": offset, "head": mac.decode("ascii")})
+    return entries
+
+def verify_range(log_path: str, key: bytes, block_size: int, start_offset: int, end_offset, prev_mac: str, start_seq: int) -> dict:
+    """
+    Verifies the chain over log bytes [start_offset, end_offset) starting from
+    prev_mac, checking sequence numbers and that each checkpoint closes its block.
+    Returns the head reached so the caller can stitch ranges together.
+    """
+    with open(log_path, "rb") as f:
+        f.seek(start_offset)
+        data = f.read() if end_offset is None else f.read(end_offset - start_offset)
+    mac, seq, records = prev_mac, start_seq, 0
+    pending_checkpoint = False
+    for line in data.splitlines():
+        try:
+            body, line_mac = line.rsplit(b"\t", 1)
+            line_seq = _seq_of(body)
+        except ValueError:
+            return {"ok": False, "error": f"malformed line at seq {seq + 1}", "head": mac, "records": records}
+        mac = chain_mac(key, mac, body)
+        if not hmac.compare_digest(mac, line_mac.decode("ascii")):
+            return {"ok": False, "error": f"MAC mismatch at seq {line_seq}", "head": mac, "records": records}
+        if pending_checkpoint:
+            checkpoint = json.loads(body)
+            if checkpoint.get("type") != "checkpoint" or line_seq != seq or checkpoint.get("block") != seq // block_size - 1:
+                return {"ok": False, "error": f"missing or invalid checkpoint after seq {seq}", "head": mac, "records": records}
+            pending_checkpoint = False
+            continue
+        if line_seq != seq + 1:
+            return {"ok": False, "error": f"sequence gap: expected {seq + 1}, found {line_seq}", "head": mac, "records": records}
+        seq = line_seq
+        records += 1
+        pending_checkpoint = seq % block_size == 0
+    return {"ok": True, "error": None, "head": mac, "records": records, "seq": seq}
+
+def verify_log(log_path: str = AUDIT_LOG_FILE, key: bytes = AUDIT_HMAC_KEY, block_size: int = AUDIT_BLOCK_SIZE,
+               from_block: int = 0, workers: int = None) -> dict:
+    """
+    Verifies the audit log in parallel. Each task checks a run of blocks starting
+    from the preceding checkpoint's head; the heads each task reaches are then
+    compared with the checkpoints the next task started from, which stitches the
+    whole chain together. from_block lets verification start at any checkpoint.
+    The returned seq and head are the chain's last record, to compare with an
+    externally kept anchor (see the truncation note above).
+    """
+    if not key:
+        raise ValueError("AUDIT_HMAC_KEY is not set; the chain can't be verified without its key.")
+    index = load_index(log_path) or rebuild_index(log_path)
+    if from_block > len(index):
+        raise ValueError(f"Log only has {len(index)} completed blocks.")
+    # boundaries[k] is where block k starts: (offset, chain head before it, last seq before it)
+    boundaries = [(0, GENESIS_MAC, 0)] + [(entry["end_offset"], entry["head"], entry["seq"]) for entry in index]
+    tasks = []
+    for start in range(from_block, len(index), VERIFY_BLOCKS_PER_TASK):
+        end = min(start + VERIFY_BLOCKS_PER_TASK, len(index))
+        start_offset, prev_mac, start_seq = boundaries[start]
+        tasks.append((start_offset, index[end - 1]["end_offset"], prev_mac, start_seq, index[end - 1]["head"]))
+    # Records after the last checkpoint form an open, partial block
+    start_offset, prev_mac, start_seq = boundaries[len(index)]
+    tasks.append((start_offset, None, prev_mac, start_seq, None))
+
+    records, errors, last = 0, [], None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(verify_range, log_path, key, block_size, s, e, p, q) for s, e, p, q, _ in tasks]
+        for (start_offset, _, _, _, expected_head), future in zip(tasks, futures):
+            result = last = future.result()
+            records += result["records"]
+            if not result["ok"]:
+                errors.append(f"at byte {start_offset}: {result['error']}")
+            elif expected_head is not None and result["head"] != expected_head:
+                errors.append(f"at byte {start_offset}: chain head does not match the index checkpoint")
+    return {
+        "ok": not errors,
+        "blocks_checked": len(index) - from_block,
+        "records_checked": records,
+        "errors": errors,
+        "seq": last.get("seq") if not errors else None,
+        "head": last["head"] if not errors else None,
+    }
+
+def check_anchor(log_path: str, seq: int, head: str) -> bool:
+    """
+    True if the log still reaches an externally recorded (seq, head) anchor.
+    Only meaningful once verify_log has passed, which makes the stored MACs trustworthy.
+    """
+    anchored = None
+    with open(log_path, "rb") as f:
+        for line in f:
+            body, mac = line.rstrip(b"\n").rsplit(b"\t", 1)
+            line_seq = _seq_of(body)
+            if line_seq > seq:
+                break
+            if line_seq == seq:
+                # A block's last record shares its seq with the checkpoint that follows it
+                anchored = mac.decode("ascii")
+    return anchored is not None and hmac.compare_digest(anchored, head)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify the hash-chained PII audit log.")
+    parser.add_argument("--log", default=AUDIT_LOG_FILE)
+    parser.add_argument("--from-block", type=int, default=0, help="Start verification at this checkpoint.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--rebuild-index", action="store_true", help="Regenerate the .idx sidecar from the log first.")
+    parser.add_argument("--anchor", action="append", default=[], metavar="SEQ:HEAD",
+                        help="Externally recorded chain head the log must still reach (detects truncation); repeatable.")
+    args = parser.parse_args()
+
+    if args.rebuild_index:
+        with open(index_path(args.log), "wb") as f:
+            for entry in rebuild_index(args.log):
+                f.write(json.dumps(entry).encode("utf-8") + b"\n")
+    started = time.perf_counter()
+    report = verify_log(args.log, from_block=args.from_block, workers=args.workers)
+    elapsed = time.perf_counter() - started
+    size_mb = os.path.getsize(args.log) / (1024 * 1024)
+    print(f"Checked {report['records_checked']} records in {report['blocks_checked']} blocks "
+          f"({size_mb:.1f} MB) in {elapsed:.2f}s.")
+    for error in report["errors"]:
+        print(f"FAIL {error}")
+    if report["ok"]:
+        print(f"Chain head at seq {report['seq']}: {report['head']}")
+        for anchor in args.anchor:
+            seq, head = anchor.split(":", 1)
+            if not check_anchor(args.log, int(seq), head):
+                report["ok"] = False
+                print(f"FAIL anchor at seq {seq} not found: the log was truncated or rewritten")
+    print("Audit chain OK." if report["ok"] else "Audit chain verification FAILED.")
+    raise SystemExit(0 if report["ok"] else 1)
@@ -0,0 +1,56 @@
+import hashlib
+import hmac
+import os
+from dotenv import load_dotenv
+
+from db.pii_db import CATEGORY_MODEL_MAP
+from utils.validation import normalize_pii_value
+
+load_dotenv()
+
+# --- Configuration ---
+# Keyed separately from every encryption key: it only makes equal values comparable and can
+# never decrypt them. Blind indexing is off while it is unset. Changing it invalidates every
+# stored index, so rebuild them afterwards (python -m services.blind_index_backfill --reset).
+BLIND_INDEX_KEY = os.getenv("BLIND_INDEX_KEY", "").encode("utf-8")
+BLIND_INDEX_SUFFIX = "_bidx"
+
+# category -> fields that have a <field>_bidx column on the category's PII model
+BLIND_INDEXED_FIELDS = {
+    category: tuple(column.name[:-len(BLIND_INDEX_SUFFIX)] for column in Model.__table__.columns if column.name.endswith(BLIND_INDEX_SUFFIX))
+    for category, Model in CATEGORY_MODEL_MAP.items()
+}
+# field -> category, for lookups by field name
+BLIND_INDEX_CATEGORY = {field_name: category for category, fields in BLIND_INDEXED_FIELDS.items() for field_name in fields}
+
+def blind_index_enabled() -> bool:
+    return bool(BLIND_INDEX_KEY)
+
+def blind_index_column(field_name: str) -> str:
+    return f"{field_name}{BLIND_INDEX_SUFFIX}"
+
+def compute_blind_index(field_name: str, normalized_value: str) -> str:
+    """HMAC-SHA256 of the normalized value, domain-separated by field so equal values in different fields don't match."""
+    message = field_name.encode("utf-8") + b"\x00" + normalized_value.encode("utf-8")
+    return hmac.new(BLIND_INDEX_KEY, message, hashlib.sha256).hexdigest()
+
+def blind_index_for(field_name: str, sanitized_value: str) -> str:
+    """Index of a validated, sanitized value, normalized exactly as the vault stores it."""
+    return compute_blind_index(field_name, normalize_pii_value(field_name, sanitized_value))
+
+def blind_index_columns(category: str, values: dict) -> dict:
+    """
+    Maps {field_name: normalized value or None} to the blind-index column values to
+    store alongside the ciphertext. Fields without an index column are ignored;
+    None clears the index even while indexing is disabled.
+    """
+    indexed = BLIND_INDEXED_FIELDS.get(category, ())
+    columns = {}
+    for field_name, value in values.items():
+        if field_name not in indexed:
+            continue
+        if value is None:
+            columns[blind_index_column(field_name)] = None
+        elif blind_index_enabled():
+            columns[blind_index_column(field_name)] = compute_blind_index(field_name, value)
+    return columns
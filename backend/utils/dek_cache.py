@@ -0,0 +1,172 @@
+import ctypes
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+DEK_CACHE_MAX_ENTRIES = int(os.getenv("DEK_CACHE_MAX_ENTRIES", 1024))
+DEK_CACHE_TTL_SECONDS = float(os.getenv("DEK_CACHE_TTL_SECONDS", 300))
+
+def _load_memory_locker():
+    """Returns (lock, unlock) functions that pin memory pages, or (None, None) if unsupported."""
+    try:
+        if sys.platform == "win32":
+            kernel32 = ctypes.windll.kernel32
+            return kernel32.VirtualLock, kernel32.VirtualUnlock
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.mlock, libc.munlock
+    except (AttributeError, OSError):
+        return None, None
+
+_mlock, _munlock = _load_memory_locker()
+
+class LockedBuffer:
+    """
+    Holds key material in a bytearray that is pinned in RAM (best effort, so it
+    is never swapped to disk) and zeroized in place when the buffer is wiped.
+    """
+    __slots__ = ("_buf", "_view", "_locked")
+
+    def __init__(self, data: bytes):
+        self._buf = bytearray(data)
+        self._view = (ctypes.c_char * len(self._buf)).from_buffer(self._buf)
+        self._locked = False
+        if _mlock is not None:
+            try:
+                result = _mlock(ctypes.addressof(self._view), ctypes.c_size_t(len(self._buf)))
+                # mlock() returns 0 on success, VirtualLock() returns non-zero on success
+                self._locked = bool(result) if sys.platform == "win32" else result == 0
+            except Exception:
+                self._locked = False
+
+    def copy(self) -> bytearray:
+        """Returns a fresh copy the caller owns (and must overwrite after use)."""
+        return bytearray(self._buf)
+
+    def wipe(self):
+        """Zeroizes the key material and releases the page lock."""
+        if self._view is None:
+            return
+        size = len(self._buf)
+        ctypes.memset(ctypes.addressof(self._view), 0, size)
+        if self._locked and _munlock is not None:
+            try:
+                _munlock(ctypes.addressof(self._view), ctypes.c_size_t(size))
+            except Exception:
+                pass
+        self._locked = False
+        self._view = None
+
+class DEKCache:
+    """
+    Bounded, TTL-limited LRU cache of unwrapped DEKs keyed by SHA-256 of the
+    wrapped DEK blob. Entries are tracked per user so they can be flushed on
+    logout or account deletion.
+    """
+
+    def __init__(self, max_entries: int = DEK_CACHE_MAX_ENTRIES, ttl_seconds: float = DEK_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # digest -> (LockedBuffer, expires_at, user_id)
+        self._by_user = defaultdict(set)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.flushes = 0
+
+    @staticmethod
+    def cache_key(wrapped_dek: bytes) -> bytes:
+        return hashlib.sha256(wrapped_dek).digest()
+
+    def _drop(self, digest: bytes):
+        # Caller must hold self._lock.
+        buffer, _, user_id = self._entries.pop(digest)
+        buffer.wipe()
+        user_keys = self._by_user.get(user_id)
+        if user_keys is not None:
+            user_keys.discard(digest)
+            if not user_keys:
+                del self._by_user[user_id]
+
+    def get(self, wrapped_dek: bytes):
+        """Returns a bytearray copy of the cached DEK, or None on a miss."""
+        if self.max_entries <= 0:
+            return None
+        digest = self.cache_key(wrapped_dek)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            buffer, expires_at, _ = entry
+            if expires_at <= time.monotonic():
+                self._drop(digest)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return buffer.copy()
+
+    def put(self, wrapped_dek: bytes, dek: bytes, user_id=None):
+        """Stores an unwrapped DEK, evicting the least recently used entries if full."""
+        if self.max_entries <= 0:
+            return
+        digest = self.cache_key(wrapped_dek)
+        with self._lock:
+            if digest in self._entries:
+                self._drop(digest)
+            while len(self._entries) >= self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+            self._entries[digest] = (LockedBuffer(dek), time.monotonic() + self.ttl_seconds, user_id)
+            self._by_user[user_id].add(digest)
+
+    def discard(self, wrapped_dek: bytes):
+        """Zeroizes and removes a single cached DEK, if present."""
+        digest = self.cache_key(wrapped_dek)
+        with self._lock:
+            if digest in self._entries:
+                self._drop(digest)
+
+    def flush_user(self, user_id) -> int:
+        """Zeroizes and removes every cached DEK belonging to a user."""
+        with self._lock:
+            digests = list(self._by_user.get(user_id, ()))
+            for digest in digests:
+                self._drop(digest)
+            if digests:
+                self.flushes += 1
+            return len(digests)
+
+    def clear(self):
+        with self._lock:
+            for digest in list(self._entries):
+                self._drop(digest)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "user_flushes": self.flushes,
+            }
+
+# Shared process-wide cache instance
+dek_cache = DEKCache()
@@ -0,0 +1,21 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+# Bounded pool for CPU-bound AES-GCM work and any remaining blocking calls (mysqldump, file I/O)
+BLOCKING_POOL_WORKERS = int(os.getenv("BLOCKING_POOL_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_WORKERS, thread_name_prefix="vault-blocking")
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking callable on the bounded worker pool without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(func, *args, **kwargs))
+
+def shutdown_executor():
+    blocking_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import random
+import time
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+# Azure Key Vault
+AZURE_VAULT_URL = os.getenv("AZURE_VAULT_URL", "https://secure-vault-keys.vault.azure.net/")
+AZURE_KEY_NAME = os.getenv("AZURE_KEY_NAME", "master-kek")
+# Pin a key version; unset uses the latest, which can't unwrap KEKs wrapped under an earlier one
+AZURE_KEY_VERSION = os.getenv("AZURE_KEY_VERSION")
+# Local provider: "rsa-oaep" (same algorithm as Key Vault) or "aes-kw" (RFC 3394)
+LOCAL_KEK_ALGORITHM = os.getenv("LOCAL_KEK_ALGORITHM", "rsa-oaep")
+# Key file to load or create; unset keeps a random KEK in memory for the life of the process
+LOCAL_KEK_PATH = os.getenv("LOCAL_KEK_PATH")
+# Simulated round trip per wrap/unwrap, to model a remote KMS offline
+LOCAL_KMS_LATENCY_MS = float(os.getenv("LOCAL_KMS_LATENCY_MS", 0))
+LOCAL_KMS_JITTER_MS = float(os.getenv("LOCAL_KMS_JITTER_MS", 0))
+# Master KEK rotation target: the key `python -m services.key_rotation rewrap-keks` moves every
+# user KEK to. While one is set the vault wraps new KEKs under it and unwraps with either key.
+# Once the run finishes, point the settings above at the target and unset these.
+TARGET_AZURE_KEY_NAME = os.getenv("TARGET_AZURE_KEY_NAME")
+TARGET_AZURE_KEY_VERSION = os.getenv("TARGET_AZURE_KEY_VERSION")
+TARGET_LOCAL_KEK_PATH = os.getenv("TARGET_LOCAL_KEK_PATH")
+
+class KEKProvider:
+    """
+    Wraps and unwraps DEKs under a key-encryption key. Subclasses implement the
+    sync pair; the async pair defaults to the sync calls for providers that
+    don't do I/O.
+    """
+    name = "base"
+
+    def wrap(self, dek: bytes) -> bytes:
+        raise NotImplementedError
+
+    def unwrap(self, wrapped_dek: bytes) -> bytes:
+        raise NotImplementedError
+
+    async def wrap_async(self, dek: bytes) -> bytes:
+        return self.wrap(dek)
+
+    async def unwrap_async(self, wrapped_dek: bytes) -> bytes:
+        return self.unwrap(wrapped_dek)
+
+    async def aclose(self):
+        pass
+
+class AzureKeyVaultProvider(KEKProvider):
+    """RSA-OAEP wrap/unwrap with the master KEK held in Azure Key Vault."""
+    name = "azure"
+
+    def __init__(self, vault_url: str = AZURE_VAULT_URL, key_name: str = AZURE_KEY_NAME, key_version: str = AZURE_KEY_VERSION):
+        # Imported here so the local provider works without the Azure SDK installed
+        from azure.identity import DefaultAzureCredential
+        from azure.keyvault.keys import KeyClient
+        from azure.keyvault.keys.crypto import CryptographyClient, KeyWrapAlgorithm
+        from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+        from azure.keyvault.keys.crypto.aio import CryptographyClient as AsyncCryptographyClient
+
+        self.algorithm = KeyWrapAlgorithm.rsa_oaep
+        self.credential = DefaultAzureCredential()
+        key = KeyClient(vault_url=vault_url, credential=self.credential).get_key(key_name, version=key_version)
+        self.crypto_client = CryptographyClient(key, credential=self.credential)
+        # Async client for the request path, so a slow KMS call never blocks the event loop
+        self.async_credential = AsyncDefaultAzureCredential()
+        self.async_crypto_client = AsyncCryptographyClient(key, credential=self.async_credential)
+
+    def wrap(self, dek: bytes) -> bytes:
+        return self.crypto_client.wrap_key(self.algorithm, bytes(dek)).encrypted_key
+
+    def unwrap(self, wrapped_dek: bytes) -> bytes:
+        return self.crypto_client.unwrap_key(self.algorithm, wrapped_dek).key
+
+    async def wrap_async(self, dek: bytes) -> bytes:
+        return (await self.async_crypto_client.wrap_key(self.algorithm, bytes(dek))).encrypted_key
+
+    async def unwrap_async(self, wrapped_dek: bytes) -> bytes:
+        return (await self.async_crypto_client.unwrap_key(self.algorithm, wrapped_dek)).key
+
+    async def aclose(self):
+        await self.async_crypto_client.close()
+        await self.async_credential.close()
+
+class LocalKEKProvider(KEKProvider):
+    """
+    Software KMS stand-in for development and offline benchmarks. Uses an RSA-OAEP
+    or AES-KW KEK from a local file (or memory) and can add simulated latency.
+    Not for production: the KEK lives on the application host.
+    """
+    name = "local"
+
+    def __init__(self, algorithm: str = LOCAL_KEK_ALGORITHM, key_path: str = LOCAL_KEK_PATH,
+                 latency_ms: float = LOCAL_KMS_LATENCY_MS, jitter_ms: float = LOCAL_KMS_JITTER_MS):
+        if algorithm not in ("rsa-oaep", "aes-kw"):
+            raise ValueError(f"Unsupported LOCAL_KEK_ALGORITHM '{algorithm}'.")
+        self.algorithm = algorithm
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._oaep = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA1()), algorithm=hashes.SHA1(), label=None)
+        self._kek = self._load_or_create(key_path)
+
+    def _load_or_create(self, key_path: str):
+        if key_path and os.path.exists(key_path):
+            with open(key_path, "rb") as f:
+                material = f.read()
+            return serialization.load_pem_private_key(material, password=None) if self.algorithm == "rsa-oaep" else material
+        if self.algorithm == "rsa-oaep":
+            kek = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            material = kek.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+        else:
+            kek = material = os.urandom(32)
+        if key_path:
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(material)
+        return kek
+
+    def _delay(self) -> float:
+        if not self.latency_ms and not self.jitter_ms:
+            return 0.0
+        return max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+    def _wrap(self, dek: bytes) -> bytes:
+        if self.algorithm == "rsa-oaep":
+            # Same scheme as Key Vault's RSA-OAEP (SHA-1 OAEP)
+            return self._kek.public_key().encrypt(bytes(dek), self._oaep)
+        return aes_key_wrap(self._kek, bytes(dek))
+
+    def _unwrap(self, wrapped_dek: bytes) -> bytes:
+        if self.algorithm == "rsa-oaep":
+            return self._kek.decrypt(wrapped_dek, self._oaep)
+        return aes_key_unwrap(self._kek, wrapped_dek)
+
+    def wrap(self, dek: bytes) -> bytes:
+        time.sleep(self._delay())
+        return self._wrap(dek)
+
+    def unwrap(self, wrapped_dek: bytes) -> bytes:
+        time.sleep(self._delay())
+        return self._unwrap(wrapped_dek)
+
+    async def wrap_async(self, dek: bytes) -> bytes:
+        await asyncio.sleep(self._delay())
+        return self._wrap(dek)
+
+    async def unwrap_async(self, wrapped_dek: bytes) -> bytes:
+        await asyncio.sleep(self._delay())
+        return self._unwrap(wrapped_dek)
+
+class RotatingKEKProvider(KEKProvider):
+    """
+    Used while the master KEK is rotated: wraps under the new key and unwraps
+    with it, falling back to the previous key for values not re-wrapped yet.
+    """
+    name = "rotating"
+
+    def __init__(self, current: KEKProvider, previous: KEKProvider):
+        self.current = current
+        self.previous = previous
+
+    def wrap(self, dek: bytes) -> bytes:
+        return self.current.wrap(dek)
+
+    def unwrap(self, wrapped_dek: bytes) -> bytes:
+        try:
+            return self.current.unwrap(wrapped_dek)
+        except Exception:
+            return self.previous.unwrap(wrapped_dek)
+
+    async def wrap_async(self, dek: bytes) -> bytes:
+        return await self.current.wrap_async(dek)
+
+    async def unwrap_async(self, wrapped_dek: bytes) -> bytes:
+        try:
+            return await self.current.unwrap_async(wrapped_dek)
+        except Exception:
+            return await self.previous.unwrap_async(wrapped_dek)
+
+    async def aclose(self):
+        await self.current.aclose()
+        await self.previous.aclose()
+
+PROVIDERS = {
+    "azure": AzureKeyVaultProvider,
+    "local": LocalKEKProvider,
+}
+
+def create_kek_provider(name: str) -> KEKProvider:
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown KMS_PROVIDER '{name}'. Expected one of: {', '.join(sorted(PROVIDERS))}.")
+    return PROVIDERS[name]()
+
+def create_target_kek_provider(name: str):
+    """Provider for the master KEK being rotated to, or None when no rotation target is configured."""
+    if name == "azure" and (TARGET_AZURE_KEY_NAME or TARGET_AZURE_KEY_VERSION):
+        return AzureKeyVaultProvider(key_name=TARGET_AZURE_KEY_NAME or AZURE_KEY_NAME, key_version=TARGET_AZURE_KEY_VERSION)
+    if name == "local" and TARGET_LOCAL_KEK_PATH:
+        return LocalKEKProvider(key_path=TARGET_LOCAL_KEK_PATH)
+    return None
@@ -0,0 +1,94 @@
+import asyncio
+import os
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from dotenv import load_dotenv
+
+from db.session import AsyncKeySessionLocal
+from db.key_db import UserKEK, KEY_VERSION_KMS, KEY_VERSION_USER_KEK
+from utils.dek_cache import dek_cache
+from utils.key_management import wrap_dek_async, unwrap_dek_cached_async
+
+load_dotenv()
+
+# --- Configuration ---
+# Hierarchy version for newly created DEKs: 2 wraps them under the user's KEK, 1 keeps the KMS-only scheme
+KEY_HIERARCHY_VERSION = int(os.getenv("KEY_HIERARCHY_VERSION", KEY_VERSION_USER_KEK))
+USER_KEK_INDEX_MAX_ENTRIES = int(os.getenv("USER_KEK_INDEX_MAX_ENTRIES", 10000))
+KEK_LOCK_STRIPES = 64
+
+# Two-level hierarchy: KMS master KEK -> per-user KEK (one remote unwrap, then cached in
+# dek_cache under its wrapped bytes) -> DEKs wrapped locally with AES-KW (RFC 3394).
+# user_id -> wrapped KEK; the wrapped form isn't secret, so this only saves a DB round trip
+_wrapped_keks = {}
+# Striped locks so concurrent first requests for one user create a single KEK
+_kek_locks = [asyncio.Lock() for _ in range(KEK_LOCK_STRIPES)]
+
+def _remember_wrapped_kek(user_id: int, wrapped_kek: bytes):
+    if len(_wrapped_keks) >= USER_KEK_INDEX_MAX_ENTRIES:
+        _wrapped_keks.pop(next(iter(_wrapped_keks)))
+    _wrapped_keks[user_id] = wrapped_kek
+
+async def _load_or_create_wrapped_kek(user_id: int) -> bytes:
+    async with AsyncKeySessionLocal() as key_db:
+        wrapped_kek = await key_db.scalar(select(UserKEK.wrapped_kek).where(UserKEK.user_id == user_id))
+        if wrapped_kek is not None:
+            return wrapped_kek
+        kek = bytearray(os.urandom(32))
+        try:
+            wrapped_kek = await wrap_dek_async(kek)
+            key_db.add(UserKEK(user_id=user_id, wrapped_kek=wrapped_kek))
+            try:
+                await key_db.commit()
+            except IntegrityError:
+                # Another worker process created it first
+                await key_db.rollback()
+                return await key_db.scalar(select(UserKEK.wrapped_kek).where(UserKEK.user_id == user_id))
+            dek_cache.put(wrapped_kek, kek, user_id)
+            return wrapped_kek
+        finally:
+            kek[:] = bytes(len(kek))
+
+async def get_user_kek(user_id: int) -> bytearray:
+    """Returns the user's intermediate KEK (creating it on first use); the caller must overwrite it."""
+    wrapped_kek = _wrapped_keks.get(user_id)
+    if wrapped_kek is None:
+        async with _kek_locks[user_id % KEK_LOCK_STRIPES]:
+            wrapped_kek = _wrapped_keks.get(user_id)
+            if wrapped_kek is None:
+                wrapped_kek = await _load_or_create_wrapped_kek(user_id)
+                _remember_wrapped_kek(user_id, wrapped_kek)
+    return await unwrap_dek_cached_async(wrapped_kek, user_id)
+
+async def wrap_dek_for_user(dek: bytes, user_id: int):
+    """Wraps a new DEK under the configured hierarchy, returning (wrapped_dek, key_version)."""
+    if KEY_HIERARCHY_VERSION == KEY_VERSION_KMS:
+        return await wrap_dek_async(dek), KEY_VERSION_KMS
+    kek = await get_user_kek(user_id)
+    try:
+        return aes_key_wrap(kek, dek), KEY_VERSION_USER_KEK
+    finally:
+        kek[:] = bytes(len(kek))
+
+async def unwrap_field_dek(wrapped_dek: bytes, key_version: int, user_id: int) -> bytearray:
+    """
+    Unwraps a FieldKey's DEK according to its key_version, serving it from the
+    DEK cache when possible. Returns a bytearray the caller must overwrite.
+    """
+    if key_version == KEY_VERSION_KMS:
+        return await unwrap_dek_cached_async(wrapped_dek, user_id)
+    dek = dek_cache.get(wrapped_dek)
+    if dek is not None:
+        return dek
+    kek = await get_user_kek(user_id)
+    try:
+        dek = bytearray(aes_key_unwrap(kek, wrapped_dek))
+    finally:
+        kek[:] = bytes(len(kek))
+    dek_cache.put(wrapped_dek, dek, user_id)
+    return dek
+
+def forget_user_kek(user_id: int):
+    """Drops the in-process KEK index entry, e.g. after the user's KEK row is deleted."""
+    _wrapped_keks.pop(user_id, None)
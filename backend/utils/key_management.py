@@ -1,25 +1,110 @@
 import os
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.keys import KeyClient
-from azure.keyvault.keys.crypto import CryptographyClient, EncryptionAlgorithm, KeyWrapAlgorithm
+import threading
+import time
 from dotenv import load_dotenv
+from utils.dek_cache import dek_cache
+from utils.executor import run_blocking
+from utils.kek_providers import KEKProvider, RotatingKEKProvider, create_kek_provider, create_target_kek_provider
 
 load_dotenv()
-# Azure Key Vault setup
-VAULT_URL = "https://secure-vault-keys.vault.azure.net/"
-KEY_NAME = "master-kek"
+# "azure" (Key Vault) or "local" (software KEK for development and offline benchmarks)
+KMS_PROVIDER = os.getenv("KMS_PROVIDER", "azure")
+KMS_INIT_ATTEMPTS = int(os.getenv("KMS_INIT_ATTEMPTS", 3))
+KMS_INIT_BACKOFF_SECONDS = float(os.getenv("KMS_INIT_BACKOFF_SECONDS", 0.5))
+# After a failed initialisation, requests fail fast for this long instead of each retrying
+KMS_INIT_COOLDOWN_SECONDS = float(os.getenv("KMS_INIT_COOLDOWN_SECONDS", 5))
 
-credential = DefaultAzureCredential()
-key_client = KeyClient(vault_url=VAULT_URL, credential=credential)
-key = key_client.get_key(KEY_NAME)
-crypto_client = CryptographyClient(key, credential=credential)
+class KMSUnavailable(Exception):
+    """Raised when the KEK provider could not be initialised."""
+
+# The provider is created on first use (or by the startup warm-up), never at import
+_provider = None
+_provider_lock = threading.Lock()
+_last_failure = None  # (monotonic time, error message)
+
+def get_kek_provider() -> KEKProvider:
+    """Returns the KEK provider, creating it with retries and exponential backoff on first use."""
+    global _provider, _last_failure
+    if _provider is not None:
+        return _provider
+    with _provider_lock:
+        if _provider is not None:
+            return _provider
+        if _last_failure and time.monotonic() - _last_failure[0] < KMS_INIT_COOLDOWN_SECONDS:
+            raise KMSUnavailable(f"KMS initialisation failed recently: {_last_failure[1]}")
+        delay = KMS_INIT_BACKOFF_SECONDS
+        for attempt in range(1, KMS_INIT_ATTEMPTS + 1):
+            try:
+                provider = create_kek_provider(KMS_PROVIDER)
+                target = create_target_kek_provider(KMS_PROVIDER)
+                _provider = RotatingKEKProvider(target, provider) if target else provider
+                _last_failure = None
+                return _provider
+            except Exception as e:
+                print(f"WARN: KMS initialisation attempt {attempt}/{KMS_INIT_ATTEMPTS} failed: {e}")
+                error = e
+                if attempt < KMS_INIT_ATTEMPTS:
+                    time.sleep(delay)
+                    delay *= 2
+        _last_failure = (time.monotonic(), str(error))
+        raise KMSUnavailable(f"KMS initialisation failed: {error}")
+
+async def get_kek_provider_async() -> KEKProvider:
+    if _provider is not None:
+        return _provider
+    return await run_blocking(get_kek_provider)
+
+def set_kek_provider(provider: KEKProvider):
+    """Installs a provider directly, e.g. a LocalKEKProvider in benchmarks."""
+    global _provider, _last_failure
+    with _provider_lock:
+        _provider, _last_failure = provider, None
+
+def kms_status() -> dict:
+    return {
+        "provider": KMS_PROVIDER,
+        "ready": _provider is not None,
+        "master_key_rotation": isinstance(_provider, RotatingKEKProvider),
+        "last_error": _last_failure[1] if _last_failure else None,
+    }
 
 def wrap_dek_with_kms(dek: bytes) -> bytes:
-    """Wrap (encrypt) a DEK with KEK in Azure Key Vault."""
-    wrap_result = crypto_client.wrap_key(KeyWrapAlgorithm.rsa_oaep, dek)
-    return wrap_result.encrypted_key
+    """Wrap (encrypt) a DEK with the KEK."""
+    return get_kek_provider().wrap(dek)
 
 def unwrap_dek_with_kms(wrapped_dek: bytes) -> bytes:
-    """Unwrap (decrypt) a DEK with KEK in Azure Key Vault."""
-    unwrap_result = crypto_client.unwrap_key(KeyWrapAlgorithm.rsa_oaep, wrapped_dek)
-    return unwrap_result.key
+    """Unwrap (decrypt) a DEK with the KEK."""
+    return get_kek_provider().unwrap(wrapped_dek)
+
+def unwrap_dek_cached(wrapped_dek: bytes, user_id=None) -> bytearray:
+    """
+    Unwrap a DEK, serving it from the in-process DEK cache when possible.
+    Returns a bytearray the caller owns and should overwrite after use.
+    """
+    dek = dek_cache.get(wrapped_dek)
+    if dek is not None:
+        return dek
+    dek = bytearray(unwrap_dek_with_kms(wrapped_dek))
+    dek_cache.put(wrapped_dek, dek, user_id)
+    return dek
+
+async def wrap_dek_async(dek: bytes) -> bytes:
+    """Wrap (encrypt) a DEK with the KEK without blocking the event loop."""
+    return await (await get_kek_provider_async()).wrap_async(dek)
+
+async def unwrap_dek_async(wrapped_dek: bytes) -> bytes:
+    """Unwrap (decrypt) a DEK with the KEK without blocking the event loop."""
+    return await (await get_kek_provider_async()).unwrap_async(wrapped_dek)
+
+async def unwrap_dek_cached_async(wrapped_dek: bytes, user_id=None) -> bytearray:
+    """Async counterpart of unwrap_dek_cached."""
+    dek = dek_cache.get(wrapped_dek)
+    if dek is not None:
+        return dek
+    dek = bytearray(await unwrap_dek_async(wrapped_dek))
+    dek_cache.put(wrapped_dek, dek, user_id)
+    return dek
+
+async def close_async_clients():
+    if _provider is not None:
+        await _provider.aclose()
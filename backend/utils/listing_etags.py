@@ -0,0 +1,67 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+# How long a remembered listing ETag may answer If-None-Match without MySQL. Mutations in this
+# process invalidate it immediately; the TTL bounds staleness after writes handled by other workers.
+LISTING_ETAG_TTL_SECONDS = float(os.getenv("LISTING_ETAG_TTL_SECONDS", 10))
+LISTING_ETAG_MAX_ENTRIES = int(os.getenv("LISTING_ETAG_MAX_ENTRIES", 10000))
+
+def compute_etag(body: bytes) -> str:
+    """Strong validator derived from the listing content, so every worker produces the same tag."""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def listing_headers(etag: str) -> dict:
+    """Headers for both the listing and its 304, which must carry the same validator and caching rules."""
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates
+
+class ListingETagCache:
+    """Per-user ETag of the last vault listing served, so unchanged polls can be answered with a 304."""
+
+    def __init__(self, ttl_seconds: float = LISTING_ETAG_TTL_SECONDS, max_entries: int = LISTING_ETAG_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # user_id -> (etag, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            return entry[0]
+
+    def put(self, user_id, etag: str):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(user_id, None)
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            self._entries[user_id] = (etag, time.monotonic() + self.ttl_seconds)
+
+    def invalidate(self, user_id):
+        """Call after any change to a user's fields."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+# Shared process-wide cache instance
+listing_etags = ListingETagCache()
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# --- Configuration ---
+# Set to e.g. redis://localhost:6379/0 to share counters between workers
+LOCKOUT_REDIS_URL = os.getenv("LOCKOUT_REDIS_URL")
+LOCKOUT_MAX_TRACKED_KEYS = int(os.getenv("LOCKOUT_MAX_TRACKED_KEYS", 100000))
+
+class MemorySlidingWindow:
+    """Per-key sliding-window event counters held in process memory."""
+
+    def __init__(self, max_keys: int = LOCKOUT_MAX_TRACKED_KEYS):
+        self.max_keys = max_keys
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def _trim(self, events: deque, cutoff: float):
+        while events and events[0] <= cutoff:
+            events.popleft()
+
+    def _purge(self, cutoff: float):
+        # Caller must hold self._lock. Drops idle keys so an attack can't grow memory without bound.
+        for key in [key for key, events in self._events.items() if not events or events[-1] <= cutoff]:
+            del self._events[key]
+        while len(self._events) >= self.max_keys:
+            del self._events[next(iter(self._events))]
+
+    def add(self, key: str, window_seconds: float) -> int:
+        """Records an event and returns how many events fall inside the window."""
+        now = time.monotonic()
+        with self._lock:
+            events = self._events.get(key)
+            if events is None:
+                if len(self._events) >= self.max_keys:
+                    self._purge(now - window_seconds)
+                events = self._events[key] = deque()
+            events.append(now)
+            self._trim(events, now - window_seconds)
+            return len(events)
+
+    def count(self, key: str, window_seconds: float) -> int:
+        now = time.monotonic()
+        with self._lock:
+            events = self._events.get(key)
+            if not events:
+                return 0
+            self._trim(events, now - window_seconds)
+            return len(events)
+
+    def reset(self, key: str):
+        with self._lock:
+            self._events.pop(key, None)
+
+class RedisSlidingWindow:
+    """Same interface as MemorySlidingWindow, backed by one Redis sorted set per key."""
+
+    def __init__(self, url: str, prefix: str = "lockout:"):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def add(self, key: str, window_seconds: float) -> int:
+        now = time.time()
+        name = self.prefix + key
+        pipe = self.client.pipeline()
+        pipe.zadd(name, {f"{now}:{uuid.uuid4().hex[:8]}": now})
+        pipe.zremrangebyscore(name, 0, now - window_seconds)
+        pipe.zcard(name)
+        pipe.expire(name, int(window_seconds) + 1)
+        return pipe.execute()[2]
+
+    def count(self, key: str, window_seconds: float) -> int:
+        now = time.time()
+        name = self.prefix + key
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(name, 0, now - window_seconds)
+        pipe.zcard(name)
+        return pipe.execute()[1]
+
+    def reset(self, key: str):
+        self.client.delete(self.prefix + key)
+
+def create_window_store():
+    if LOCKOUT_REDIS_URL:
+        if redis is None:
+            print("WARN: LOCKOUT_REDIS_URL is set but the 'redis' package is not installed. Using in-memory counters.")
+        else:
+            return RedisSlidingWindow(LOCKOUT_REDIS_URL)
+    return MemorySlidingWindow()
+
+class LockoutEngine:
+    """Sliding-window failed-login counters per account and per client IP."""
+
+    def __init__(self, max_account_failures: int, account_window_minutes: float,
+                 max_ip_failures: int, ip_window_minutes: float, store=None):
+        self.max_account_failures = max_account_failures
+        self.account_window = account_window_minutes * 60
+        self.max_ip_failures = max_ip_failures
+        self.ip_window = ip_window_minutes * 60
+        self.store = store or create_window_store()
+
+    def is_account_locked(self, username: str) -> bool:
+        return self.store.count(f"acct:{username}", self.account_window) >= self.max_account_failures
+
+    def is_ip_blocked(self, ip_address: str) -> bool:
+        return self.store.count(f"ip:{ip_address}", self.ip_window) >= self.max_ip_failures
+
+    def record_failure(self, username: str, ip_address: str) -> int:
+        """Counts a failed login and returns the account's failures within its window."""
+        self.store.add(f"ip:{ip_address}", self.ip_window)
+        return self.store.add(f"acct:{username}", self.account_window)
+
+    def record_success(self, username: str):
+        self.store.reset(f"acct:{username}")
@@ -1,7 +1,45 @@
 import logging
+import logging.handlers
+import atexit
+import glob
 import json
-from datetime import datetime
 import os
+import queue
+import threading
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+
+from utils.audit_chain import AUDIT_HMAC_KEY, AuditChainWriter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+load_dotenv()
+
+# --- Configuration ---
+LOG_FILE = os.getenv("LOG_FILE", "app_logs.json")
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", 10000))
+# "drop" discards new records when the queue is full; "block" waits up to LOG_QUEUE_BLOCK_SECONDS first
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "drop")
+LOG_QUEUE_BLOCK_SECONDS = float(os.getenv("LOG_QUEUE_BLOCK_SECONDS", 0.05))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 256))
+LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv("LOG_FLUSH_INTERVAL_SECONDS", 0.5))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 50 * 1024 * 1024))
+LOG_ROTATE_INTERVAL_SECONDS = float(os.getenv("LOG_ROTATE_INTERVAL_SECONDS", 86400))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 10))
+# Events that are also appended to the tamper-evident hash-chained audit log
+AUDIT_CHAIN_EVENTS = {"pii_action"}
+
+_json_encoder = json.JSONEncoder(separators=(", ", ": "), default=str)
+
+def dumps_json(obj) -> str:
+    """Serializes a log object with orjson when available, else a reused JSONEncoder."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+    return _json_encoder.encode(obj)
 
 # Create a custom JSON Formatter
 class JSONFormatter(logging.Formatter):
@@ -10,28 +48,191 @@ class JSONFormatter(logging.Formatter):
             "timestamp": datetime.utcfromtimestamp(record.created).isoformat() + "Z",
             "level": record.levelname,
             "message": record.getMessage(),
-            "source_file": os.path.basename(record.pathname),
+            "source_file": record.filename,
         }
         if hasattr(record, 'extra_data'):
             log_object.update(record.extra_data)
-        return json.dumps(log_object)
+        return dumps_json(log_object)
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the request path for longer than the configured policy allows."""
+
+    def __init__(self, log_queue, policy: str = LOG_QUEUE_POLICY, block_seconds: float = LOG_QUEUE_BLOCK_SECONDS):
+        super().__init__(log_queue)
+        self.policy = policy
+        self.block_seconds = block_seconds
+        self.enqueued = 0
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            if self.policy == "block":
+                self.queue.put(record, timeout=self.block_seconds)
+            else:
+                self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+class BatchingLogWriter:
+    """
+    Background thread that drains the log queue, serializes records in batches and
+    writes each batch with a single write() call. Rotates the JSON file by size
+    and age, echoes records to the console handler and appends audit events to
+    the hash chain.
+    """
+
+    def __init__(self, log_queue, path: str, formatter: logging.Formatter, console_handler: logging.Handler = None,
+                 audit_chain: AuditChainWriter = None):
+        self.queue = log_queue
+        self.path = path
+        self.formatter = formatter
+        self.console_handler = console_handler
+        self.audit_chain = audit_chain
+        self._file = None
+        self._opened_at = 0.0
+        self._stopping = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.batches = 0
+        self.rotations = 0
+        self.write_errors = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="json-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self.audit_chain:
+            self.audit_chain.close()
+
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._opened_at = time.time()
+
+    def _should_rotate(self) -> bool:
+        if LOG_MAX_BYTES and self._file.tell() >= LOG_MAX_BYTES:
+            return True
+        return bool(LOG_ROTATE_INTERVAL_SECONDS) and time.time() - self._opened_at >= LOG_ROTATE_INTERVAL_SECONDS
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            os.replace(self.path, f"{self.path}.{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}")
+            self.rotations += 1
+            for old in sorted(glob.glob(f"{glob.escape(self.path)}.*"))[:-LOG_BACKUP_COUNT or None]:
+                os.remove(old)
+        self._open()
+
+    def _drain(self, timeout: float = LOG_FLUSH_INTERVAL_SECONDS) -> list:
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=timeout) if timeout else self.queue.get_nowait())
+            while len(batch) < LOG_BATCH_SIZE:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, batch: list):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception:
+                self.write_errors += 1
+            if self.console_handler:
+                self.console_handler.handle(record)
+            if self.audit_chain and getattr(record, 'extra_data', {}).get("event") in AUDIT_CHAIN_EVENTS:
+                self._append_audit(record)
+        if self.audit_chain:
+            try:
+                self.audit_chain.flush()
+            except OSError:
+                self.write_errors += 1
+        if not lines:
+            return
+        try:
+            if self._file is None:
+                self._open()
+            elif self._should_rotate():
+                self._rotate()
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            self.written += len(lines)
+            self.batches += 1
+        except OSError:
+            # A disk stall or failure costs log lines, never request latency
+            self.write_errors += len(lines)
+
+    def _append_audit(self, record):
+        try:
+            self.audit_chain.append({"message": record.getMessage(), **record.extra_data})
+        except OSError:
+            self.write_errors += 1
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._drain()
+            if batch:
+                self._write(batch)
+        # Flush whatever is left on shutdown
+        while batch := self._drain(timeout=0):
+            self._write(batch)
 
 # Get the main logger instance
 logger = logging.getLogger("secure_vault_logger")
 logger.setLevel(logging.INFO)
 logger.propagate = False
 
+log_writer = None
+
 # Configure handlers only if they haven't been added already
 if not logger.handlers:
-    json_file_handler = logging.FileHandler("app_logs.json")
-    json_file_handler.setFormatter(JSONFormatter())
-    
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_MAX)
+    queue_handler = BoundedQueueHandler(log_queue)
+
     console_handler = logging.StreamHandler()
     console_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     console_handler.setFormatter(console_formatter)
-    
-    logger.addHandler(json_file_handler)
-    logger.addHandler(console_handler)
+
+    audit_chain = None
+    if AUDIT_HMAC_KEY:
+        audit_chain = AuditChainWriter()
+    else:
+        print("WARN: AUDIT_HMAC_KEY is not set. The tamper-evident PII audit chain is DISABLED; "
+              "pii_action events go to the JSON log only. Set a secret AUDIT_HMAC_KEY in production.")
+    log_writer = BatchingLogWriter(log_queue, LOG_FILE, JSONFormatter(), console_handler, audit_chain)
+    log_writer.start()
+    atexit.register(log_writer.stop)
+
+    logger.addHandler(queue_handler)
+
+def get_log_stats() -> dict:
+    """Counters for the non-blocking logging pipeline."""
+    handler = next((h for h in logger.handlers if isinstance(h, BoundedQueueHandler)), None)
+    if handler is None or log_writer is None:
+        return {}
+    return {
+        "policy": handler.policy,
+        "queued": handler.queue.qsize(),
+        "enqueued": handler.enqueued,
+        "dropped": handler.dropped,
+        "written": log_writer.written,
+        "batches": log_writer.batches,
+        "rotations": log_writer.rotations,
+        "write_errors": log_writer.write_errors,
+        "audit_chain_seq": log_writer.audit_chain.seq if log_writer.audit_chain else None,
+        # Record this off-host now and then: it is what exposes a truncated audit log
+        "audit_chain_anchor": log_writer.audit_chain.anchor() if log_writer.audit_chain else None,
+    }
 
 def log_pii_action(user_id: int, username: str, category: str, field_name: str, sensitivity: str, action: str):
     """Logs metadata about PII actions, including the username."""
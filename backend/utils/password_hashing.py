@@ -0,0 +1,154 @@
+import argparse
+import asyncio
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from passlib.hash import bcrypt
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# "thread" (bcrypt releases the GIL) or "process"
+PASSWORD_HASH_POOL = os.getenv("PASSWORD_HASH_POOL", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+# Calls allowed to wait for a worker before new ones are rejected
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", PASSWORD_HASH_WORKERS * 4))
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing pool and its queue are full; callers should answer 429."""
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.using(rounds=rounds).hash(password)
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return bcrypt.verify(password, hashed_password)
+
+def hash_rounds(hashed_password: str) -> int:
+    """Reads the cost factor from a '$2b$<rounds>$...' bcrypt hash."""
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError, AttributeError):
+        return -1
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated, size-limited pool so a burst of logins can't tie
+    up the request workers. Admission is bounded: once every worker is busy and
+    the queue is full, calls fail fast with PasswordHashingBusy. Request handlers
+    use the *_async methods, which await the pool future without holding a
+    thread; the sync methods block their caller until the hash is done.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE,
+                 pool_kind: str = PASSWORD_HASH_POOL, rounds: int = BCRYPT_ROUNDS):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pool_kind = pool_kind
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self.rejected = 0
+
+    def _get_executor(self):
+        # Created lazily so importing this module never forks worker processes
+        with self._executor_lock:
+            if self._executor is None:
+                if self.pool_kind == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            return self._executor
+
+    def submit(self, fn, *args):
+        """Queues fn on the pool, returning a concurrent Future, or raises PasswordHashingBusy."""
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordHashingBusy("Password hashing pool is saturated.")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def hash(self, password: str) -> str:
+        return self.submit(_hash, password, self.rounds).result()
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        return self.submit(_verify, password, hashed_password).result()
+
+    def verify_and_update(self, password: str, hashed_password: str):
+        """
+        Verifies a password and, if the stored hash uses a different cost than
+        BCRYPT_ROUNDS, returns a replacement hash: (is_valid, new_hash_or_None).
+        """
+        if not self.verify(password, hashed_password):
+            return False, None
+        if hash_rounds(hashed_password) != self.rounds:
+            return True, self.hash(password)
+        return True, None
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self.submit(_hash, password, self.rounds))
+
+    async def verify_async(self, password: str, hashed_password: str) -> bool:
+        return await asyncio.wrap_future(self.submit(_verify, password, hashed_password))
+
+    async def verify_and_update_async(self, password: str, hashed_password: str):
+        """Async counterpart of verify_and_update."""
+        if not await self.verify_async(password, hashed_password):
+            return False, None
+        if hash_rounds(hashed_password) != self.rounds:
+            return True, await self.hash_async(password)
+        return True, None
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "pool": self.pool_kind,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "rounds": self.rounds,
+            "rejected": self.rejected,
+        }
+
+# Shared process-wide hasher
+password_hasher = PasswordHasher()
+
+def calibrate(target_ms: float, min_rounds: int = 10, max_rounds: int = 16, samples: int = 5) -> int:
+    """Returns the highest bcrypt cost whose median hash time on this host stays within target_ms."""
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            _hash("calibration-Password1!", rounds)
+            timings.append((time.perf_counter() - started) * 1000)
+        median = statistics.median(timings)
+        print(f"rounds={rounds:>2}  median={median:8.1f} ms  max={max(timings):8.1f} ms")
+        if median > target_ms:
+            break
+        chosen = rounds
+    return chosen
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick the bcrypt cost factor for a target hashing latency on this host.")
+    parser.add_argument("--target-ms", type=float, default=250.0)
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=16)
+    parser.add_argument("--samples", type=int, default=5)
+    args = parser.parse_args()
+    rounds = calibrate(args.target_ms, args.min_rounds, args.max_rounds, args.samples)
+    print(f"\nRecommended setting for a {args.target_ms:.0f} ms target:\nBCRYPT_ROUNDS={rounds}")
+    print("Existing hashes are upgraded transparently on the next successful login.")
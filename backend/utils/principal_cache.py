@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 30))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", 10000))
+
+@dataclass(frozen=True)
+class Principal:
+    """Detached snapshot of the User columns that request handlers rely on."""
+    id: int
+    name: str
+    email: str
+    role: str
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(id=user.id, name=user.name, email=user.email, role=user.role)
+
+class PrincipalCache:
+    """
+    Short-TTL LRU of authenticated principals keyed by user id, with a secondary
+    email index so either identifier can invalidate an entry.
+    """
+
+    def __init__(self, ttl_seconds: float = PRINCIPAL_CACHE_TTL_SECONDS, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # user_id -> (Principal, expires_at)
+        self._ids_by_email = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _drop(self, user_id):
+        # Caller must hold self._lock.
+        principal, _ = self._entries.pop(user_id)
+        self._ids_by_email.pop(principal.email, None)
+
+    def get(self, user_id=None, email=None):
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            if user_id is None:
+                user_id = self._ids_by_email.get(email)
+            entry = self._entries.get(user_id) if user_id is not None else None
+            if entry is None:
+                self.misses += 1
+                return None
+            principal, expires_at = entry
+            # A token's subject must still match the cached row (e.g. after an email change)
+            if expires_at <= time.monotonic() or (email is not None and principal.email != email):
+                self._drop(user_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return principal
+
+    def put(self, principal: Principal):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if principal.id in self._entries:
+                self._drop(principal.id)
+            while len(self._entries) >= self.max_entries:
+                self._drop(next(iter(self._entries)))
+            self._entries[principal.id] = (principal, time.monotonic() + self.ttl_seconds)
+            self._ids_by_email[principal.email] = principal.id
+
+    def invalidate(self, user_id=None, email=None):
+        """Drops a user's cached principal; call on deletion, lock, role change or password reset."""
+        with self._lock:
+            if user_id is None:
+                user_id = self._ids_by_email.get(email)
+            if user_id in self._entries:
+                self._drop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._ids_by_email.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "ttl_seconds": self.ttl_seconds}
+
+# Shared process-wide cache instance
+principal_cache = PrincipalCache()
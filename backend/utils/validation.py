@@ -30,7 +30,8 @@ REGEX_MAP = {
 
     # Employment & Education
     "empid": r"^[a-zA-Z0-9-]{3,20}$",
-    "workemail": r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]++$",
+    # Plain '+' (same as "email"): the possessive '++' is a syntax error before Python 3.11
+    "workemail": r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$",
     "emis": r"^[0-9]{10,20}$",
     "umis": r"^[a-zA-Z0-9]{10,20}$",
 
@@ -41,20 +42,91 @@ REGEX_MAP = {
     "emergency_contact": r"^[a-zA-Z0-9\s,.'-:+()]{10,100}$",
 }
 
+# Characters that could be used for HTML/script injection (XSS), removed with one str.translate()
+_UNSAFE_CHARS = str.maketrans("", "", "<>/&\"'`")
+_SEPARATORS = re.compile(r"[\s-]")
+
+def _normalize_phone(value: str) -> str:
+    digits = _SEPARATORS.sub("", value)
+    if digits.startswith("+"): return f"+{digits[1:3]}-{digits[3:]}"
+    elif len(digits) == 10: return f"+91-{digits}"
+    return value
+
+def _normalize_adhar(value: str) -> str:
+    digits = _SEPARATORS.sub("", value)
+    if len(digits) == 12: return f"{digits[0:4]}-{digits[4:8]}-{digits[8:12]}"
+    return value
+
+def _normalize_creditnum(value: str) -> str:
+    digits = _SEPARATORS.sub("", value)
+    if len(digits) == 16: return f"{digits[0:4]}-{digits[4:8]}-{digits[8:12]}-{digits[12:16]}"
+    return value
+
+def _normalize_pan(value: str) -> str:
+    return value.upper()
+
+_NORMALIZERS = {
+    "phone": _normalize_phone,
+    "adhar": _normalize_adhar,
+    "creditnum": _normalize_creditnum,
+    "pan": _normalize_pan,
+}
+
+class FieldRule:
+    """A field's compiled format check and canonical normalisation."""
+    __slots__ = ("field_name", "pattern", "normalizer")
+
+    def __init__(self, field_name: str, pattern: str = None):
+        self.field_name = field_name
+        self.pattern = re.compile(pattern) if pattern else None
+        self.normalizer = _NORMALIZERS.get(field_name)
+
+    def is_valid(self, sanitized_value: str) -> bool:
+        return self.pattern is None or self.pattern.match(sanitized_value) is not None
+
+    def normalize(self, value: str) -> str:
+        value = value.strip()
+        return self.normalizer(value) if self.normalizer else value
+
+# Every rule is compiled once, at import
+VALIDATORS = {field_name: FieldRule(field_name, pattern) for field_name, pattern in REGEX_MAP.items()}
+_UNCHECKED = FieldRule("")
+
 def sanitize_input(value: str) -> str:
     """
     Strips any characters that could be used for HTML/script injection (XSS).
     """
     if not isinstance(value, str):
         return ""
-    return re.sub(r'[<>/&"\'`]', '', value)
+    return value.translate(_UNSAFE_CHARS)
 
 def validate_and_sanitize(field_name: str, value: str) -> (bool, str):
     """
     Validates a given value against a predefined regex and sanitizes it.
     """
     sanitized_value = sanitize_input(value)
-    if field_name in REGEX_MAP:
-        if not re.match(REGEX_MAP[field_name], sanitized_value):
-            return (False, sanitized_value)
-    return (True, sanitized_value)
+    return (VALIDATORS.get(field_name, _UNCHECKED).is_valid(sanitized_value), sanitized_value)
+
+def normalize_pii_value(field_name: str, value: str) -> str:
+    """Brings a sanitized value into the canonical form it is stored in."""
+    return VALIDATORS.get(field_name, _UNCHECKED).normalize(value)
+
+def validate_batch(items, allowed_fields: dict = None):
+    """
+    Sanitizes, validates and normalizes (category, field_name, value) items in
+    one pass. allowed_fields optionally maps each category to its field names.
+    Returns (valid, errors): valid holds (category, field_name, normalized_value)
+    tuples and errors holds one structured dict per rejected field.
+    """
+    valid, errors = [], []
+    for category, field_name, value in items:
+        if allowed_fields is not None and field_name not in allowed_fields.get(category, ()):
+            errors.append({"category": category, "field_name": field_name, "code": "unknown_field", "detail": "Unknown field for this category."})
+            continue
+        rule = VALIDATORS.get(field_name, _UNCHECKED)
+        sanitized_value = sanitize_input(value)
+        if not rule.is_valid(sanitized_value):
+            errors.append({"category": category, "field_name": field_name, "code": "invalid_format", "detail": f"Invalid format for '{field_name}'."})
+            continue
+        valid.append((category, field_name, rule.normalize(sanitized_value)))
+    return valid, errors